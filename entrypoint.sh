@@ -26,11 +26,16 @@ sleep 5
 echo -e "${GREEN}📊 Ejecutando migraciones...${NC}"
 python manage.py makemigrations --noinput || true
 python manage.py migrate --noinput
+python manage.py createcachetable
 
 # Load maintenance types
 echo -e "${GREEN}📦 Cargando tipos de mantenimiento...${NC}"
 python manage.py load_maintenance_types || true
 
+# Estimate daily km and rebuild materialized maintenance states from them
+echo -e "${GREEN}🔁 Reconstruyendo estados de mantenimiento...${NC}"
+python manage.py estimar_kilometraje_diario || true
+
 # Create default superuser
 echo -e "${GREEN}👤 Creando superusuario por defecto...${NC}"
 python manage.py create_default_superuser || true
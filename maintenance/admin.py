@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.utils import timezone
 from .models import (
     Vehiculo, TipoMantenimiento, IntervaloMantenimiento, 
     RegistroMantenimiento, ItemMantenimiento, UserRegistrationRequest,
-    NotificacionMantenimiento
+    NotificacionMantenimiento, EstadoMantenimiento, TareaNotificacion, Concesion,
+    CorreoSaliente, CanalNotificacion, ClaveCalendario
 )
 
 
@@ -35,7 +37,10 @@ class VehiculoAdmin(admin.ModelAdmin):
     
     readonly_fields = [
         'fecha_creacion', 
-        'fecha_actualizacion'
+        'fecha_actualizacion',
+        'fecha_lectura_km',
+        'km_diarios_estimados',
+        'fecha_estimacion_km'
     ]
     
     fieldsets = (
@@ -43,7 +48,11 @@ class VehiculoAdmin(admin.ModelAdmin):
             'fields': ('tipo', 'marca', 'modelo', 'año')
         }),
         ('Detalles', {
-            'fields': ('propietario', 'matricula', 'kilometraje_actual')
+            'fields': ('propietario', 'matricula', 'kilometraje_actual', 'fecha_lectura_km')
+        }),
+        ('Uso estimado', {
+            'fields': ('km_diarios_estimados', 'fecha_estimacion_km'),
+            'classes': ('collapse',)
         }),
         ('Fechas', {
             'fields': ('fecha_creacion', 'fecha_actualizacion'),
@@ -203,23 +212,19 @@ class RegistroMantenimientoAdmin(admin.ModelAdmin):
         """Optimizar consultas con select_related"""
         return super().get_queryset(request).select_related(
             'vehiculo', 
-            'tipo_mantenimiento',
             'vehiculo__propietario'
         )
     
     def get_trabajos_realizados(self, obj):
         """Mostrar lista de trabajos realizados"""
-        trabajos = [item.tipo_mantenimiento.nombre for item in obj.items.all()]
-        if len(trabajos) > 2:
-            return f"{trabajos[0]}, {trabajos[1]} y {len(trabajos)-2} más"
-        return ", ".join(trabajos) if trabajos else "Sin ítems"
+        return obj.resumen_trabajos or "Sin ítems"
     get_trabajos_realizados.short_description = "Trabajos Realizados"
     
     def costo_total(self, obj):
         """Mostrar costo total formateado"""
         return f"€{obj.costo_total:,.2f}"
     costo_total.short_description = "Costo Total"
-    costo_total.admin_order_field = 'costo_mano_obra_total'
+    costo_total.admin_order_field = 'costo_total'
 
 
 class ItemMantenimientoInline(admin.TabularInline):
@@ -262,6 +267,49 @@ class ItemMantenimientoAdmin(admin.ModelAdmin):
     readonly_fields = ['costo_total']
 
 
+@admin.register(EstadoMantenimiento)
+class EstadoMantenimientoAdmin(admin.ModelAdmin):
+    """Consulta de los estados de mantenimiento materializados (solo lectura)"""
+    
+    list_display = [
+        'vehiculo',
+        'tipo_mantenimiento',
+        'fecha_ultimo',
+        'km_ultimo',
+        'proximo_km',
+        'km_restantes',
+        'proxima_fecha',
+        'fecha_prevista',
+        'fecha_actualizacion'
+    ]
+    
+    list_filter = [
+        'tipo_mantenimiento__categoria',
+        'vehiculo__tipo'
+    ]
+    
+    search_fields = [
+        'vehiculo__marca',
+        'vehiculo__modelo',
+        'vehiculo__propietario__username',
+        'tipo_mantenimiento__nombre'
+    ]
+    
+    def get_queryset(self, request):
+        """Optimizar consultas con select_related"""
+        return super().get_queryset(request).select_related(
+            'vehiculo', 'tipo_mantenimiento'
+        )
+    
+    def has_add_permission(self, request):
+        """Los estados se calculan automáticamente"""
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        """Los estados se calculan automáticamente"""
+        return False
+
+
 @admin.register(UserRegistrationRequest)
 class UserRegistrationRequestAdmin(admin.ModelAdmin):
     """Administración de solicitudes de registro de usuarios"""
@@ -316,25 +364,17 @@ class UserRegistrationRequestAdmin(admin.ModelAdmin):
     
     def aprobar_solicitudes(self, request, queryset):
         """Acción para aprobar solicitudes seleccionadas"""
-        aprobadas = 0
-        errores = []
-        
-        for solicitud in queryset.filter(status='pendiente'):
-            try:
-                usuario = solicitud.aprobar(request.user, "Aprobado desde el panel de administración")
-                aprobadas += 1
-                self.message_user(
-                    request, 
-                    f"Usuario '{usuario.username}' creado exitosamente.",
-                    level='success'
-                )
-            except ValueError as e:
-                errores.append(f"Error con {solicitud.username}: {str(e)}")
+        # En bloque: con cientos de solicitudes no se hace una consulta y un email por cada una
+        usuarios, errores = UserRegistrationRequest.aprobar_en_bloque(
+            queryset, request.user, "Aprobado desde el panel de administración"
+        )
         
-        if aprobadas > 0:
+        if usuarios:
             self.message_user(
                 request,
-                f"{aprobadas} solicitud(es) aprobada(s) exitosamente.",
+                f"{len(usuarios)} solicitud(es) aprobada(s) exitosamente: "
+                f"{', '.join(usuario.username for usuario in usuarios[:20])}"
+                f"{'...' if len(usuarios) > 20 else ''}",
                 level='success'
             )
         
@@ -410,6 +450,9 @@ class NotificacionMantenimientoAdmin(admin.ModelAdmin):
     
     ordering = ['-fecha_envio']
     
+    # Con millones de filas, contar toda la tabla en cada búsqueda es lo más lento del listado
+    show_full_result_count = False
+    
     def get_queryset(self, request):
         """Optimizar consultas con select_related"""
         return super().get_queryset(request).select_related(
@@ -418,4 +461,191 @@ class NotificacionMantenimientoAdmin(admin.ModelAdmin):
     
     def has_add_permission(self, request):
         """No permitir agregar notificaciones manualmente"""
-        return False
\ No newline at end of file
+        return False
+
+
+@admin.register(TareaNotificacion)
+class TareaNotificacionAdmin(admin.ModelAdmin):
+    """Consulta de la cola de verificaciones de notificaciones"""
+    
+    list_display = [
+        'id',
+        'usuario',
+        'estado',
+        'intentos',
+        'fecha_creacion',
+        'fecha_disponible',
+        'fecha_fin',
+        'trabajador'
+    ]
+    
+    list_filter = [
+        'estado',
+        'fecha_creacion'
+    ]
+    
+    search_fields = [
+        'usuario__username',
+        'usuario__email',
+        'trabajador'
+    ]
+    
+    readonly_fields = [
+        'usuario',
+        'intentos',
+        'fecha_creacion',
+        'fecha_inicio',
+        'fecha_latido',
+        'fecha_fin',
+        'trabajador',
+        'ultimo_error'
+    ]
+    
+    ordering = ['-fecha_creacion']
+    
+    def get_queryset(self, request):
+        """Optimizar consultas con select_related"""
+        return super().get_queryset(request).select_related('usuario')
+    
+    def has_add_permission(self, request):
+        """Las tareas las encola la aplicación"""
+        return False
+
+
+@admin.register(Concesion)
+class ConcesionAdmin(admin.ModelAdmin):
+    """Consulta de las concesiones entre procesos (borrar una la libera)"""
+    
+    list_display = [
+        'nombre',
+        'titular',
+        'fecha_adquisicion',
+        'expira'
+    ]
+    
+    readonly_fields = [
+        'nombre',
+        'titular',
+        'fecha_adquisicion',
+        'expira'
+    ]
+    
+    def has_add_permission(self, request):
+        """Las concesiones las crean los procesos al adquirirlas"""
+        return False
+
+
+@admin.register(CorreoSaliente)
+class CorreoSalienteAdmin(admin.ModelAdmin):
+    """Consulta de la bandeja de salida de emails"""
+    
+    list_display = [
+        'destinatario',
+        'asunto',
+        'estado',
+        'intentos',
+        'proximo_intento',
+        'fecha_creacion',
+        'fecha_envio'
+    ]
+    
+    list_filter = [
+        'estado',
+        'fecha_creacion'
+    ]
+    
+    search_fields = [
+        'destinatario',
+        'asunto',
+        'usuario__username'
+    ]
+    
+    readonly_fields = [
+        'usuario',
+        'destinatario',
+        'asunto',
+        'cuerpo_texto',
+        'cuerpo_html',
+        'intentos',
+        'ultimo_error',
+        'fecha_creacion',
+        'fecha_envio'
+    ]
+    
+    ordering = ['-fecha_creacion']
+    
+    actions = ['reintentar']
+    
+    def reintentar(self, request, queryset):
+        """Devuelve a la cola los emails fallidos o en espera"""
+        actualizados = queryset.exclude(estado='enviado').update(
+            estado='pendiente', intentos=0, proximo_intento=timezone.now()
+        )
+        self.message_user(request, f"{actualizados} email(s) vuelto(s) a encolar.", level='success')
+    
+    reintentar.short_description = "Reintentar ahora los emails seleccionados"
+    
+    def has_add_permission(self, request):
+        """Los emails los genera la aplicación"""
+        return False
+
+
+@admin.register(CanalNotificacion)
+class CanalNotificacionAdmin(admin.ModelAdmin):
+    """Canales por los que cada usuario recibe los avisos"""
+    
+    list_display = [
+        'usuario',
+        'tipo',
+        'destino',
+        'activo',
+        'fecha_creacion'
+    ]
+    
+    list_filter = [
+        'tipo',
+        'activo'
+    ]
+    
+    search_fields = [
+        'usuario__username',
+        'usuario__email',
+        'destino'
+    ]
+    
+    list_editable = ['activo']
+    
+    raw_id_fields = ['usuario']
+
+
+@admin.register(ClaveCalendario)
+class ClaveCalendarioAdmin(admin.ModelAdmin):
+    """Claves de los enlaces de calendario; renovarlas revoca los enlaces compartidos"""
+    
+    list_display = [
+        'usuario',
+        'fecha_renovacion'
+    ]
+    
+    search_fields = [
+        'usuario__username',
+        'usuario__email'
+    ]
+    
+    readonly_fields = [
+        'usuario',
+        'clave',
+        'fecha_renovacion'
+    ]
+    
+    actions = ['renovar_claves']
+    
+    def renovar_claves(self, request, queryset):
+        """Revoca los enlaces de calendario de los usuarios seleccionados"""
+        for clave in queryset:
+            ClaveCalendario.renovar(clave.usuario_id)
+        self.message_user(request, f'{queryset.count()} claves renovadas.')
+    renovar_claves.short_description = "Renovar claves (revoca los enlaces de calendario)"
+    
+    def has_add_permission(self, request):
+        return False
@@ -5,3 +5,7 @@ class MaintenanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'maintenance'
     verbose_name = 'Mantenimiento'
+
+    def ready(self):
+        # Registrar las señales que mantienen los estados de mantenimiento
+        from . import signals  # noqa: F401
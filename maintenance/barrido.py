@@ -0,0 +1,190 @@
+"""
+Barrido vectorizado de vencimientos para toda la flota.
+
+Alternativa a leer EstadoMantenimiento pensada para instalaciones grandes:
+carga en arrays de NumPy el último servicio, los intervalos efectivos y el
+kilometraje actual de todos los pares (vehículo, tipo) y calcula en bloque
+los km y fechas de vencimiento, los días restantes y la urgencia. Solo los
+pares dentro de los umbrales de aviso se convierten en objetos Vencimiento.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .catalogo import obtener_catalogo
+from .models import Vehiculo, IntervaloMantenimiento, RegistroMantenimiento
+from .vencimientos import UMBRAL_KM, UMBRAL_DIAS, Vencimiento, ultimos_items
+
+
+EPOCA = date(1970, 1, 1)
+
+# Días desde la época que representan "sin fecha"; nunca entra en una ventana
+SIN_FECHA = np.iinfo(np.int64).max
+
+
+def sumar_meses(fechas, meses):
+    """
+    Suma ``meses`` a un array datetime64[D] con la semántica de relativedelta:
+    si el día no existe en el mes de destino se usa el último día de ese mes.
+    """
+    mes = fechas.astype('datetime64[M]')
+    dia = (fechas - mes.astype('datetime64[D]')).astype(np.int64)
+    destino = mes + meses.astype('timedelta64[M]')
+    dias_mes = ((destino + 1).astype('datetime64[D]') - destino.astype('datetime64[D]')).astype(np.int64)
+    return destino.astype('datetime64[D]') + np.minimum(dia, dias_mes - 1).astype('timedelta64[D]')
+
+
+def _fecha(dias):
+    return EPOCA + timedelta(days=int(dias))
+
+
+def _buscar(claves_ordenadas, claves):
+    """Posición de cada clave en un array ordenado y si realmente está presente"""
+    posiciones = np.searchsorted(claves_ordenadas, claves)
+    posiciones = np.minimum(posiciones, max(len(claves_ordenadas) - 1, 0))
+    encontradas = claves_ordenadas[posiciones] == claves if len(claves_ordenadas) else np.zeros(len(claves), bool)
+    return posiciones, encontradas
+
+
+def barrer_flota(usuarios=None, hoy=None):
+    """
+    Devuelve los vencimientos próximos o vencidos de los vehículos de
+    ``usuarios`` (un queryset; por defecto toda la flota).
+
+    Produce los mismos resultados que ``obtener_vencimientos`` sobre estados
+    recién recalculados, pero sin depender de EstadoMantenimiento ni recorrer
+    los pares en Python.
+    """
+    hoy = hoy or date.today()
+    catalogo = obtener_catalogo()
+    tipos = catalogo.con_intervalo
+    if not tipos:
+        return []
+
+    vehiculos = Vehiculo.objects.all()
+    if usuarios is not None:
+        vehiculos = vehiculos.filter(propietario__in=usuarios)
+
+    lecturas = list(vehiculos.order_by('id').values_list(
+        'id', 'tipo', 'kilometraje_actual', 'km_diarios_estimados', 'fecha_lectura_km'
+    ))
+    if not lecturas:
+        return []
+
+    # Vehículos, ordenados por id para localizarlos con searchsorted
+    codigos_tipo_vehiculo = {tipo: codigo for codigo, (tipo, _) in enumerate(Vehiculo.TIPOS_VEHICULO)}
+    veh_ids = np.array([lectura[0] for lectura in lecturas], dtype=np.int64)
+    veh_tipo = np.array([codigos_tipo_vehiculo.get(lectura[1], -1) for lectura in lecturas], dtype=np.int64)
+    veh_km = np.array([lectura[2] for lectura in lecturas], dtype=np.int64)
+    veh_ritmo = np.array(
+        [lectura[3] or np.nan for lectura in lecturas], dtype=np.float64
+    )
+    veh_lectura = np.array(
+        [timezone.localdate(lectura[4]) for lectura in lecturas], dtype='datetime64[D]'
+    ).astype(np.int64)
+
+    # Tipos con intervalo y matriz de aplicabilidad [tipo, tipo de vehículo]
+    tipo_ids = np.array([tipo.id for tipo in tipos], dtype=np.int64)
+    orden_tipos = np.argsort(tipo_ids)
+    tipo_ids = tipo_ids[orden_tipos]
+    tipos = [tipos[i] for i in orden_tipos]
+    tipo_km = np.array([tipo.intervalo_km for tipo in tipos], dtype=np.int64)
+    tipo_meses = np.array([tipo.intervalo_meses for tipo in tipos], dtype=np.int64)
+    aplicable = np.zeros((len(tipos), len(codigos_tipo_vehiculo) + 1), dtype=bool)
+    for tipo_vehiculo, codigo in codigos_tipo_vehiculo.items():
+        aplicables = {tipo.id for tipo in catalogo.por_tipo_vehiculo.get(tipo_vehiculo, ())}
+        aplicable[:, codigo] = [tipo.id in aplicables for tipo in tipos]
+
+    # Último servicio de cada par (vehículo, tipo)
+    pares = list(ultimos_items(vehiculos.values('id'), tipo_ids.tolist()).values_list(
+        'registro__vehiculo_id', 'tipo_mantenimiento_id', 'registro_id',
+        'registro__fecha_realizacion', 'registro__kilometraje_realizacion'
+    ))
+    if not pares:
+        return []
+
+    par_vehiculo = np.array([par[0] for par in pares], dtype=np.int64)
+    par_tipo = np.array([par[1] for par in pares], dtype=np.int64)
+    par_registro = np.array([par[2] for par in pares], dtype=np.int64)
+    fecha_ultimo = np.array([par[3] for par in pares], dtype='datetime64[D]')
+    km_ultimo = np.array([par[4] for par in pares], dtype=np.int64)
+
+    iv, _ = _buscar(veh_ids, par_vehiculo)
+    it, _ = _buscar(tipo_ids, par_tipo)
+    validos = aplicable[it, veh_tipo[iv]]
+
+    # Intervalos efectivos: el personalizado, si no es 0, sustituye al del tipo
+    intervalo_km = tipo_km[it]
+    intervalo_meses = tipo_meses[it]
+    personalizados = list(IntervaloMantenimiento.objects.filter(
+        vehiculo_id__in=vehiculos.values('id')
+    ).values_list('vehiculo_id', 'tipo_mantenimiento_id', 'intervalo_km_personalizado', 'intervalo_meses_personalizado'))
+    if personalizados:
+        base = int(max(tipo_ids.max(), max(p[1] for p in personalizados))) + 1
+        claves = np.array([p[0] * base + p[1] for p in personalizados], dtype=np.int64)
+        orden = np.argsort(claves)
+        claves = claves[orden]
+        personal_km = np.array([p[2] for p in personalizados], dtype=np.int64)[orden]
+        personal_meses = np.array([p[3] for p in personalizados], dtype=np.int64)[orden]
+
+        posiciones, encontrados = _buscar(claves, par_vehiculo * base + par_tipo)
+        km = np.where(encontrados, personal_km[posiciones], 0)
+        meses = np.where(encontrados, personal_meses[posiciones], 0)
+        intervalo_km = np.where(km > 0, km, intervalo_km)
+        intervalo_meses = np.where(meses > 0, meses, intervalo_meses)
+
+    # Vencimiento por kilometraje
+    con_km = intervalo_km > 0
+    proximo_km = km_ultimo + intervalo_km
+    km_restantes = proximo_km - veh_km[iv]
+
+    # Vencimiento por tiempo
+    con_meses = intervalo_meses > 0
+    proxima_fecha = np.where(
+        con_meses, sumar_meses(fecha_ultimo, intervalo_meses).astype(np.int64), SIN_FECHA
+    )
+
+    # Fecha prevista para alcanzar los km al ritmo estimado
+    ritmo = veh_ritmo[iv]
+    lectura = veh_lectura[iv]
+    con_prevision = con_km & (ritmo > 0)
+    dias_hasta_km = np.ceil(np.divide(
+        km_restantes, ritmo, out=np.zeros(len(pares)), where=con_prevision
+    )).astype(np.int64)
+    prevista_km = np.where(con_prevision, lectura + dias_hasta_km, SIN_FECHA)
+
+    # Sin ritmo estimado, un kilometraje ya superado vence en la fecha de la lectura
+    superado = np.where(con_km & (km_restantes <= 0) & ~con_prevision, lectura, SIN_FECHA)
+    fecha_prevista = np.minimum(np.minimum(proxima_fecha, prevista_km), superado)
+
+    hoy_dias = (hoy - EPOCA).days
+    proximos = validos & (
+        (con_km & (km_restantes <= UMBRAL_KM)) |
+        (fecha_prevista <= hoy_dias + UMBRAL_DIAS)
+    )
+    seleccion = np.flatnonzero(proximos)
+    if not len(seleccion):
+        return []
+
+    # Solo los pares seleccionados se materializan como objetos
+    objetos_vehiculo = Vehiculo.objects.in_bulk(set(par_vehiculo[seleccion].tolist()))
+    objetos_registro = RegistroMantenimiento.objects.in_bulk(set(par_registro[seleccion].tolist()))
+
+    vencimientos = []
+    for i in seleccion:
+        vencimientos.append(Vencimiento(
+            vehiculo=objetos_vehiculo[int(par_vehiculo[i])],
+            tipo_mantenimiento=tipos[it[i]],
+            ultimo_registro=objetos_registro[int(par_registro[i])],
+            intervalo_km=int(intervalo_km[i]),
+            intervalo_meses=int(intervalo_meses[i]),
+            proximo_km=int(proximo_km[i]) if con_km[i] else None,
+            proxima_fecha=_fecha(proxima_fecha[i]) if con_meses[i] else None,
+            km_restantes=int(km_restantes[i]) if con_km[i] else None,
+            dias_restantes=int(proxima_fecha[i] - hoy_dias) if con_meses[i] else None,
+            fecha_prevista_km=_fecha(prevista_km[i]) if con_prevision[i] else None,
+            fecha_prevista=_fecha(fecha_prevista[i]) if fecha_prevista[i] != SIN_FECHA else None,
+            dias_previstos_km=int(prevista_km[i] - hoy_dias) if con_prevision[i] else None,
+        ))
+    return vencimientos
@@ -0,0 +1,116 @@
+"""
+Caché en dos niveles para datos derivados de cada usuario.
+
+Cada usuario tiene una versión de datos guardada en la caché compartida de
+Django. Las escrituras la renuevan con ``invalidar_usuario`` y todas las claves
+derivadas incluyen esa versión, así que invalidar no requiere borrar nada.
+Delante de la caché compartida hay una LRU en memoria del proceso que evita
+la deserialización y el viaje a la caché en las lecturas repetidas. Para que
+ese viaje no se haga igualmente al leer la versión, cada proceso recuerda la
+versión de cada usuario y solo la vuelve a comprobar cada
+WHEELER_CACHE_COMPROBACION_VERSION segundos, como el catálogo de tipos: un
+cambio hecho desde otro proceso se ve como mucho con ese retraso.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+_AUSENTE = object()
+
+
+class CacheLRU:
+    """Caché LRU en memoria, segura entre hilos y de tamaño acotado"""
+
+    def __init__(self, max_entradas=1024):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave, default=None):
+        with self._lock:
+            if clave not in self._datos:
+                return default
+            self._datos.move_to_end(clave)
+            return self._datos[clave]
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+
+lru = CacheLRU(getattr(settings, 'WHEELER_CACHE_LRU_ENTRADAS', 1024))
+
+# Versión de cada usuario ya leída por este proceso: {usuario_id: (versión, momento de la lectura)}
+versiones = CacheLRU(getattr(settings, 'WHEELER_CACHE_LRU_ENTRADAS', 1024))
+
+
+def _clave_version(usuario_id):
+    return f'wk:version_usuario:{usuario_id}'
+
+
+def _nueva_version():
+    """Las versiones son marcas de tiempo en microsegundos (sirven también como Last-Modified)"""
+    return time.time_ns() // 1000
+
+
+def version_usuario(usuario_id):
+    """Devuelve la versión actual de los datos del usuario, creándola si no existe"""
+    version = cache.get(_clave_version(usuario_id))
+    if version is None:
+        cache.add(_clave_version(usuario_id), _nueva_version(), None)
+        version = cache.get(_clave_version(usuario_id))
+    return version
+
+
+def version_reciente(usuario_id):
+    """Versión del usuario, comprobada en la caché compartida como mucho cada WHEELER_CACHE_COMPROBACION_VERSION segundos"""
+    recordada = versiones.get(usuario_id)
+    ahora = time.monotonic()
+    if recordada is not None and ahora - recordada[1] < getattr(settings, 'WHEELER_CACHE_COMPROBACION_VERSION', 2):
+        return recordada[0]
+    version = version_usuario(usuario_id)
+    versiones.set(usuario_id, (version, ahora))
+    return version
+
+
+def invalidar_usuario(usuario_id):
+    """Renueva la versión de datos del usuario, invalidando todo lo derivado de ella"""
+    version = _nueva_version()
+    cache.set(_clave_version(usuario_id), version, None)
+    # El proceso que escribe ve el cambio de inmediato
+    versiones.set(usuario_id, (version, time.monotonic()))
+
+
+def obtener_cacheado(usuario_id, nombre, calcular, timeout=None):
+    """
+    Devuelve el valor ``nombre`` del usuario para su versión de datos actual.
+
+    Busca primero en la LRU del proceso, después en la caché compartida y, si
+    no está en ninguna, lo calcula con ``calcular()`` y lo guarda en ambas. Un
+    acierto en la LRU dentro del periodo de comprobación no sale del proceso.
+    """
+    version = version_reciente(usuario_id)
+    clave = f'wk:{nombre}:{usuario_id}:{version}'
+
+    valor = lru.get(clave, _AUSENTE)
+    if valor is not _AUSENTE:
+        return valor
+
+    valor = cache.get(clave, _AUSENTE)
+    if valor is _AUSENTE:
+        valor = calcular()
+        cache.set(clave, valor, timeout)
+
+    lru.set(clave, valor)
+    return valor
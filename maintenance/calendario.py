@@ -0,0 +1,126 @@
+"""
+Feed iCalendar (.ics) con los próximos mantenimientos.
+
+Cada feed se identifica con un token firmado que contiene el usuario,
+opcionalmente un vehículo y la ClaveCalendario vigente del usuario: las
+aplicaciones de calendario pueden suscribirse sin iniciar sesión y renovar
+la clave revoca todos los enlaces anteriores. El cuerpo se genera a partir de los estados
+materializados y se cachea con la versión de datos del usuario, que también
+sirve de ETag/Last-Modified para responder 304 a los sondeos sin cambios.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core import signing
+
+from .cache import obtener_cacheado
+from .models import ClaveCalendario, EstadoMantenimiento
+
+
+SAL_TOKEN = 'maintenance.calendario'
+
+# Un día; los clientes de calendario pueden tardar en volver a pedir el feed
+TIMEOUT_FEED = 86400
+
+
+def token_calendario(usuario_id, vehiculo_id=None):
+    """Token firmado que da acceso de solo lectura al feed del usuario o de uno de sus vehículos"""
+    clave = ClaveCalendario.de_usuario(usuario_id)
+    return signing.dumps([usuario_id, vehiculo_id, clave], salt=SAL_TOKEN, compress=True)
+
+
+def leer_token(token):
+    """Devuelve (usuario_id, vehiculo_id) o None si el token no es válido o su clave se ha renovado"""
+    try:
+        usuario_id, vehiculo_id, clave = signing.loads(token, salt=SAL_TOKEN)
+    except (signing.BadSignature, TypeError, ValueError):
+        return None
+    if not ClaveCalendario.es_vigente(usuario_id, clave):
+        return None
+    return usuario_id, vehiculo_id
+
+
+def ultima_modificacion(version):
+    """Las versiones de datos de usuario son marcas de tiempo en microsegundos"""
+    return datetime.fromtimestamp(version / 1_000_000, tz=dt_timezone.utc)
+
+
+def _escapar(texto):
+    return (
+        str(texto).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+    )
+
+
+def _plegar(linea):
+    """Parte las líneas de más de 75 octetos como exige RFC 5545"""
+    codificada = linea.encode('utf-8')
+    if len(codificada) <= 75:
+        return linea
+    partes = []
+    while codificada:
+        limite = 75 if not partes else 74
+        # No cortar en mitad de un carácter multibyte
+        while limite < len(codificada) and (codificada[limite] & 0xC0) == 0x80:
+            limite -= 1
+        partes.append(codificada[:limite].decode('utf-8'))
+        codificada = codificada[limite:]
+    return '\r\n '.join(partes)
+
+
+def _evento(estado):
+    vehiculo = estado.vehiculo
+    tipo = estado.tipo_mantenimiento
+    detalles = [f'Vehículo: {vehiculo}']
+    if estado.proximo_km is not None:
+        detalles.append(f'Próximo a los {estado.proximo_km} km ({estado.km_restantes} km restantes)')
+    if estado.proxima_fecha:
+        detalles.append(f'Próximo por tiempo: {estado.proxima_fecha:%d/%m/%Y}')
+    if estado.fecha_prevista_km:
+        detalles.append(f'Previsto por kilometraje hacia el {estado.fecha_prevista_km:%d/%m/%Y}')
+    detalles.append(f'Último servicio: {estado.fecha_ultimo:%d/%m/%Y} a los {estado.km_ultimo} km')
+
+    return [
+        'BEGIN:VEVENT',
+        f'UID:mantenimiento-{vehiculo.id}-{tipo.id}@wheeler-keeper',
+        f'DTSTAMP:{estado.fecha_actualizacion.astimezone(dt_timezone.utc):%Y%m%dT%H%M%SZ}',
+        f'DTSTART;VALUE=DATE:{estado.fecha_prevista:%Y%m%d}',
+        f'DTEND;VALUE=DATE:{estado.fecha_prevista + timedelta(days=1):%Y%m%d}',
+        f'SUMMARY:{_escapar(f"{tipo.nombre} - {vehiculo}")}',
+        f'DESCRIPTION:{_escapar(chr(10).join(detalles))}',
+        f'CATEGORIES:{_escapar(tipo.get_categoria_display())}',
+        'TRANSP:TRANSPARENT',
+        'END:VEVENT',
+    ]
+
+
+def generar_ics(usuario_id, vehiculo_id=None):
+    """Genera el calendario con la fecha prevista de cada mantenimiento del usuario o del vehículo"""
+    estados = EstadoMantenimiento.objects.filter(
+        vehiculo__propietario_id=usuario_id, fecha_prevista__isnull=False
+    )
+    if vehiculo_id is not None:
+        estados = estados.filter(vehiculo_id=vehiculo_id)
+    estados = estados.select_related('vehiculo', 'tipo_mantenimiento').order_by('fecha_prevista', 'id')
+
+    lineas = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Wheeler Keeper//Mantenimientos//ES',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:Wheeler Keeper - Mantenimientos',
+    ]
+    for estado in estados:
+        lineas.extend(_evento(estado))
+    lineas.append('END:VCALENDAR')
+
+    return '\r\n'.join(_plegar(linea) for linea in lineas) + '\r\n'
+
+
+def ics_cacheado(usuario_id, vehiculo_id=None):
+    """Cuerpo del feed para la versión de datos actual del usuario"""
+    return obtener_cacheado(
+        usuario_id,
+        f'calendario:{vehiculo_id or "todos"}',
+        lambda: generar_ics(usuario_id, vehiculo_id),
+        timeout=TIMEOUT_FEED,
+    )
@@ -0,0 +1,154 @@
+"""
+Canales de entrega de los avisos de mantenimiento.
+
+Cada usuario puede tener configurados varios CanalNotificacion; sin ninguno
+recibe los avisos por email, como siempre. El email pasa por la bandeja de
+salida (``maintenance.correo``); el resto de canales acumulan los avisos de
+un lote del barrido y los entregan juntos al llamar a ``entregar()``:
+
+- ``webhook``: POST JSON a la URL configurada, agrupando los avisos de cada
+  URL en peticiones de como mucho ``tamano_lote`` y enviando las peticiones
+  en paralelo con un número máximo de hilos y un timeout por petición.
+- ``archivo``: una línea JSON (NDJSON) por aviso en un fichero dentro de
+  WHEELER_CANALES_DIRECTORIO, para integraciones que leen de disco.
+
+``entregar()`` devuelve los ids de usuario entregados y los errores, de modo
+que un aviso que no ha llegado por ningún canal no se registra y se vuelve a
+intentar en el siguiente barrido.
+"""
+import json
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+
+DIRECTORIO_ARCHIVOS = Path(getattr(
+    settings, 'WHEELER_CANALES_DIRECTORIO', Path(settings.BASE_DIR) / 'avisos'
+))
+
+
+def carga_aviso(usuario, mantenimientos_por_vehiculo):
+    """Representación JSON de los avisos de un usuario"""
+    return {
+        'usuario': {'id': usuario.id, 'username': usuario.username, 'email': usuario.email},
+        'generado': timezone.now(),
+        'vehiculos': [
+            {
+                'id': vehiculo.id,
+                'nombre': str(vehiculo),
+                'matricula': vehiculo.matricula,
+                'kilometraje_actual': vehiculo.kilometraje_actual,
+                'mantenimientos': [
+                    {
+                        'tipo_mantenimiento': item['tipo_mantenimiento'].nombre,
+                        'categoria': item['tipo_mantenimiento'].categoria,
+                        'tipo_alerta': item['tipo_alerta'],
+                        'urgencia': item['urgencia'],
+                        'mensaje': item['mensaje'],
+                        'proximo_km': item['proximo_km'],
+                        'proxima_fecha': item['proxima_fecha'],
+                        'fecha_prevista': item['fecha_prevista'],
+                    }
+                    for item in items
+                ],
+            }
+            for vehiculo, items in mantenimientos_por_vehiculo.items()
+        ],
+    }
+
+
+class CanalWebhook:
+    """Entrega los avisos por POST JSON a las URLs de los usuarios"""
+
+    def __init__(self, paralelismo=8, timeout=10, tamano_lote=50):
+        self.paralelismo = max(1, paralelismo)
+        self.timeout = timeout
+        self.tamano_lote = max(1, tamano_lote)
+        self.pendientes = defaultdict(list)
+
+    def añadir(self, usuario, destino, carga):
+        self.pendientes[destino].append((usuario.id, carga))
+
+    def _post(self, url, cargas):
+        cuerpo = json.dumps({'avisos': cargas}, cls=DjangoJSONEncoder).encode('utf-8')
+        peticion = urllib.request.Request(url, data=cuerpo, method='POST', headers={
+            'Content-Type': 'application/json',
+            'User-Agent': 'Wheeler-Keeper',
+        })
+        # urlopen lanza HTTPError con las respuestas 4xx/5xx
+        with urllib.request.urlopen(peticion, timeout=self.timeout) as respuesta:
+            respuesta.read()
+
+    def entregar(self):
+        peticiones = [
+            (url, avisos[inicio:inicio + self.tamano_lote])
+            for url, avisos in self.pendientes.items()
+            for inicio in range(0, len(avisos), self.tamano_lote)
+        ]
+        self.pendientes = defaultdict(list)
+
+        entregados, errores = set(), []
+        if not peticiones:
+            return entregados, errores
+        with ThreadPoolExecutor(max_workers=min(self.paralelismo, len(peticiones))) as ejecutor:
+            futuros = [
+                (url, avisos, ejecutor.submit(self._post, url, [carga for _, carga in avisos]))
+                for url, avisos in peticiones
+            ]
+            for url, avisos, futuro in futuros:
+                try:
+                    futuro.result()
+                except Exception as e:
+                    errores.append((url, e))
+                else:
+                    entregados.update(usuario_id for usuario_id, _ in avisos)
+        return entregados, errores
+
+
+class CanalArchivo:
+    """Añade los avisos como líneas JSON a ficheros locales"""
+
+    def __init__(self, directorio=None):
+        self.directorio = Path(directorio or DIRECTORIO_ARCHIVOS).resolve()
+        self.pendientes = defaultdict(list)
+
+    def añadir(self, usuario, destino, carga):
+        self.pendientes[destino].append((usuario.id, carga))
+
+    def ruta(self, destino):
+        """Ruta del fichero dentro del directorio de canales; no se permite salir de él"""
+        ruta = (self.directorio / destino).resolve()
+        if self.directorio not in ruta.parents:
+            raise ValueError(f'El fichero {destino} está fuera de {self.directorio}')
+        return ruta
+
+    def entregar(self):
+        entregados, errores = set(), []
+        for destino, avisos in self.pendientes.items():
+            try:
+                ruta = self.ruta(destino)
+                ruta.parent.mkdir(parents=True, exist_ok=True)
+                with open(ruta, 'a', encoding='utf-8') as fichero:
+                    fichero.writelines(
+                        json.dumps(carga, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+                        for _, carga in avisos
+                    )
+            except Exception as e:
+                errores.append((destino, e))
+            else:
+                entregados.update(usuario_id for usuario_id, _ in avisos)
+        self.pendientes = defaultdict(list)
+        return entregados, errores
+
+
+def crear_canales(paralelismo=8, timeout=10, tamano_lote=50):
+    """Canales distintos del email, por tipo de CanalNotificacion"""
+    return {
+        'webhook': CanalWebhook(paralelismo, timeout, tamano_lote),
+        'archivo': CanalArchivo(),
+    }
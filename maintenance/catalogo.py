@@ -0,0 +1,100 @@
+"""
+Catálogo en memoria de los tipos de mantenimiento.
+
+TipoMantenimiento es una tabla pequeña que casi nunca cambia pero se consulta
+en casi todas las vistas. Cada proceso guarda una instantánea inmutable,
+indexada por id, categoría y tipo de vehículo, y solo la recarga cuando cambia
+la versión del catálogo en la caché compartida (al guardar un tipo desde el
+admin o al ejecutar ``load_maintenance_types``).
+"""
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import TipoMantenimiento, Vehiculo
+
+
+CLAVE_VERSION = 'wk:catalogo_tipos_version'
+
+# Segundos entre comprobaciones de la versión en la caché compartida
+INTERVALO_COMPROBACION = getattr(settings, 'WHEELER_CATALOGO_COMPROBACION', 10)
+
+
+class CatalogoTipos:
+    """Instantánea inmutable de los tipos de mantenimiento"""
+
+    def __init__(self, tipos, version):
+        self.version = version
+        self.todos = tuple(sorted(tipos, key=lambda t: (t.categoria, t.nombre)))
+        self.activos = tuple(tipo for tipo in self.todos if tipo.activo)
+        self.con_intervalo = tuple(
+            tipo for tipo in self.activos if tipo.intervalo_km > 0 or tipo.intervalo_meses > 0
+        )
+        self.por_id = MappingProxyType({tipo.id: tipo for tipo in self.todos})
+
+        por_categoria = {}
+        for tipo in self.activos:
+            por_categoria.setdefault(tipo.categoria, []).append(tipo)
+        self.por_categoria = MappingProxyType({
+            categoria: tuple(tipos_categoria) for categoria, tipos_categoria in por_categoria.items()
+        })
+
+        self.por_tipo_vehiculo = MappingProxyType({
+            tipo_vehiculo: tuple(
+                tipo for tipo in self.activos if tipo.vehiculos_aplicables in ('todos', tipo_vehiculo)
+            )
+            for tipo_vehiculo, _ in Vehiculo.TIPOS_VEHICULO
+        })
+
+    def get(self, tipo_id):
+        """Devuelve el tipo con ese id o None"""
+        try:
+            return self.por_id.get(int(tipo_id))
+        except (TypeError, ValueError):
+            return None
+
+    def aplicables(self, vehiculo=None):
+        """Tipos activos aplicables al vehículo (o todos los activos si no se indica)"""
+        if vehiculo is None:
+            return self.activos
+        return self.por_tipo_vehiculo.get(vehiculo.tipo, ())
+
+
+_catalogo = None
+_comprobado_en = 0.0
+_lock = threading.Lock()
+
+
+def _version_actual():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        cache.add(CLAVE_VERSION, time.time_ns(), None)
+        version = cache.get(CLAVE_VERSION)
+    return version
+
+
+def obtener_catalogo():
+    """Devuelve la instantánea vigente, recargándola si la versión ha cambiado"""
+    global _catalogo, _comprobado_en
+
+    catalogo = _catalogo
+    if catalogo is not None and time.monotonic() - _comprobado_en < INTERVALO_COMPROBACION:
+        return catalogo
+
+    with _lock:
+        version = _version_actual()
+        if _catalogo is None or _catalogo.version != version:
+            _catalogo = CatalogoTipos(list(TipoMantenimiento.objects.all()), version)
+        _comprobado_en = time.monotonic()
+        return _catalogo
+
+
+def invalidar_catalogo():
+    """Publica una nueva versión del catálogo; cada proceso lo recargará en su próxima comprobación"""
+    global _comprobado_en
+    cache.set(CLAVE_VERSION, time.time_ns(), None)
+    # El proceso que escribe ve el cambio de inmediato
+    _comprobado_en = 0.0
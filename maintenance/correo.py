@@ -0,0 +1,265 @@
+"""
+Bandeja de salida de emails.
+
+Los emails se guardan ya renderizados en CorreoSaliente antes de enviarse
+(los transaccionales, con encolar_correo al confirmar la transacción),
+así que un fallo del servidor SMTP no los pierde: quedan pendientes con su
+próximo intento y ``procesar_correos_salientes`` los reintenta con espera
+exponencial, sin volver a calcular los vencimientos que los generaron.
+
+Un envío reclamado aplaza su ``proximo_intento`` durante RESERVA; si el
+proceso muere a mitad, otro trabajador lo recoge cuando la reserva caduca.
+
+Para días de mucho volumen, ``sesiones`` > 1 envía por varias conexiones
+SMTP simultáneas, cada una en su hilo: el envío está limitado por la latencia
+de red, así que solapar sesiones multiplica el ritmo de entrega.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CorreoSaliente, NotificacionMantenimiento
+
+
+# Tiempo durante el que un email reclamado no lo coge ningún otro trabajador
+RESERVA = timedelta(minutes=10)
+
+# Intentos antes de dar un email por fallido (con 8, el último es unas 4 horas después del primero)
+MAX_INTENTOS = getattr(settings, 'WHEELER_CORREO_MAX_INTENTOS', 8)
+
+# Conexiones SMTP simultáneas por envío (1 = una sola conexión, en serie)
+SESIONES_SMTP = getattr(settings, 'WHEELER_EMAIL_SESIONES_SMTP', 1)
+
+
+def espera_reintento(intentos):
+    """Espera exponencial tras el intento número ``intentos``: 1, 2, 4... minutos"""
+    return timedelta(minutes=2 ** (intentos - 1))
+
+
+def crear_correos(mensajes, usuarios=None):
+    """
+    Guarda en la bandeja de salida una lista de EmailMultiAlternatives y
+    devuelve los CorreoSaliente creados, ya reservados para quien los envíe
+    a continuación. ``usuarios`` asocia cada mensaje a su usuario.
+    """
+    reservado_hasta = timezone.now() + RESERVA
+    usuarios = usuarios or [None] * len(mensajes)
+    return CorreoSaliente.objects.bulk_create([
+        CorreoSaliente(
+            usuario=usuario,
+            destinatario=mensaje.to[0],
+            asunto=mensaje.subject,
+            cuerpo_texto=mensaje.body,
+            cuerpo_html=next((contenido for contenido, tipo in mensaje.alternatives if tipo == 'text/html'), ''),
+            proximo_intento=reservado_hasta,
+        )
+        for mensaje, usuario in zip(mensajes, usuarios)
+    ])
+
+
+def encolar_correo(destinatario, asunto, cuerpo_texto, cuerpo_html='', usuario=None):
+    """
+    Añade un email a la bandeja de salida cuando se confirme la transacción
+    en curso; lo entrega el trabajador procesar_correos_salientes.
+
+    La petición no espera al servidor SMTP, y si la transacción se revierte
+    no se envía nada. Un fallo al encolar se registra en el log en lugar de
+    romper una operación ya confirmada.
+    """
+    encolar_correos([(destinatario, asunto, cuerpo_texto, cuerpo_html, usuario)])
+
+
+def encolar_correos(correos):
+    """
+    Versión en bloque de encolar_correo: cada email es una tupla
+    (destinatario, asunto, cuerpo_texto, cuerpo_html, usuario) y se guardan
+    todos con un único INSERT al confirmar la transacción.
+    """
+    transaction.on_commit(lambda: CorreoSaliente.objects.bulk_create([
+        CorreoSaliente(
+            usuario=usuario,
+            destinatario=destinatario,
+            asunto=asunto,
+            cuerpo_texto=cuerpo_texto,
+            cuerpo_html=cuerpo_html,
+        )
+        for destinatario, asunto, cuerpo_texto, cuerpo_html, usuario in correos
+    ], batch_size=500), robust=True)
+
+
+def reclamar(cantidad):
+    """
+    Reserva hasta ``cantidad`` emails pendientes cuyo intento ha llegado.
+
+    SKIP LOCKED permite que varios trabajadores reclamen a la vez sin
+    bloquearse ni repartirse el mismo email.
+    """
+    ahora = timezone.now()
+    with transaction.atomic():
+        correos = list(
+            CorreoSaliente.objects.select_for_update(skip_locked=True)
+            .filter(estado='pendiente', proximo_intento__lte=ahora)
+            .order_by('proximo_intento', 'id')[:cantidad]
+        )
+        for correo in correos:
+            correo.proximo_intento = ahora + RESERVA
+        CorreoSaliente.objects.bulk_update(correos, ['proximo_intento'])
+    return correos
+
+
+def construir_mensaje(correo):
+    mensaje = EmailMultiAlternatives(
+        subject=correo.asunto,
+        body=correo.cuerpo_texto,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[correo.destinatario],
+    )
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, 'text/html')
+    return mensaje
+
+
+class Limitador:
+    """Reparte turnos de envío para no superar ``max_por_segundo`` (0 = sin límite)"""
+
+    def __init__(self, max_por_segundo=0):
+        self.intervalo = 1 / max_por_segundo if max_por_segundo > 0 else 0
+        self.siguiente = 0
+        self._lock = threading.Lock()
+
+    def reservar(self):
+        """Reserva el siguiente turno y devuelve los segundos que faltan para él"""
+        if not self.intervalo:
+            return 0
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self.siguiente)
+            self.siguiente = turno + self.intervalo
+        return turno - ahora
+
+
+def _abrir(conexion):
+    try:
+        # Sin conexión abierta, send_messages abriría y cerraría una por email
+        conexion.open()
+    except Exception:
+        # Se reintentará al enviar el primer email
+        pass
+
+
+def _cerrar(conexion):
+    try:
+        conexion.close()
+    except Exception:
+        # Los resultados ya están anotados en cada correo; un QUIT fallido no los cambia
+        pass
+
+
+def _entregar(conexion, correo, max_intentos):
+    """
+    Envía un email por la conexión y anota el resultado en el propio correo.
+    Devuelve el error o None si se ha enviado.
+
+    Si el envío falla se reabre la conexión y se reintenta una vez en el
+    momento; si vuelve a fallar, el email queda pendiente con espera
+    exponencial hasta agotar ``max_intentos``.
+    """
+    correo.intentos += 1
+    mensaje = construir_mensaje(correo)
+    try:
+        try:
+            conexion.send_messages([mensaje])
+        except Exception:
+            # Conexión caída o rechazada por el servidor: reconectar y reintentar
+            conexion.close()
+            conexion.open()
+            conexion.send_messages([mensaje])
+    except Exception as e:
+        correo.ultimo_error = str(e)
+        if correo.intentos >= max_intentos:
+            correo.estado = 'error'
+        else:
+            correo.proximo_intento = timezone.now() + espera_reintento(correo.intentos)
+        return e
+    correo.estado = 'enviado'
+    correo.fecha_envio = timezone.now()
+    correo.ultimo_error = ''
+    return None
+
+
+def _enviar_concurrente(correos, sesiones, limitador, max_intentos):
+    """
+    Reparte los emails entre ``sesiones`` conexiones SMTP abiertas a la vez.
+
+    Cada sesión es un hilo con su propia conexión, que reutiliza para todos
+    los emails que toma de la cola común. smtplib es bloqueante, así que las
+    esperas de red de unas sesiones se solapan con las de otras; un fallo en
+    una conexión sólo afecta al email que se estaba enviando por ella.
+    """
+    cola = queue.SimpleQueue()
+    for correo in correos:
+        cola.put(correo)
+    fallidos = []
+
+    def sesion():
+        conexion = get_connection(fail_silently=False)
+        _abrir(conexion)
+        try:
+            while True:
+                try:
+                    correo = cola.get_nowait()
+                except queue.Empty:
+                    return
+                time.sleep(limitador.reservar())
+                error = _entregar(conexion, correo, max_intentos)
+                if error is not None:
+                    fallidos.append((correo, error))
+        finally:
+            _cerrar(conexion)
+
+    with ThreadPoolExecutor(max_workers=sesiones) as ejecutor:
+        for futuro in [ejecutor.submit(sesion) for _ in range(sesiones)]:
+            futuro.result()
+    return fallidos
+
+
+def enviar_correos(correos, conexion=None, max_por_segundo=0, max_intentos=MAX_INTENTOS, sesiones=1):
+    """
+    Envía los emails reservados y guarda el resultado de cada uno. Devuelve
+    la lista de (correo, error) fallidos.
+
+    Con una sesión se usa una única conexión SMTP (``conexion`` si se pasa);
+    con más, se abren ``sesiones`` conexiones que envían en paralelo.
+    """
+    limitador = Limitador(max_por_segundo)
+    sesiones = min(max(sesiones, 1), len(correos))
+
+    if sesiones > 1:
+        fallidos = _enviar_concurrente(correos, sesiones, limitador, max_intentos)
+    else:
+        propia = conexion is None
+        conexion = conexion or get_connection(fail_silently=False)
+        _abrir(conexion)
+        fallidos = []
+        for correo in correos:
+            time.sleep(limitador.reservar())
+            error = _entregar(conexion, correo, max_intentos)
+            if error is not None:
+                fallidos.append((correo, error))
+        if propia:
+            _cerrar(conexion)
+
+    CorreoSaliente.objects.bulk_update(
+        correos, ['estado', 'intentos', 'proximo_intento', 'ultimo_error', 'fecha_envio']
+    )
+    enviados = [correo.id for correo in correos if correo.estado == 'enviado']
+    if enviados:
+        NotificacionMantenimiento.objects.filter(correo_id__in=enviados).update(email_enviado=True)
+    return fallidos
@@ -4,6 +4,7 @@ from django.db import models
 from django.utils.safestring import mark_safe
 from itertools import groupby
 from .models import Vehiculo, TipoMantenimiento, RegistroMantenimiento, ItemMantenimiento
+from .catalogo import obtener_catalogo
 
 
 def tipo_mantenimiento_categoria_choices(vehiculo=None, include_empty=True):
@@ -15,12 +16,8 @@ def tipo_mantenimiento_categoria_choices(vehiculo=None, include_empty=True):
     def tipo_name(t):
         return "%s" % (t.nombre)
 
-    tipos = TipoMantenimiento.objects.filter(activo=True).select_related().order_by("categoria", "nombre")
-
-    if vehiculo:
-        tipos = tipos.filter(
-            models.Q(vehiculos_aplicables='todos') | models.Q(vehiculos_aplicables=vehiculo.tipo)
-        )
+    # El catálogo ya viene ordenado por categoría y nombre
+    tipos = obtener_catalogo().aplicables(vehiculo)
 
     choices = [(categoria, list(tipos_cat)) for (categoria, tipos_cat) in groupby(tipos, key=categoria_display)]
     choices = [(categoria, [(t.id, tipo_name(t)) for t in tipos_cat]) for (categoria, tipos_cat) in choices]
@@ -86,6 +83,19 @@ class TipoMantenimientoModelChoiceField(forms.ModelChoiceField):
         self.queryset = queryset
         self.update_choices()
 
+    def to_python(self, value):
+        """Resuelve la opción elegida contra el catálogo en memoria en lugar de consultar la base de datos"""
+        if value in self.empty_values:
+            return None
+        tipo = obtener_catalogo().get(value)
+        if tipo is None or tipo not in obtener_catalogo().aplicables(self.vehiculo):
+            raise forms.ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return tipo
+
 
 class VehiculoForm(forms.ModelForm):
     """Formulario para crear y editar vehículos"""
@@ -0,0 +1,157 @@
+"""
+Analítica de gastos de mantenimiento de un usuario.
+
+Todas las cifras salen de agregados agrupados en SQL sobre los totales
+guardados en cada RegistroMantenimiento (ver ``actualizar_totales``) y, para
+el reparto por categoría, sobre sus ítems, de modo que el coste no crece con
+los registros leídos en Python. El resultado se
+cachea por usuario y versión de datos: cualquier cambio en sus mantenimientos
+renueva la versión y la siguiente visita lo vuelve a calcular.
+"""
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Case, Count, DecimalField, F, FloatField, Min, Q, Sum, When
+from django.db.models.functions import Cast, TruncMonth
+
+from .cache import obtener_cacheado
+from .models import ItemMantenimiento, RegistroMantenimiento, TipoMantenimiento, Vehiculo
+
+
+# Periodos disponibles en meses (0 = todo el historial)
+PERIODOS = [12, 24, 36, 0]
+PERIODO_POR_DEFECTO = 12
+
+
+def inicio_periodo(meses, hoy=None):
+    """Primer día del periodo de ``meses`` meses que termina en el mes actual, o None para todo el historial"""
+    if not meses:
+        return None
+    hoy = hoy or date.today()
+    return hoy.replace(day=1) - relativedelta(months=meses - 1)
+
+
+def nombre_categoria(categoria):
+    """
+    Nombre visible de la categoría guardada en un tipo de mantenimiento.
+
+    Acepta la clave de CATEGORIA_CHOICES, su nombre visible y la clave con
+    mayúscula inicial que guarda load_maintenance_types ("Transmision"). Lo
+    que no corresponde a ninguna se muestra aparte, sin mezclarlo con "Otros".
+    """
+    nombres = dict(TipoMantenimiento.CATEGORIA_CHOICES)
+    if not categoria:
+        return 'Sin categoría'
+    if categoria.lower() in nombres:
+        return nombres[categoria.lower()]
+    if categoria in nombres.values():
+        return categoria
+    return f'{categoria} (categoría no reconocida)'
+
+
+def _totales(prefijo='', filtro=None):
+    """Agregados de coste comunes a todas las agrupaciones"""
+    return {
+        'total': Sum(f'{prefijo}costo_total', filter=filtro),
+        'materiales': Sum(f'{prefijo}costo_materiales_total', filter=filtro),
+        'mano_obra': Sum(f'{prefijo}costo_mano_obra_total', filter=filtro),
+        'iva': Sum(f'{prefijo}costo_iva', filter=filtro),
+        'servicios': Count(f'{prefijo}id', filter=filtro),
+    }
+
+
+def calcular_gastos(usuario_id, vehiculo_id=None, desde=None):
+    """
+    Gasto del usuario desde ``desde``: totales, por mes, por categoría y por
+    vehículo (con el coste por km). Son cuatro consultas agregadas.
+
+    El reparto por categoría suma las piezas de cada ítem según la categoría
+    de su tipo de mantenimiento; la mano de obra y el IVA son del registro
+    entero y van en filas propias, así que todas las filas suman el total.
+    """
+    registros = RegistroMantenimiento.objects.filter(vehiculo__propietario_id=usuario_id)
+    vehiculos = Vehiculo.objects.filter(propietario_id=usuario_id)
+    if vehiculo_id:
+        registros = registros.filter(vehiculo_id=vehiculo_id)
+        vehiculos = vehiculos.filter(id=vehiculo_id)
+    filtro_vehiculo = None
+    if desde:
+        registros = registros.filter(fecha_realizacion__gte=desde)
+        filtro_vehiculo = Q(mantenimientos__fecha_realizacion__gte=desde)
+
+    resumen = registros.aggregate(**_totales())
+
+    por_mes = list(
+        registros.annotate(mes=TruncMonth('fecha_realizacion'))
+        .values('mes').annotate(**_totales()).order_by('mes')
+    )
+
+    materiales_por_categoria = (
+        ItemMantenimiento.objects.filter(registro__in=registros)
+        .values('tipo_mantenimiento__categoria')
+        .annotate(
+            total=Sum(
+                F('cantidad') * F('costo_unitario'),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        .order_by()
+    )
+    # Claves y nombres distintos de una misma categoría se juntan en una fila
+    categorias = {}
+    for fila in materiales_por_categoria:
+        nombre = nombre_categoria(fila['tipo_mantenimiento__categoria'])
+        categorias[nombre] = categorias.get(nombre, 0) + (fila['total'] or 0)
+    por_categoria = [
+        {'nombre': nombre, 'total': total}
+        for nombre, total in sorted(categorias.items(), key=lambda par: par[1], reverse=True)
+    ]
+    por_categoria += [
+        {'nombre': nombre, 'total': resumen[clave], 'del_registro': True}
+        for nombre, clave in [('Mano de obra', 'mano_obra'), ('IVA añadido', 'iva')]
+        if resumen[clave]
+    ]
+
+    # Coste por km: gasto del periodo entre los km recorridos desde su primer mantenimiento
+    por_vehiculo = list(
+        vehiculos.annotate(
+            **_totales('mantenimientos__', filtro_vehiculo),
+            km_inicial=Min('mantenimientos__kilometraje_realizacion', filter=filtro_vehiculo),
+        ).annotate(
+            km_recorridos=F('kilometraje_actual') - F('km_inicial'),
+        ).annotate(
+            coste_km=Case(
+                When(km_recorridos__gt=0, then=Cast('total', FloatField()) / F('km_recorridos')),
+                output_field=FloatField(),
+            ),
+        ).values(
+            'id', 'marca', 'modelo', 'matricula', 'kilometraje_actual', 'km_recorridos', 'coste_km',
+            *_totales(),
+        ).order_by(F('total').desc(nulls_last=True), 'marca', 'modelo')
+    )
+
+    # Proporciones para las barras de la plantilla, sobre filas ya agregadas
+    total = resumen['total'] or 0
+    maximo_mes = max((fila['total'] or 0 for fila in por_mes), default=0)
+    for fila in por_mes:
+        fila['porcentaje'] = round((fila['total'] or 0) * 100 / maximo_mes) if maximo_mes else 0
+    for fila in por_categoria:
+        fila['porcentaje'] = round((fila['total'] or 0) * 100 / total) if total else 0
+
+    return {
+        'resumen': resumen,
+        'por_mes': por_mes,
+        'por_categoria': por_categoria,
+        'por_vehiculo': por_vehiculo,
+    }
+
+
+def gastos_usuario(usuario_id, vehiculo_id=None, meses=PERIODO_POR_DEFECTO):
+    """Gastos del usuario en los últimos ``meses`` meses, cacheados por versión de sus datos"""
+    desde = inicio_periodo(meses)
+    return obtener_cacheado(
+        usuario_id,
+        f'gastos:{vehiculo_id or 0}:{desde.isoformat() if desde else "todo"}',
+        lambda: calcular_gastos(usuario_id, vehiculo_id, desde),
+        timeout=86400,
+    )
@@ -1,17 +1,44 @@
-from django.core.management.base import BaseCommand
-from django.core.mail import send_mail
+from django.core.management.base import BaseCommand, CommandError
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connections
+from django.db.models import Max, Min, Q
+from concurrent.futures import ProcessPoolExecutor
 from datetime import date
-from dateutil.relativedelta import relativedelta
+import time
 
-from maintenance.models import (
-    Vehiculo, TipoMantenimiento, IntervaloMantenimiento, 
-    RegistroMantenimiento, NotificacionMantenimiento
-)
+import django
+
+from maintenance.models import Vehiculo, NotificacionMantenimiento, CanalNotificacion
+from maintenance.canales import carga_aviso, crear_canales
+from maintenance.correo import SESIONES_SMTP, crear_correos, enviar_correos
+from maintenance.vencimientos import obtener_vencimientos
+from maintenance.barrido import barrer_flota
+
+
+def _inicializar_proceso():
+    """Prepara Django en cada proceso del pool; las conexiones heredadas no se reutilizan"""
+    django.setup()
+    connections.close_all()
+
+
+def _procesar_rango(desde, hasta, opciones):
+    """Procesa en un proceso del pool los usuarios con id en [desde, hasta)"""
+    comando = Command()
+    try:
+        usuarios = comando.usuarios_destino(opciones).filter(id__gte=desde, id__lt=hasta)
+        return comando.procesar_usuarios(usuarios, opciones)
+    finally:
+        connections.close_all()
+
+
+def _dividir_rango(desde, hasta, partes):
+    """Divide [desde, hasta) en ``partes`` rangos consecutivos de ids"""
+    limites = [desde + (hasta - desde) * i // partes for i in range(partes + 1)]
+    return [(inicio, fin) for inicio, fin in zip(limites, limites[1:]) if fin > inicio]
 
 
 class Command(BaseCommand):
@@ -38,166 +65,299 @@ class Command(BaseCommand):
             action='store_true',
             help='Modo silencioso: no mostrar output (para middleware)',
         )
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=getattr(settings, 'WHEELER_EMAIL_TAMANO_LOTE', 100),
+            help='Emails enviados por cada lote sobre la misma conexión SMTP (por defecto 100)',
+        )
+        parser.add_argument(
+            '--max-por-segundo',
+            type=float,
+            default=getattr(settings, 'WHEELER_EMAIL_MAX_POR_SEGUNDO', 0),
+            help='Límite de emails por segundo (0 = sin límite)',
+        )
+        parser.add_argument(
+            '--sesiones-smtp',
+            type=int,
+            default=SESIONES_SMTP,
+            help='Conexiones SMTP simultáneas para enviar cada lote (por defecto 1, en serie)',
+        )
+        parser.add_argument(
+            '--shard',
+            type=str,
+            help='Procesar solo la parte i de n del rango de ids de usuario, con formato i/n (i empieza en 0)',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Procesos en paralelo; cada uno recibe rangos de ids de usuario (por defecto 1)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Usuarios leídos de la base de datos por bloque (por defecto 500)',
+        )
+        parser.add_argument(
+            '--webhook-paralelismo',
+            type=int,
+            default=getattr(settings, 'WHEELER_WEBHOOK_PARALELISMO', 8),
+            help='Peticiones de webhook simultáneas como máximo (por defecto 8)',
+        )
+        parser.add_argument(
+            '--webhook-timeout',
+            type=float,
+            default=getattr(settings, 'WHEELER_WEBHOOK_TIMEOUT', 10),
+            help='Segundos de espera máximos por petición de webhook (por defecto 10)',
+        )
+        parser.add_argument(
+            '--engine',
+            choices=['estados', 'vectorized'],
+            default='estados',
+            help=(
+                'Cálculo de vencimientos: "estados" lee los estados materializados de cada usuario; '
+                '"vectorized" recalcula con NumPy cada bloque de --chunk-size usuarios (instalaciones grandes)'
+            ),
+        )
 
     def handle(self, *args, **options):
         test_mode = options['test_mode']
         target_user_email = options.get('user_email')
-        target_user_id = options.get('usuario_id')
         silencioso = options.get('silencioso', False)
         
         if not silencioso:
             self.stdout.write(self.style.SUCCESS('🚗 Iniciando verificación de mantenimientos próximos...'))
         
-        # Filtrar usuarios
-        if target_user_id:
-            usuarios = User.objects.filter(id=target_user_id)
-        elif target_user_email:
-            usuarios = User.objects.filter(email=target_user_email)
-            if not usuarios.exists():
-                if not silencioso:
-                    self.stdout.write(self.style.ERROR(f'No se encontró usuario con email: {target_user_email}'))
-                return
+        usuarios = self.usuarios_destino(options)
+        if target_user_email and not usuarios.exists():
+            if not silencioso:
+                self.stdout.write(self.style.ERROR(f'No se encontró usuario con email: {target_user_email}'))
+            return
+        
+        # Rango de ids de usuario que corresponde a este shard
+        limites = usuarios.aggregate(desde=Min('id'), hasta=Max('id'))
+        if limites['desde'] is None:
+            rango = None
         else:
-            usuarios = User.objects.filter(email__isnull=False).exclude(email='')
+            rango = (limites['desde'], limites['hasta'] + 1)
+            if options.get('shard'):
+                indice, total = self.leer_shard(options['shard'])
+                rangos = _dividir_rango(*rango, total)
+                rango = rangos[indice] if indice < len(rangos) else None
+        
+        workers = max(1, options.get('workers', 1))
+        if rango is None:
+            total_notificaciones = 0
+        elif workers == 1:
+            desde, hasta = rango
+            total_notificaciones = self.procesar_usuarios(usuarios.filter(id__gte=desde, id__lt=hasta), options)
+        else:
+            # Más rangos que procesos para repartir mejor la carga entre ellos
+            rangos = _dividir_rango(*rango, workers * 4)
+            # Los flujos de salida no se pueden enviar a otro proceso
+            opciones = {clave: valor for clave, valor in options.items() if clave not in ('stdout', 'stderr')}
+            # Los procesos hijos no deben heredar conexiones abiertas
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_proceso) as pool:
+                resultados = pool.map(
+                    _procesar_rango,
+                    [desde for desde, _ in rangos],
+                    [hasta for _, hasta in rangos],
+                    [opciones] * len(rangos),
+                )
+                total_notificaciones = sum(resultados)
         
+        if not silencioso:
+            if test_mode:
+                self.stdout.write(self.style.WARNING(f'🧪 Modo prueba completado. Se habrían enviado {total_notificaciones} notificaciones.'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'✅ Proceso completado. Se enviaron {total_notificaciones} notificaciones.'))
+
+    def leer_shard(self, shard):
+        """Convierte 'i/n' en (i, n) validando el formato"""
+        try:
+            indice, total = (int(parte) for parte in shard.split('/'))
+        except ValueError:
+            raise CommandError('--shard debe tener el formato i/n, por ejemplo 0/4')
+        if total < 1 or not 0 <= indice < total:
+            raise CommandError('--shard i/n requiere 0 <= i < n')
+        return indice, total
+
+    def usuarios_destino(self, options):
+        """Usuarios a los que se dirige esta ejecución"""
+        if options.get('usuario_id'):
+            return User.objects.filter(id=options['usuario_id'])
+        if options.get('user_email'):
+            return User.objects.filter(email=options['user_email'])
+        # Con email o con algún canal que no lo necesita
+        return User.objects.filter(
+            (Q(email__isnull=False) & ~Q(email='')) |
+            Q(id__in=CanalNotificacion.objects.filter(activo=True).exclude(tipo='email').values('usuario_id'))
+        )
+
+    def procesar_usuarios(self, usuarios, options):
+        """
+        Calcula y envía las notificaciones de ``usuarios``. Devuelve cuántas se
+        enviaron (o se habrían enviado en modo prueba).
+        
+        Los usuarios se leen por bloques con iterator(), así que la memoria no
+        crece con su número.
+        """
+        test_mode = options['test_mode']
+        silencioso = options.get('silencioso', False)
         total_notificaciones = 0
         
-        for usuario in usuarios:
-            mantenimientos_proximos = self.obtener_mantenimientos_proximos(usuario)
+        # Los emails se envían por lotes reutilizando una única conexión SMTP
+        tamano_lote = max(1, options['tamano_lote'])
+        self.max_por_segundo = options['max_por_segundo']
+        self.sesiones_smtp = options['sesiones_smtp']
+        lote = []
+        conexion = None if test_mode else get_connection(fail_silently=False)
+        
+        # Webhooks y ficheros: se entregan juntos cada vez que se envía un lote de emails
+        self.canales = crear_canales(options['webhook_paralelismo'], options['webhook_timeout'], tamano_lote)
+        self.sin_email = []
+        
+        tamano_bloque = options['chunk_size']
+        for bloque in self.por_bloques(usuarios.order_by('id').iterator(chunk_size=tamano_bloque), tamano_bloque):
+            usuario_ids = [usuario.id for usuario in bloque]
+            # Una sola consulta por bloque para saber qué avisos se enviaron ya hoy
+            recientes = NotificacionMantenimiento.notificadas_recientes(usuario_ids)
+            canales_por_usuario = CanalNotificacion.por_usuario(usuario_ids)
+            # Ambos motores trabajan bloque a bloque para que la memoria dependa de --chunk-size
+            if options['engine'] == 'vectorized':
+                vencimientos = barrer_flota(User.objects.filter(id__in=usuario_ids))
+            else:
+                vencimientos = obtener_vencimientos(Vehiculo.objects.filter(propietario_id__in=usuario_ids))
+            vencimientos_por_usuario = {}
+            for vencimiento in vencimientos:
+                vencimientos_por_usuario.setdefault(vencimiento.vehiculo.propietario_id, []).append(vencimiento)
             
-            if mantenimientos_proximos:
+            for usuario in bloque:
+                vencimientos = vencimientos_por_usuario.pop(usuario.id, [])
+                mantenimientos_proximos = self.obtener_mantenimientos_proximos(usuario, vencimientos, recientes)
+                if not mantenimientos_proximos:
+                    continue
+                
+                # Sin canales configurados, los avisos van por email
+                canales = canales_por_usuario.get(usuario.id) or [('email', '')]
+                
                 if test_mode:
+                    total_notificaciones += 1
                     if not silencioso:
-                        self.stdout.write(f'📧 [MODO PRUEBA] Se enviaría email a {usuario.email}:')
+                        destinos = ', '.join(destino or usuario.email for _, destino in canales)
+                        self.stdout.write(f'📧 [MODO PRUEBA] Se enviaría aviso a {destinos}:')
                         for vehiculo, items in mantenimientos_proximos.items():
                             self.stdout.write(f'  🚙 {vehiculo}:')
                             for item in items:
                                 self.stdout.write(f'    - {item["tipo_mantenimiento"].nombre}: {item["mensaje"]}')
+                    continue
+                
+                con_email = False
+                carga = None
+                for tipo, destino in canales:
+                    if tipo == 'email':
+                        con_email = bool(usuario.email)
+                    else:
+                        carga = carga or carga_aviso(usuario, mantenimientos_proximos)
+                        self.canales[tipo].añadir(usuario, destino, carga)
+                if con_email:
+                    lote.append((usuario, mantenimientos_proximos, self.construir_email(usuario, mantenimientos_proximos)))
                 else:
-                    self.enviar_notificacion(usuario, mantenimientos_proximos, silencioso)
-                    total_notificaciones += 1
-                    if not silencioso:
-                        self.stdout.write(f'📧 Email enviado a {usuario.email}')
+                    self.sin_email.append((usuario, mantenimientos_proximos))
+                
+                if len(lote) >= tamano_lote or len(self.sin_email) >= tamano_lote:
+                    total_notificaciones += self.entregar_canales(silencioso)
+                    if lote:
+                        total_notificaciones += self.enviar_lote(conexion, lote, silencioso)
+                    lote = []
         
-        if not silencioso:
-            if test_mode:
-                self.stdout.write(self.style.WARNING(f'🧪 Modo prueba completado. Se habrían enviado {len([u for u in usuarios if self.obtener_mantenimientos_proximos(u)])} notificaciones.'))
-            else:
-                self.stdout.write(self.style.SUCCESS(f'✅ Proceso completado. Se enviaron {total_notificaciones} notificaciones.'))
+        total_notificaciones += self.entregar_canales(silencioso)
+        if lote:
+            total_notificaciones += self.enviar_lote(conexion, lote, silencioso)
+        if conexion is not None:
+            conexion.close()
+        
+        return total_notificaciones
+
+    def por_bloques(self, iterable, tamano):
+        """Agrupa un iterador en listas de como mucho ``tamano`` elementos"""
+        bloque = []
+        for elemento in iterable:
+            bloque.append(elemento)
+            if len(bloque) >= tamano:
+                yield bloque
+                bloque = []
+        if bloque:
+            yield bloque
 
-    def obtener_mantenimientos_proximos(self, usuario):
-        """Obtiene todos los mantenimientos próximos a vencer para un usuario"""
-        vehiculos = Vehiculo.objects.filter(propietario=usuario)
+    def obtener_mantenimientos_proximos(self, usuario, vencimientos, recientes):
+        """
+        Agrupa por vehículo los vencimientos del usuario que aún no se han
+        notificado; ``recientes`` es el conjunto de notificadas_recientes().
+        """
         mantenimientos_por_vehiculo = {}
         
-        for vehiculo in vehiculos:
-            mantenimientos_vehiculo = []
+        for vencimiento in vencimientos:
+            vehiculo = vencimiento.vehiculo
+            tipo_mant = vencimiento.tipo_mantenimiento
             
-            # Obtener todos los tipos de mantenimiento aplicables
-            tipos_aplicables = TipoMantenimiento.objects.filter(
-                models.Q(vehiculos_aplicables='todos') | models.Q(vehiculos_aplicables=vehiculo.tipo),
-                activo=True
-            ).filter(
-                models.Q(intervalo_km__gt=0) | models.Q(intervalo_meses__gt=0)
-            )
+            # Verificar si ya se notificó hoy
+            if (usuario.id, vehiculo.id, tipo_mant.id, vencimiento.tipo_alerta) in recientes:
+                continue
             
-            for tipo_mant in tipos_aplicables:
-                # Buscar el último mantenimiento de este tipo
-                ultimo_registro = RegistroMantenimiento.objects.filter(
-                    vehiculo=vehiculo,
-                    items__tipo_mantenimiento=tipo_mant
-                ).order_by('-fecha_realizacion').first()
-                
-                if ultimo_registro:
-                    # Buscar intervalo personalizado
-                    intervalo_personalizado = IntervaloMantenimiento.objects.filter(
-                        vehiculo=vehiculo,
-                        tipo_mantenimiento=tipo_mant
-                    ).first()
-                    
-                    # Determinar intervalos a usar
-                    if intervalo_personalizado:
-                        intervalo_km = intervalo_personalizado.intervalo_km_personalizado if intervalo_personalizado.intervalo_km_personalizado > 0 else tipo_mant.intervalo_km
-                        intervalo_meses = intervalo_personalizado.intervalo_meses_personalizado if intervalo_personalizado.intervalo_meses_personalizado > 0 else tipo_mant.intervalo_meses
-                    else:
-                        intervalo_km = tipo_mant.intervalo_km or 0
-                        intervalo_meses = tipo_mant.intervalo_meses or 0
-                    
-                    # Verificar si está próximo a vencer
-                    es_proximo = False
-                    mensaje = ""
-                    urgencia = 0  # 0 = no urgente, 1 = próximo, 2 = vencido
-                    
-                    # Verificar por kilometraje
-                    if intervalo_km > 0:
-                        proximo_km = ultimo_registro.kilometraje_realizacion + intervalo_km
-                        km_restantes = proximo_km - vehiculo.kilometraje_actual
-                        
-                        if km_restantes <= 1000:  # Próximo si faltan 1000 km o menos
-                            es_proximo = True
-                            if km_restantes <= 0:
-                                mensaje = f"¡VENCIDO! (Pasado por {abs(km_restantes):.0f} km)"
-                                urgencia = 2
-                            else:
-                                mensaje = f"Próximo en {km_restantes:.0f} km"
-                                urgencia = 1
-                    
-                    # Verificar por fecha
-                    if intervalo_meses > 0:
-                        proxima_fecha = ultimo_registro.fecha_realizacion + relativedelta(months=intervalo_meses)
-                        dias_restantes = (proxima_fecha - date.today()).days
-                        
-                        if dias_restantes <= 30:  # Próximo si faltan 30 días o menos
-                            es_proximo = True
-                            if dias_restantes <= 0:
-                                if mensaje:
-                                    mensaje += f" y ¡VENCIDO POR TIEMPO! (Pasado por {abs(dias_restantes)} días)"
-                                else:
-                                    mensaje = f"¡VENCIDO! (Pasado por {abs(dias_restantes)} días)"
-                                urgencia = 2
-                            else:
-                                if mensaje:
-                                    mensaje += f" o en {dias_restantes} días"
-                                else:
-                                    mensaje = f"Próximo en {dias_restantes} días"
-                                if urgencia < 1:
-                                    urgencia = 1
-                    
-                    if es_proximo:
-                        # Determinar tipo de alerta
-                        tipo_alerta = 'proximo_km'
-                        if urgencia > 2:  # Vencido
-                            if km_restantes <= 0:
-                                tipo_alerta = 'vencido_km'
-                            elif dias_restantes <= 0:
-                                tipo_alerta = 'vencido_tiempo'
-                        else:  # Próximo
-                            if intervalo_meses > 0 and dias_restantes <= 30:
-                                tipo_alerta = 'proximo_tiempo'
-                        
-                        # Verificar si ya se notificó hoy
-                        if NotificacionMantenimiento.debe_notificar(
-                            vehiculo.propietario, vehiculo, tipo_mant, tipo_alerta
-                        ):
-                            mantenimientos_vehiculo.append({
-                                'tipo_mantenimiento': tipo_mant,
-                                'ultimo_registro': ultimo_registro,
-                                'mensaje': mensaje,
-                                'urgencia': urgencia,
-                                'proximo_km': proximo_km if intervalo_km > 0 else None,
-                                'proxima_fecha': proxima_fecha if intervalo_meses > 0 else None,
-                                'tipo_alerta': tipo_alerta,
-                            })
-            
-            if mantenimientos_vehiculo:
-                # Ordenar por urgencia (vencidos primero)
-                mantenimientos_vehiculo.sort(key=lambda x: (-x['urgencia'], x['tipo_mantenimiento'].nombre))
-                mantenimientos_por_vehiculo[vehiculo] = mantenimientos_vehiculo
+            mantenimientos_por_vehiculo.setdefault(vehiculo, []).append({
+                'tipo_mantenimiento': tipo_mant,
+                'ultimo_registro': vencimiento.ultimo_registro,
+                'mensaje': self.construir_mensaje(vencimiento),
+                'urgencia': vencimiento.urgencia,
+                'proximo_km': vencimiento.proximo_km,
+                'proxima_fecha': vencimiento.proxima_fecha,
+                'fecha_prevista': vencimiento.fecha_prevista,
+                'tipo_alerta': vencimiento.tipo_alerta,
+            })
+        
+        # Ordenar por urgencia (vencidos primero) y después por fecha prevista
+        for mantenimientos_vehiculo in mantenimientos_por_vehiculo.values():
+            mantenimientos_vehiculo.sort(key=lambda x: (
+                -x['urgencia'], x['fecha_prevista'] or date.max, x['tipo_mantenimiento'].nombre
+            ))
         
         return mantenimientos_por_vehiculo
 
-    def enviar_notificacion(self, usuario, mantenimientos_por_vehiculo, silencioso=False):
-        """Envía el email de notificación al usuario"""
+    def construir_mensaje(self, vencimiento):
+        """Construye el texto de aviso de un vencimiento para el email"""
+        mensaje = ""
+        
+        # Verificar por kilometraje (real o previsto según el ritmo de uso)
+        if vencimiento.proximo_por_km or vencimiento.proximo_por_prevision:
+            km_restantes = vencimiento.km_restantes
+            if km_restantes <= 0:
+                mensaje = f"¡VENCIDO! (Pasado por {abs(km_restantes):.0f} km)"
+            else:
+                mensaje = f"Próximo en {km_restantes:.0f} km"
+                if vencimiento.fecha_prevista_km:
+                    mensaje += f" (previsto hacia el {vencimiento.fecha_prevista_km:%d/%m/%Y})"
+        
+        # Verificar por fecha
+        if vencimiento.proximo_por_tiempo:
+            dias_restantes = vencimiento.dias_restantes
+            if dias_restantes <= 0:
+                if mensaje:
+                    mensaje += f" y ¡VENCIDO POR TIEMPO! (Pasado por {abs(dias_restantes)} días)"
+                else:
+                    mensaje = f"¡VENCIDO! (Pasado por {abs(dias_restantes)} días)"
+            elif mensaje:
+                mensaje += f" o en {dias_restantes} días"
+            else:
+                mensaje = f"Próximo en {dias_restantes} días"
+        
+        return mensaje
+
+    def construir_email(self, usuario, mantenimientos_por_vehiculo):
+        """Construye el email de notificación del usuario (texto plano y HTML)"""
         
         # Contar total de mantenimientos
         total_mantenimientos = sum(len(items) for items in mantenimientos_por_vehiculo.values())
@@ -225,39 +385,81 @@ class Command(BaseCommand):
         else:
             asunto = f'🔧 Wheeler Keeper - {total_mantenimientos} mantenimiento(s) próximo(s)'
         
-        try:
-            send_mail(
-                subject=asunto,
-                message=plain_message,
-                html_message=html_message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[usuario.email],
-                fail_silently=False,
+        email = EmailMultiAlternatives(
+            subject=asunto,
+            body=plain_message,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[usuario.email],
+        )
+        email.attach_alternative(html_message, 'text/html')
+        return email
+    
+    def enviar_lote(self, conexion, lote, silencioso=False):
+        """
+        Guarda un lote de (usuario, mantenimientos, email) en la bandeja de
+        salida y lo envía por la conexión abierta.
+        
+        Los emails que fallen quedan pendientes en la bandeja y los reintenta
+        procesar_correos_salientes. Devuelve el número de enviados.
+        """
+        inicio = time.monotonic()
+        correos = crear_correos([email for _, _, email in lote], [usuario for usuario, _, _ in lote])
+        
+        # Todo el lote se registra con un único INSERT en bloque
+        filas = []
+        for (usuario, mantenimientos_por_vehiculo, _), correo in zip(lote, correos):
+            filas.extend(self.filas_notificacion(usuario, mantenimientos_por_vehiculo, correo))
+        NotificacionMantenimiento.registrar_en_bloque(filas)
+        
+        fallidos = enviar_correos(correos, conexion, self.max_por_segundo, sesiones=self.sesiones_smtp)
+        enviados = len(lote) - len(fallidos)
+        
+        if not silencioso:
+            errores = {correo.id: error for correo, error in fallidos}
+            for correo in correos:
+                if correo.id in errores:
+                    self.stdout.write(self.style.ERROR(
+                        f'❌ Error enviando email a {correo.destinatario}: {errores[correo.id]} '
+                        f'(queda en la bandeja de salida)'
+                    ))
+                else:
+                    self.stdout.write(f'📧 Email enviado a {correo.destinatario}')
+            duracion = time.monotonic() - inicio
+            self.stdout.write(
+                f'📦 Lote de {len(lote)} emails: {enviados} enviados, '
+                f'{len(fallidos)} fallidos en {duracion:.2f} s'
             )
-            
-            # Registrar las notificaciones enviadas
-            self.registrar_notificaciones_enviadas(usuario, mantenimientos_por_vehiculo)
-            
-            return True
-        except Exception as e:
+        return enviados
+    
+    def entregar_canales(self, silencioso=False):
+        """
+        Entrega lo acumulado en los canales que no son email y registra los
+        avisos de los usuarios sin email que han llegado por algún canal.
+        Devuelve el número de esos usuarios.
+        """
+        entregados = set()
+        for tipo, canal in self.canales.items():
+            ids, errores = canal.entregar()
+            entregados |= ids
             if not silencioso:
-                self.stdout.write(
-                    self.style.ERROR(f'❌ Error enviando email a {usuario.email}: {str(e)}')
-                )
-            
-            # Registrar como no enviadas en caso de error
-            self.registrar_notificaciones_enviadas(usuario, mantenimientos_por_vehiculo, enviado=False)
-            
-            return False
+                for destino, error in errores:
+                    self.stdout.write(self.style.ERROR(f'❌ Error entregando avisos por {tipo} a {destino}: {error}'))
+        
+        # Los que no han llegado por ningún canal no se registran: se reintentan en el siguiente barrido
+        filas = []
+        avisados = 0
+        for usuario, mantenimientos_por_vehiculo in self.sin_email:
+            if usuario.id in entregados:
+                filas.extend(self.filas_notificacion(usuario, mantenimientos_por_vehiculo, None))
+                avisados += 1
+        NotificacionMantenimiento.registrar_en_bloque(filas)
+        self.sin_email = []
+        return avisados
     
-    def registrar_notificaciones_enviadas(self, usuario, mantenimientos_por_vehiculo, enviado=True):
-        """Registra en la base de datos las notificaciones que se enviaron"""
-        for vehiculo, mantenimientos in mantenimientos_por_vehiculo.items():
-            for item in mantenimientos:
-                NotificacionMantenimiento.registrar_notificacion(
-                    usuario=usuario,
-                    vehiculo=vehiculo,
-                    tipo_mantenimiento=item['tipo_mantenimiento'],
-                    tipo_alerta=item['tipo_alerta'],
-                    email_enviado=enviado
-                )
\ No newline at end of file
+    def filas_notificacion(self, usuario, mantenimientos_por_vehiculo, correo):
+        """Filas para NotificacionMantenimiento.registrar_en_bloque de un email"""
+        return [
+            (usuario, vehiculo, item['tipo_mantenimiento'], item['tipo_alerta'], correo)
+            for vehiculo, mantenimientos in mantenimientos_por_vehiculo.items()
+            for item in mantenimientos
+        ]
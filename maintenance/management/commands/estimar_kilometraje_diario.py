@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from maintenance.models import Vehiculo
+from maintenance.proyeccion import estimar_km_diarios
+from maintenance.vencimientos import recalcular_estados
+
+
+class Command(BaseCommand):
+    help = 'Estima los km diarios de cada vehículo a partir de su historial y actualiza las fechas previstas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--vehiculo-id',
+            type=int,
+            help='Estimar solo este vehículo',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=500,
+            help='Número de vehículos por lote al recalcular los estados (por defecto 500)',
+        )
+
+    def handle(self, *args, **options):
+        vehiculo_ids = [options['vehiculo_id']] if options.get('vehiculo_id') else None
+
+        estimaciones = estimar_km_diarios(vehiculo_ids)
+        self.stdout.write(f'  {len(estimaciones)} vehículos con estimación de km diarios')
+
+        # Trasladar las nuevas estimaciones a las fechas previstas de los estados
+        if vehiculo_ids is None:
+            vehiculo_ids = list(Vehiculo.objects.order_by('id').values_list('id', flat=True))
+        lote = max(options['lote'], 1)
+        for inicio in range(0, len(vehiculo_ids), lote):
+            recalcular_estados(vehiculo_ids[inicio:inicio + lote])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Proceso completado. {len(vehiculo_ids)} vehículos actualizados.')
+        )
@@ -0,0 +1,84 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand
+
+from maintenance.vencimientos import vencimientos_flota
+
+
+COLUMNAS = [
+    'fecha_prevista', 'usuario', 'email', 'vehiculo_id', 'vehiculo', 'matricula',
+    'tipo_mantenimiento', 'proximo_km', 'km_restantes', 'proxima_fecha',
+]
+
+
+class Command(BaseCommand):
+    help = 'Lista los vehículos de todas las cuentas que vencen en una ventana de días/km'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=30,
+            help='Incluir los que vencen en los próximos N días (por defecto 30)',
+        )
+        parser.add_argument(
+            '--km',
+            type=int,
+            help='Incluir también los que tengan N km restantes o menos',
+        )
+        parser.add_argument(
+            '--formato',
+            choices=['texto', 'csv', 'ndjson'],
+            default='texto',
+            help='Formato de salida (por defecto texto)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Filas leídas de la base de datos por bloque al transmitir la salida',
+        )
+
+    def handle(self, *args, **options):
+        formato = options['formato']
+        estados = vencimientos_flota(options['dias'], km=options.get('km'))
+
+        if formato == 'csv':
+            escritor = csv.writer(self.stdout, lineterminator='\n')
+            escritor.writerow(COLUMNAS)
+
+        total = 0
+        # iterator() transmite los resultados sin cargar toda la flota en memoria
+        for estado in estados.iterator(chunk_size=options['chunk_size']):
+            fila = self.fila(estado)
+            total += 1
+            if formato == 'csv':
+                escritor.writerow([fila[columna] for columna in COLUMNAS])
+            elif formato == 'ndjson':
+                self.stdout.write(json.dumps(fila, ensure_ascii=False))
+            else:
+                self.stdout.write(
+                    f"{fila['fecha_prevista'] or '-':<10}  {fila['usuario']:<20}  "
+                    f"{fila['vehiculo']:<30}  {fila['tipo_mantenimiento']:<40}  "
+                    f"{fila['km_restantes'] if fila['km_restantes'] is not None else '-':>8} km"
+                )
+
+        if formato == 'texto':
+            self.stdout.write(self.style.SUCCESS(f'{total} vencimientos en la ventana indicada.'))
+
+    def fila(self, estado):
+        """Convierte un EstadoMantenimiento en un diccionario serializable"""
+        vehiculo = estado.vehiculo
+        return {
+            'fecha_prevista': estado.fecha_prevista.isoformat() if estado.fecha_prevista else None,
+            'usuario': vehiculo.propietario.username,
+            'email': vehiculo.propietario.email,
+            'vehiculo_id': vehiculo.id,
+            'vehiculo': vehiculo.nombre_completo(),
+            'matricula': vehiculo.matricula,
+            'tipo_mantenimiento': estado.tipo_mantenimiento.nombre,
+            'proximo_km': estado.proximo_km,
+            'km_restantes': estado.km_restantes,
+            'proxima_fecha': estado.proxima_fecha.isoformat() if estado.proxima_fecha else None,
+        }
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from maintenance.models import TipoMantenimiento
+from maintenance.catalogo import invalidar_catalogo
 
 
 class Command(BaseCommand):
@@ -289,6 +290,9 @@ class Command(BaseCommand):
                         self.style.WARNING(f'Sin cambios: {tipo.nombre}')
                     )
         
+        # Las señales ya lo hacen por cada tipo guardado; aquí se garantiza una sola vez al final
+        invalidar_catalogo()
+
         self.stdout.write(
             self.style.SUCCESS(
                 f'Proceso completado. {created_count} tipos creados, {updated_count} actualizados.'
@@ -0,0 +1,268 @@
+import re
+import time
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from maintenance.models import NotificacionMantenimiento
+
+
+# CREATE [UNIQUE] INDEX nombre ON [ONLY] esquema.tabla USING ..., tal como lo devuelve pg_get_indexdef
+PATRON_INDICE = re.compile(r'^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON )(?:ONLY )?(\S+)( USING .*)$', re.S)
+
+
+class Command(BaseCommand):
+    help = (
+        'Particiona por meses (PostgreSQL) el historial de notificaciones según fecha_envio, '
+        'crea las particiones de los próximos meses y elimina las que quedan fuera de la retención'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convertir',
+            action='store_true',
+            help=(
+                'Convertir la tabla actual en una tabla particionada (una sola vez). Copia las filas por lotes '
+                'sin bloquear la tabla y solo la bloquea al final para copiar lo que haya cambiado e intercambiarlas'
+            ),
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=5000,
+            help='Filas copiadas por transacción al convertir (por defecto 5000)',
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=0.1,
+            help='Segundos de espera entre lotes al convertir para no saturar la base de datos (por defecto 0.1)',
+        )
+        parser.add_argument(
+            '--meses-adelante',
+            type=int,
+            default=3,
+            help='Meses futuros para los que se dejan creadas las particiones (por defecto 3)',
+        )
+        parser.add_argument(
+            '--retencion-meses',
+            type=int,
+            help='Eliminar las particiones de meses anteriores a este número de meses',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('El particionado solo está disponible con PostgreSQL')
+
+        self.tabla = NotificacionMantenimiento._meta.db_table
+        # La conversión gestiona sus propias transacciones: una por lote y una corta al final
+        if options['convertir']:
+            if self.esta_particionada():
+                self.stdout.write('La tabla ya estaba particionada')
+            else:
+                self.convertir(options['meses_adelante'], max(options['lote'], 1), options['pausa'])
+        elif not self.esta_particionada():
+            raise CommandError('La tabla no está particionada; ejecuta primero el comando con --convertir')
+
+        with transaction.atomic():
+            hoy = date.today().replace(day=1)
+            creadas = self.crear_particiones(hoy, hoy + relativedelta(months=options['meses_adelante']))
+            eliminadas = 0
+            if options['retencion_meses'] is not None:
+                eliminadas = self.eliminar_particiones(hoy - relativedelta(months=max(options['retencion_meses'], 1)))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Proceso completado. {creadas} particiones creadas y {eliminadas} eliminadas.'
+        ))
+
+    def esta_particionada(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", [self.tabla])
+            return cursor.fetchone()[0] == 'p'
+
+    def particion(self, mes):
+        return f'{self.tabla}_p{mes:%Y%m}'
+
+    def crear_particiones(self, desde, hasta, padre=None):
+        """
+        Crea las particiones mensuales de ``desde`` a ``hasta`` (ambos incluidos)
+        que falten. Se nombran siempre a partir de la tabla definitiva, aunque
+        ``padre`` sea la tabla nueva de la conversión.
+        """
+        creadas = 0
+        mes = desde
+        with connection.cursor() as cursor:
+            while mes <= hasta:
+                nombre = self.particion(mes)
+                cursor.execute("SELECT to_regclass(%s)", [nombre])
+                if cursor.fetchone()[0] is None:
+                    cursor.execute(
+                        f'CREATE TABLE {connection.ops.quote_name(nombre)} '
+                        f'PARTITION OF {connection.ops.quote_name(padre or self.tabla)} '
+                        f"FOR VALUES FROM ('{mes:%Y-%m-%d}') TO ('{mes + relativedelta(months=1):%Y-%m-%d}')"
+                    )
+                    creadas += 1
+                mes += relativedelta(months=1)
+        return creadas
+
+    def eliminar_particiones(self, antes_de):
+        """Elimina las particiones mensuales anteriores a ``antes_de``: mucho más barato que un DELETE"""
+        patron = re.compile(rf'^{re.escape(self.tabla)}_p(\d{{4}})(\d{{2}})$')
+        eliminadas = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = %s::regclass",
+                [self.tabla]
+            )
+            for (nombre,) in cursor.fetchall():
+                coincidencia = patron.match(nombre)
+                if not coincidencia or date(int(coincidencia[1]), int(coincidencia[2]), 1) >= antes_de:
+                    continue
+                cursor.execute(
+                    f'ALTER TABLE {connection.ops.quote_name(self.tabla)} '
+                    f'DETACH PARTITION {connection.ops.quote_name(nombre)}'
+                )
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(nombre)}')
+                eliminadas += 1
+        return eliminadas
+
+    def convertir(self, meses_adelante, lote, pausa):
+        """
+        Sustituye la tabla por otra particionada por rango de fecha_envio con
+        el mismo esquema, índices y claves ajenas.
+
+        La tabla nueva se crea con otro nombre y se llena por lotes de id, cada
+        uno en su propia transacción, mientras la antigua sigue en uso. Solo el
+        último paso bloquea la tabla: copia las filas nuevas o modificadas
+        desde el último lote (email_enviado se actualiza tras el envío), borra
+        las que ya no existen e intercambia las tablas.
+
+        PostgreSQL exige que la clave primaria incluya la columna de
+        particionado, así que pasa a ser (id, fecha_envio); los id se siguen
+        generando con una secuencia y son únicos.
+        """
+        nombre_nueva = f'{self.tabla}_nueva'
+        tabla = connection.ops.quote_name(self.tabla)
+        nueva = connection.ops.quote_name(nombre_nueva)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Restos de una conversión interrumpida: se empieza de cero
+            cursor.execute(f'DROP TABLE IF EXISTS {nueva} CASCADE')
+            indices, clave_primaria, claves_ajenas = self.leer_esquema(cursor)
+
+            cursor.execute(f'SELECT min(fecha_envio)::date FROM {tabla}')
+            primera_fecha = cursor.fetchone()[0]
+            cursor.execute(
+                f'CREATE TABLE {nueva} (LIKE {tabla} INCLUDING DEFAULTS) PARTITION BY RANGE (fecha_envio)'
+            )
+            # Si id era serial, su valor por defecto depende de la secuencia de la tabla antigua
+            cursor.execute(f'ALTER TABLE {nueva} ALTER COLUMN id DROP DEFAULT')
+            # Las filas fuera de las particiones mensuales (fechas futuras lejanas) van a la de por defecto
+            cursor.execute(
+                f'CREATE TABLE {connection.ops.quote_name(self.tabla + "_pdefecto")} PARTITION OF {nueva} DEFAULT'
+            )
+            hoy = date.today().replace(day=1)
+            desde = primera_fecha.replace(day=1) if primera_fecha else hoy
+            self.crear_particiones(desde, hoy + relativedelta(months=meses_adelante), padre=nombre_nueva)
+
+            # Índices con nombres provisionales: los definitivos siguen siendo de la
+            # tabla antigua hasta que se elimina, y se recuperan al final con RENAME
+            cursor.execute(
+                f'ALTER TABLE {nueva} ADD CONSTRAINT {connection.ops.quote_name(nombre_nueva + "_pkey")} '
+                f'PRIMARY KEY (id, fecha_envio)'
+            )
+            for i, (nombre, definicion) in enumerate(indices):
+                cursor.execute(self.definicion_indice(definicion, f'{nombre_nueva[:50]}_idx{i}', nueva))
+
+        # Copia por lotes sin bloquear la tabla
+        copiadas = 0
+        ultimo_id = 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(
+                    f'INSERT INTO {nueva} SELECT * FROM {tabla} WHERE id > %s ORDER BY id LIMIT %s RETURNING id',
+                    [ultimo_id, lote]
+                )
+                ids = [fila[0] for fila in cursor.fetchall()]
+            if not ids:
+                break
+            copiadas += len(ids)
+            ultimo_id = max(ids)
+            self.stdout.write(f'  {copiadas} notificaciones copiadas')
+            if len(ids) < lote:
+                break
+            time.sleep(pausa)
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {tabla} IN ACCESS EXCLUSIVE MODE')
+
+            # Cambios durante la copia: fuera las filas borradas o distintas y dentro las que faltan
+            cursor.execute(
+                f'DELETE FROM {nueva} n WHERE NOT EXISTS ('
+                f'SELECT 1 FROM {tabla} a WHERE a.id = n.id AND ROW(a.*) IS NOT DISTINCT FROM ROW(n.*))'
+            )
+            cursor.execute(
+                f'INSERT INTO {nueva} SELECT * FROM {tabla} a '
+                f'WHERE NOT EXISTS (SELECT 1 FROM {nueva} n WHERE n.id = a.id)'
+            )
+            cursor.execute(f'SELECT max(id) FROM {nueva}')
+            max_id = cursor.fetchone()[0]
+
+            # El orden importa: eliminar la tabla antigua libera los nombres de sus
+            # índices, de su clave primaria y de su secuencia {tabla}_id_seq, que la
+            # tabla nueva toma a continuación
+            cursor.execute(f'DROP TABLE {tabla}')
+            cursor.execute(f'ALTER TABLE {nueva} RENAME TO {tabla}')
+            cursor.execute(
+                f'ALTER TABLE {tabla} RENAME CONSTRAINT {connection.ops.quote_name(nombre_nueva + "_pkey")} '
+                f'TO {connection.ops.quote_name(clave_primaria)}'
+            )
+            for i, (nombre, _) in enumerate(indices):
+                cursor.execute(
+                    f'ALTER INDEX {connection.ops.quote_name(f"{nombre_nueva[:50]}_idx{i}")} '
+                    f'RENAME TO {connection.ops.quote_name(nombre)}'
+                )
+
+            secuencia = connection.ops.quote_name(f'{self.tabla}_id_seq')
+            cursor.execute(f'CREATE SEQUENCE {secuencia} OWNED BY {tabla}.id')
+            cursor.execute("SELECT setval(%s, %s, %s)", [f'{self.tabla}_id_seq', max_id or 1, max_id is not None])
+            cursor.execute(f"ALTER TABLE {tabla} ALTER COLUMN id SET DEFAULT nextval('{self.tabla}_id_seq')")
+            # Las claves ajenas se añaden al final: durante la copia impedirían
+            # borrar usuarios o vehículos cuyas filas aún estaban en la tabla nueva
+            for nombre, definicion in claves_ajenas:
+                cursor.execute(
+                    f'ALTER TABLE {tabla} ADD CONSTRAINT {connection.ops.quote_name(nombre)} {definicion}'
+                )
+
+        self.stdout.write(f'Tabla {self.tabla} convertida en tabla particionada por meses')
+
+    def leer_esquema(self, cursor):
+        """Índices (nombre, definición), nombre de la clave primaria y claves ajenas (nombre, definición) de la tabla"""
+        cursor.execute(
+            "SELECT c.relname, pg_get_indexdef(i.indexrelid) FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass AND NOT i.indisprimary ORDER BY c.relname",
+            [self.tabla]
+        )
+        indices = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'",
+            [self.tabla]
+        )
+        clave_primaria = cursor.fetchone()[0]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = %s::regclass AND contype = 'f'",
+            [self.tabla]
+        )
+        return indices, clave_primaria, cursor.fetchall()
+
+    def definicion_indice(self, definicion, nombre, tabla):
+        """Reescribe una definición de pg_get_indexdef para crear el índice con otro nombre sobre otra tabla"""
+        partes = PATRON_INDICE.match(definicion)
+        if not partes:
+            raise CommandError(f'Definición de índice no reconocida: {definicion}')
+        return f'{partes[1]}{connection.ops.quote_name(nombre)}{partes[3]}{tabla}{partes[5]}'
@@ -0,0 +1,196 @@
+import os
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from maintenance.models import TareaNotificacion
+
+
+class Command(BaseCommand):
+    help = 'Trabajador que procesa la cola de verificaciones de notificaciones de mantenimiento'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrencia',
+            type=int,
+            default=2,
+            help='Tareas procesadas en paralelo por este trabajador (por defecto 2)',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=5,
+            help='Segundos de espera cuando la cola está vacía (por defecto 5)',
+        )
+        parser.add_argument(
+            '--max-intentos',
+            type=int,
+            default=3,
+            help='Intentos antes de dar una tarea por fallida (por defecto 3)',
+        )
+        parser.add_argument(
+            '--tiempo-maximo',
+            type=int,
+            default=900,
+            help='Segundos sin latido tras los que una tarea en curso se considera abandonada y se reencola',
+        )
+        parser.add_argument(
+            '--retencion-dias',
+            type=int,
+            default=7,
+            help='Días que se conservan las tareas terminadas (por defecto 7)',
+        )
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Vaciar la cola y terminar en lugar de quedarse esperando tareas nuevas',
+        )
+
+    def handle(self, *args, **options):
+        self.concurrencia = max(1, options['concurrencia'])
+        self.max_intentos = options['max_intentos']
+        # Varios latidos por cada tiempo máximo: una tarea viva nunca llega a parecer abandonada
+        self.intervalo_latido = max(1, options['tiempo_maximo'] / 3)
+        self.trabajador = f'{socket.gethostname()}:{os.getpid()}'
+        self.parar = threading.Event()
+
+        for senal in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(senal, lambda *_: self.parar.set())
+
+        self.stdout.write(self.style.SUCCESS(
+            f'🛠️  Trabajador {self.trabajador} iniciado (concurrencia {self.concurrencia})'
+        ))
+
+        procesadas = 0
+        ultima_limpieza = None
+        with ThreadPoolExecutor(max_workers=self.concurrencia) as ejecutor:
+            while not self.parar.is_set():
+                if ultima_limpieza is None or timezone.now() - ultima_limpieza > timedelta(hours=1):
+                    self.limpiar_terminadas(options['retencion_dias'])
+                    ultima_limpieza = timezone.now()
+                self.reencolar_abandonadas(options['tiempo_maximo'])
+                tareas = self.reclamar(self.concurrencia)
+                if not tareas:
+                    if options['una_vez']:
+                        break
+                    self.parar.wait(options['intervalo'])
+                    continue
+                # Se espera al lote completo antes de reclamar más, así nunca hay
+                # más tareas en curso que hilos disponibles
+                procesadas += len(list(ejecutor.map(self.procesar, tareas)))
+
+        self.stdout.write(self.style.SUCCESS(f'✅ Trabajador detenido. {procesadas} tareas procesadas.'))
+
+    def limpiar_terminadas(self, retencion_dias):
+        """Borra las tareas terminadas hace más de ``retencion_dias``"""
+        TareaNotificacion.objects.filter(
+            estado__in=['completada', 'error'],
+            fecha_fin__lt=timezone.now() - timedelta(days=retencion_dias),
+        ).delete()
+
+    def reencolar_abandonadas(self, tiempo_maximo):
+        """
+        Devuelve a la cola las tareas de trabajadores que murieron a mitad.
+        
+        Se mira el latido y no el inicio: un barrido global largo sigue
+        renovándolo mientras su trabajador vive y no se duplica.
+        """
+        limite = timezone.now() - timedelta(seconds=tiempo_maximo)
+        TareaNotificacion.objects.filter(estado='en_curso').filter(
+            Q(fecha_latido__lt=limite) | Q(fecha_latido__isnull=True, fecha_inicio__lt=limite)
+        ).update(
+            estado='pendiente', trabajador='', ultimo_error='Tarea abandonada por su trabajador'
+        )
+
+    def reclamar(self, cantidad):
+        """
+        Marca como en curso hasta ``cantidad`` tareas disponibles.
+
+        SKIP LOCKED permite que varios trabajadores reclamen a la vez sin
+        bloquearse ni repartirse la misma tarea.
+        """
+        ahora = timezone.now()
+        with transaction.atomic():
+            tareas = list(
+                TareaNotificacion.objects.select_for_update(skip_locked=True)
+                .filter(estado='pendiente', fecha_disponible__lte=ahora)
+                .order_by('fecha_disponible', 'id')[:cantidad]
+            )
+            for tarea in tareas:
+                tarea.estado = 'en_curso'
+                tarea.trabajador = self.trabajador
+                tarea.fecha_inicio = ahora
+                tarea.fecha_latido = ahora
+                tarea.intentos += 1
+            TareaNotificacion.objects.bulk_update(
+                tareas, ['estado', 'trabajador', 'fecha_inicio', 'fecha_latido', 'intentos']
+            )
+        return tareas
+
+    def latir(self, tarea_id, terminada):
+        """Renueva el latido de una tarea en curso hasta que ``terminada`` se activa"""
+        try:
+            while not terminada.wait(self.intervalo_latido):
+                TareaNotificacion.objects.filter(
+                    id=tarea_id, estado='en_curso', trabajador=self.trabajador
+                ).update(fecha_latido=timezone.now())
+        finally:
+            connection.close()
+
+    def procesar(self, tarea):
+        """
+        Ejecuta la verificación de una tarea y guarda el resultado.
+
+        El resultado solo se guarda si la tarea sigue siendo de este trabajador
+        y de este intento: si su latido se retrasó y se reencoló (o ya la ha
+        reclamado otro trabajador), no se pisa ese estado.
+        """
+        close_old_connections()
+        terminada = threading.Event()
+        latido = threading.Thread(target=self.latir, args=(tarea.id, terminada), daemon=True)
+        latido.start()
+        try:
+            if tarea.usuario_id:
+                call_command('enviar_notificaciones_mantenimiento', usuario_id=tarea.usuario_id, silencioso=True)
+            else:
+                # El barrido global solo revisa los estados cuya revisión ha llegado
+                # y encola una tarea por cada usuario con avisos
+                call_command('revisar_vencimientos')
+        except Exception as e:
+            tarea.ultimo_error = str(e)
+            if tarea.intentos >= self.max_intentos:
+                tarea.estado = 'error'
+                tarea.fecha_fin = timezone.now()
+            else:
+                # Reintento con espera exponencial: 1, 2, 4... minutos
+                tarea.estado = 'pendiente'
+                tarea.fecha_disponible = timezone.now() + timedelta(minutes=2 ** (tarea.intentos - 1))
+            self.stderr.write(f'❌ Tarea {tarea.id}: {e}')
+        else:
+            tarea.estado = 'completada'
+            tarea.fecha_fin = timezone.now()
+            tarea.ultimo_error = ''
+        finally:
+            terminada.set()
+            latido.join()
+            guardada = TareaNotificacion.objects.filter(
+                id=tarea.id, estado='en_curso', trabajador=self.trabajador, intentos=tarea.intentos
+            ).update(
+                estado=tarea.estado,
+                fecha_fin=tarea.fecha_fin,
+                fecha_disponible=tarea.fecha_disponible,
+                ultimo_error=tarea.ultimo_error,
+            )
+            if not guardada:
+                self.stderr.write(f'⚠️  Tarea {tarea.id}: reencolada o reclamada por otro trabajador; no se guarda su resultado')
+            # Cada hilo abre su propia conexión; se cierra para no acumularlas
+            connection.close()
+        return tarea
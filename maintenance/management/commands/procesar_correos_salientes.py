@@ -0,0 +1,100 @@
+import signal
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from maintenance.correo import MAX_INTENTOS, SESIONES_SMTP, enviar_correos, reclamar
+from maintenance.models import CorreoSaliente
+
+
+class Command(BaseCommand):
+    help = 'Trabajador que entrega y reintenta los emails de la bandeja de salida'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tamano-lote',
+            type=int,
+            default=getattr(settings, 'WHEELER_EMAIL_TAMANO_LOTE', 100),
+            help='Emails enviados por cada conexión SMTP (por defecto 100)',
+        )
+        parser.add_argument(
+            '--max-por-segundo',
+            type=float,
+            default=getattr(settings, 'WHEELER_EMAIL_MAX_POR_SEGUNDO', 0),
+            help='Límite de emails por segundo que admite el servidor SMTP (0 = sin límite)',
+        )
+        parser.add_argument(
+            '--sesiones-smtp',
+            type=int,
+            default=SESIONES_SMTP,
+            help='Conexiones SMTP simultáneas para enviar cada lote (por defecto 1, en serie)',
+        )
+        parser.add_argument(
+            '--max-intentos',
+            type=int,
+            default=MAX_INTENTOS,
+            help=f'Intentos antes de dar un email por fallido (por defecto {MAX_INTENTOS})',
+        )
+        parser.add_argument(
+            '--intervalo',
+            type=float,
+            default=10,
+            help='Segundos de espera cuando no hay emails que enviar (por defecto 10)',
+        )
+        parser.add_argument(
+            '--retencion-dias',
+            type=int,
+            default=30,
+            help='Días que se conservan los emails enviados (por defecto 30)',
+        )
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Vaciar la bandeja y terminar en lugar de quedarse esperando emails nuevos',
+        )
+
+    def handle(self, *args, **options):
+        self.parar = threading.Event()
+        for senal in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(senal, lambda *_: self.parar.set())
+
+        tamano_lote = max(1, options['tamano_lote'])
+        enviados = fallidos = 0
+        ultima_limpieza = None
+        while not self.parar.is_set():
+            if ultima_limpieza is None or timezone.now() - ultima_limpieza > timedelta(hours=1):
+                self.limpiar_enviados(options['retencion_dias'])
+                ultima_limpieza = timezone.now()
+
+            correos = reclamar(tamano_lote)
+            if not correos:
+                if options['una_vez']:
+                    break
+                self.parar.wait(options['intervalo'])
+                continue
+
+            errores = enviar_correos(
+                correos,
+                max_por_segundo=options['max_por_segundo'],
+                max_intentos=options['max_intentos'],
+                sesiones=options['sesiones_smtp'],
+            )
+            for correo, error in errores:
+                destino = 'descartado' if correo.estado == 'error' else f'reintento a las {timezone.localtime(correo.proximo_intento):%H:%M}'
+                self.stderr.write(f'❌ Email {correo.id} a {correo.destinatario}: {error} ({destino})')
+            enviados += len(correos) - len(errores)
+            fallidos += len(errores)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Bandeja de salida procesada. {enviados} emails enviados, {fallidos} intentos fallidos.'
+        ))
+
+    def limpiar_enviados(self, retencion_dias):
+        """Borra los emails enviados hace más de ``retencion_dias``; los fallidos se conservan para revisarlos"""
+        CorreoSaliente.objects.filter(
+            estado='enviado',
+            fecha_envio__lt=timezone.now() - timedelta(days=retencion_dias),
+        ).delete()
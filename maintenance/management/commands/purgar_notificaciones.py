@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from maintenance.models import NotificacionMantenimiento
+
+
+class Command(BaseCommand):
+    help = 'Borra por lotes el historial de notificaciones más antiguo que el periodo de retención'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=180,
+            help='Días de historial que se conservan (por defecto 180)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=5000,
+            help='Filas borradas por transacción (por defecto 5000)',
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=0.1,
+            help='Segundos de espera entre lotes para no saturar la base de datos (por defecto 0.1)',
+        )
+
+    def handle(self, *args, **options):
+        # La comprobación anti-spam solo mira las últimas 24 horas
+        dias = max(options['dias'], 1)
+        lote = max(options['lote'], 1)
+        limite = timezone.now() - timedelta(days=dias)
+        antiguas = NotificacionMantenimiento.objects.filter(fecha_envio__lt=limite).order_by()
+
+        # Cada lote es una transacción corta: nunca se bloquea la tabla entera
+        # ni se acumula un único DELETE de millones de filas
+        total = 0
+        while True:
+            ids = list(antiguas.values_list('id', flat=True)[:lote])
+            if not ids:
+                break
+            borradas, _ = NotificacionMantenimiento.objects.filter(id__in=ids).delete()
+            total += borradas
+            self.stdout.write(f'  {total} notificaciones borradas')
+            if len(ids) < lote:
+                break
+            time.sleep(options['pausa'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Proceso completado. {total} notificaciones anteriores al {limite:%d/%m/%Y} borradas.'
+        ))
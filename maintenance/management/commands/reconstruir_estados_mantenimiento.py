@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+
+from maintenance.models import Vehiculo
+from maintenance.vencimientos import recalcular_estados
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye la tabla de estados de mantenimiento a partir del historial'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--usuario-id',
+            type=int,
+            help='Reconstruir solo los vehículos de este usuario',
+        )
+        parser.add_argument(
+            '--vehiculo-id',
+            type=int,
+            help='Reconstruir solo este vehículo',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=500,
+            help='Número de vehículos a recalcular por lote (por defecto 500)',
+        )
+
+    def handle(self, *args, **options):
+        vehiculos = Vehiculo.objects.order_by('id')
+        if options.get('usuario_id'):
+            vehiculos = vehiculos.filter(propietario_id=options['usuario_id'])
+        if options.get('vehiculo_id'):
+            vehiculos = vehiculos.filter(id=options['vehiculo_id'])
+
+        lote = max(options['lote'], 1)
+        vehiculo_ids = list(vehiculos.values_list('id', flat=True))
+        total_estados = 0
+
+        for inicio in range(0, len(vehiculo_ids), lote):
+            total_estados += recalcular_estados(vehiculo_ids[inicio:inicio + lote])
+            self.stdout.write(f'  {min(inicio + lote, len(vehiculo_ids))}/{len(vehiculo_ids)} vehículos procesados')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Proceso completado. {total_estados} estados reconstruidos para {len(vehiculo_ids)} vehículos.'
+            )
+        )
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from maintenance.models import RegistroMantenimiento
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye los totales de costes y el resumen de trabajos de los registros a partir de sus ítems'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--usuario-id',
+            type=int,
+            help='Reconstruir solo los registros de este usuario',
+        )
+        parser.add_argument(
+            '--vehiculo-id',
+            type=int,
+            help='Reconstruir solo los registros de este vehículo',
+        )
+        parser.add_argument(
+            '--solo-desfasados',
+            action='store_true',
+            help='Reconstruir solo los registros cuyo total o número de ítems guardados no coinciden con los calculados en la base de datos',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Número de registros a recalcular por lote (por defecto 1000)',
+        )
+
+    def handle(self, *args, **options):
+        registros = RegistroMantenimiento.objects.order_by('id')
+        if options.get('usuario_id'):
+            registros = registros.filter(vehiculo__propietario_id=options['usuario_id'])
+        if options.get('vehiculo_id'):
+            registros = registros.filter(vehiculo_id=options['vehiculo_id'])
+        if options['solo_desfasados']:
+            registros = registros.with_costs().filter(
+                ~Q(costo_total=F('total_calculado')) | ~Q(numero_items=F('numero_items_calculado'))
+            )
+
+        lote = max(options['lote'], 1)
+        registro_ids = list(registros.values_list('id', flat=True))
+
+        for inicio in range(0, len(registro_ids), lote):
+            RegistroMantenimiento.actualizar_totales(registro_ids[inicio:inicio + lote])
+            self.stdout.write(f'  {min(inicio + lote, len(registro_ids))}/{len(registro_ids)} registros procesados')
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Proceso completado. Totales reconstruidos para {len(registro_ids)} registros.')
+        )
@@ -0,0 +1,55 @@
+from collections import defaultdict
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from maintenance.models import EstadoMantenimiento, TareaNotificacion
+from maintenance.vencimientos import en_aviso, proxima_revision
+
+
+class Command(BaseCommand):
+    help = (
+        'Revisa solo los estados de mantenimiento cuya próxima revisión ha llegado y encola '
+        'la notificación de los usuarios con avisos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Estados revisados por consulta (por defecto 1000)',
+        )
+
+    def handle(self, *args, **options):
+        hoy = date.today()
+        lote = max(options['lote'], 1)
+        # Recorre el índice de proxima_revision: el coste depende de los estados
+        # que tocan hoy, no del tamaño de la flota
+        pendientes = EstadoMantenimiento.objects.filter(proxima_revision__lte=hoy).order_by('proxima_revision', 'id')
+
+        revisados = 0
+        usuarios = set()
+        while True:
+            filas = list(pendientes.values_list(
+                'id', 'vehiculo__propietario_id', 'proxima_fecha', 'fecha_prevista_km', 'km_restantes'
+            )[:lote])
+            if not filas:
+                break
+
+            # La nueva revisión siempre es posterior a hoy, así que estos estados no vuelven a salir
+            por_fecha = defaultdict(list)
+            for estado_id, propietario_id, proxima_fecha, fecha_prevista_km, km_restantes in filas:
+                por_fecha[proxima_revision(proxima_fecha, fecha_prevista_km, km_restantes, hoy)].append(estado_id)
+                if en_aviso(proxima_fecha, fecha_prevista_km, km_restantes, hoy):
+                    usuarios.add(propietario_id)
+            for fecha, estado_ids in por_fecha.items():
+                EstadoMantenimiento.objects.filter(id__in=estado_ids).update(proxima_revision=fecha)
+            revisados += len(filas)
+
+        for usuario_id in usuarios:
+            TareaNotificacion.encolar(usuario_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Proceso completado. {revisados} estados revisados y {len(usuarios)} usuarios con avisos encolados.'
+        ))
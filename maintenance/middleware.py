@@ -1,22 +1,30 @@
 from django.utils.deprecation import MiddlewareMixin
-from django.core.management import call_command
-from django.conf import settings
-from datetime import datetime, timedelta
+from django.utils import timezone
+from datetime import timedelta
 import logging
+import os
+import socket
+
+from .models import Concesion, TareaNotificacion
 
 logger = logging.getLogger(__name__)
 
 
 class NotificacionesMantenimientoMiddleware(MiddlewareMixin):
     """
-    Middleware que verifica y envía notificaciones de mantenimiento
-    de forma inteligente durante la navegación normal del usuario.
+    Middleware que encola el barrido de notificaciones de mantenimiento
+    durante la navegación normal, sin bloquear la petición.
+    
+    Una concesión compartida en base de datos garantiza que, con varios
+    procesos o contenedores, solo uno encola cada barrido.
     """
     
-    # Cache para evitar verificaciones muy frecuentes
-    _ultima_verificacion = None
+    NOMBRE_CONCESION = 'barrido_notificaciones'
     _intervalo_verificacion = timedelta(hours=6)  # Verificar cada 6 horas máximo
     
+    # Caducidad conocida de la concesión en este proceso: hasta entonces no hace falta consultar la BD
+    _concesion_expira = None
+    
     def process_request(self, request):
         """
         Procesa cada request y verifica si es momento de enviar notificaciones
@@ -25,24 +33,18 @@ class NotificacionesMantenimientoMiddleware(MiddlewareMixin):
         if not request.user.is_authenticated:
             return None
         
-        # Verificar si es momento de hacer la comprobación
-        if not self._debe_verificar():
-            return None
-        
         # Verificar solo en requests GET normales (no AJAX, no archivos estáticos)
         if not self._es_request_apropiado(request):
             return None
         
         try:
-            # Ejecutar comando de notificaciones en modo silencioso
-            logger.info("Ejecutando verificación automática de notificaciones de mantenimiento")
-            call_command(
-                'enviar_notificaciones_mantenimiento',
-                **{'silencioso': True, 'usuario_id': request.user.id}
-            )
+            # Verificar si es momento de hacer la comprobación y si le toca a este proceso
+            if not self._adquirir_concesion():
+                return None
             
-            # Actualizar tiempo de última verificación
-            NotificacionesMantenimientoMiddleware._ultima_verificacion = datetime.now()
+            # Solo se encola: el trabajador procesar_cola_notificaciones hace el cálculo y el envío
+            logger.info("Encolando barrido automático de notificaciones de mantenimiento")
+            TareaNotificacion.encolar()
             
         except Exception as e:
             # Log del error pero no interrumpir la navegación del usuario
@@ -50,15 +52,26 @@ class NotificacionesMantenimientoMiddleware(MiddlewareMixin):
         
         return None
     
-    def _debe_verificar(self):
+    def _adquirir_concesion(self):
         """
-        Determina si es momento de verificar notificaciones
+        Devuelve True si este proceso ha adquirido el barrido actual.
+        
+        Mientras la concesión conocida no haya expirado se responde sin
+        consultar la base de datos; después, una única actualización
+        condicional decide qué proceso se la queda.
         """
-        if self._ultima_verificacion is None:
-            return True
+        ahora = timezone.now()
+        expira = NotificacionesMantenimientoMiddleware._concesion_expira
+        if expira is not None and ahora < expira:
+            return False
         
-        tiempo_transcurrido = datetime.now() - self._ultima_verificacion
-        return tiempo_transcurrido >= self._intervalo_verificacion
+        adquirida, expira = Concesion.adquirir(
+            self.NOMBRE_CONCESION,
+            self._intervalo_verificacion,
+            titular=f'{socket.gethostname()}:{os.getpid()}'
+        )
+        NotificacionesMantenimientoMiddleware._concesion_expira = expira
+        return adquirida
     
     def _es_request_apropiado(self, request):
         """
@@ -110,11 +123,8 @@ class NotificacionesProgramadasMiddleware(MiddlewareMixin):
             return None
         
         try:
-            logger.info(f"Verificación diaria de notificaciones para usuario {request.user.username}")
-            call_command(
-                'enviar_notificaciones_mantenimiento',
-                **{'silencioso': True, 'usuario_id': request.user.id}
-            )
+            logger.info(f"Encolando verificación diaria de notificaciones para usuario {request.user.username}")
+            TareaNotificacion.encolar(request.user.id)
             
             # Marcar como verificado hoy
             self._marcar_verificado_hoy(request.user)
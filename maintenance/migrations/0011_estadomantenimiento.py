@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0010_notificacionmantenimiento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadoMantenimiento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_ultimo', models.DateField(verbose_name='Fecha del último mantenimiento')),
+                ('km_ultimo', models.PositiveIntegerField(verbose_name='Kilometraje del último mantenimiento')),
+                ('intervalo_km', models.PositiveIntegerField(default=0, verbose_name='Intervalo efectivo en kilómetros')),
+                ('intervalo_meses', models.PositiveIntegerField(default=0, verbose_name='Intervalo efectivo en meses')),
+                ('proximo_km', models.PositiveIntegerField(blank=True, null=True, verbose_name='Próximo mantenimiento (km)')),
+                ('proxima_fecha', models.DateField(blank=True, null=True, verbose_name='Próximo mantenimiento (fecha)')),
+                ('km_restantes', models.IntegerField(blank=True, help_text='Negativo si ya se ha superado el kilometraje previsto', null=True, verbose_name='Kilómetros restantes')),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True, verbose_name='Última actualización')),
+                ('tipo_mantenimiento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='maintenance.tipomantenimiento', verbose_name='Tipo de mantenimiento')),
+                ('ultimo_registro', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='maintenance.registromantenimiento', verbose_name='Último registro')),
+                ('vehiculo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estados_mantenimiento', to='maintenance.vehiculo', verbose_name='Vehículo')),
+            ],
+            options={
+                'verbose_name': 'Estado de Mantenimiento',
+                'verbose_name_plural': 'Estados de Mantenimiento',
+                'ordering': ['vehiculo', 'tipo_mantenimiento'],
+                'indexes': [models.Index(fields=['proxima_fecha'], name='estado_proxima_fecha_idx'), models.Index(fields=['km_restantes'], name='estado_km_restantes_idx')],
+                'unique_together': {('vehiculo', 'tipo_mantenimiento')},
+            },
+        ),
+    ]
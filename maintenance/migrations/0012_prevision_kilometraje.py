@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0011_estadomantenimiento'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='estadomantenimiento',
+            name='estado_proxima_fecha_idx',
+        ),
+        migrations.AddField(
+            model_name='estadomantenimiento',
+            name='fecha_prevista',
+            field=models.DateField(blank=True, help_text='La más temprana entre la fecha por tiempo y la prevista por kilometraje', null=True, verbose_name='Fecha prevista'),
+        ),
+        migrations.AddField(
+            model_name='estadomantenimiento',
+            name='fecha_prevista_km',
+            field=models.DateField(blank=True, help_text='Cuándo se alcanzará el próximo kilometraje según los km diarios estimados', null=True, verbose_name='Fecha prevista por kilometraje'),
+        ),
+        migrations.AddField(
+            model_name='vehiculo',
+            name='fecha_estimacion_km',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Fecha de la estimación de km diarios'),
+        ),
+        migrations.AddField(
+            model_name='vehiculo',
+            name='km_diarios_estimados',
+            field=models.FloatField(blank=True, help_text='Estimación calculada a partir del historial de mantenimientos', null=True, verbose_name='Km diarios estimados'),
+        ),
+        migrations.AddIndex(
+            model_name='estadomantenimiento',
+            index=models.Index(fields=['fecha_prevista'], name='estado_fecha_prevista_idx'),
+        ),
+    ]
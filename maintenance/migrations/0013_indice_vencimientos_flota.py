@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0012_prevision_kilometraje'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='estadomantenimiento',
+            name='estado_fecha_prevista_idx',
+        ),
+        migrations.AlterField(
+            model_name='estadomantenimiento',
+            name='fecha_prevista',
+            field=models.DateField(blank=True, help_text='Fecha de vencimiento más temprana (por tiempo, por kilometraje previsto o ya superado)', null=True, verbose_name='Fecha prevista'),
+        ),
+        migrations.AddIndex(
+            model_name='estadomantenimiento',
+            index=models.Index(fields=['fecha_prevista', 'id'], name='estado_vencimiento_idx'),
+        ),
+    ]
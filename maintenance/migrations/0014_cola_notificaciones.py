@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('maintenance', '0013_indice_vencimientos_flota'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TareaNotificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('completada', 'Completada'), ('error', 'Error')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('intentos', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('fecha_disponible', models.DateTimeField(default=django.utils.timezone.now, help_text='La tarea no se procesa antes de esta fecha (reintentos)', verbose_name='Disponible desde')),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de inicio')),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de finalización')),
+                ('trabajador', models.CharField(blank=True, help_text='Proceso que ha reclamado la tarea', max_length=100, verbose_name='Trabajador')),
+                ('ultimo_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('usuario', models.ForeignKey(blank=True, help_text='Vacío para verificar a todos los usuarios', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tareas_notificacion', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Tarea de Notificación',
+                'verbose_name_plural': 'Tareas de Notificación',
+                'ordering': ['fecha_disponible', 'id'],
+                'indexes': [models.Index(fields=['estado', 'fecha_disponible'], name='tarea_notif_cola_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='tareanotificacion',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ['pendiente', 'en_curso'])), fields=('usuario',), name='tarea_notif_activa_unica'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0014_cola_notificaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Concesion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=100, unique=True, verbose_name='Nombre')),
+                ('titular', models.CharField(blank=True, help_text='Proceso que tiene la concesión', max_length=100, verbose_name='Titular')),
+                ('expira', models.DateTimeField(verbose_name='Expira')),
+                ('fecha_adquisicion', models.DateTimeField(verbose_name='Fecha de adquisición')),
+            ],
+            options={
+                'verbose_name': 'Concesión',
+                'verbose_name_plural': 'Concesiones',
+                'ordering': ['nombre'],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0015_concesiones'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificacionmantenimiento',
+            index=models.Index(fields=['usuario', 'vehiculo', 'tipo_mantenimiento', 'tipo_alerta', 'fecha_envio'], name='notif_antispam_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacionmantenimiento',
+            index=models.Index(fields=['fecha_envio'], name='notif_fecha_envio_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 01:59
+
+from datetime import date
+
+from django.db import migrations, models
+
+
+def revisar_existentes(apps, schema_editor):
+    """Los estados existentes se revisan en la primera pasada del programador, que calcula su fecha"""
+    EstadoMantenimiento = apps.get_model('maintenance', 'EstadoMantenimiento')
+    EstadoMantenimiento.objects.update(proxima_revision=date.today())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0016_indices_notificaciones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='estadomantenimiento',
+            name='proxima_revision',
+            field=models.DateField(blank=True, help_text='Primer día en que el paso del tiempo puede cambiar el aviso de este mantenimiento', null=True, verbose_name='Próxima revisión'),
+        ),
+        migrations.AddIndex(
+            model_name='estadomantenimiento',
+            index=models.Index(fields=['proxima_revision'], name='estado_revision_idx'),
+        ),
+        migrations.RunPython(revisar_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('maintenance', '0017_proxima_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorreoSaliente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destinatario', models.EmailField(max_length=254, verbose_name='Destinatario')),
+                ('asunto', models.CharField(max_length=255, verbose_name='Asunto')),
+                ('cuerpo_texto', models.TextField(verbose_name='Cuerpo (texto plano)')),
+                ('cuerpo_html', models.TextField(blank=True, verbose_name='Cuerpo (HTML)')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviado', 'Enviado'), ('error', 'Error')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('intentos', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('proximo_intento', models.DateTimeField(default=django.utils.timezone.now, help_text='El email no se envía antes de esta fecha (reintentos y envíos en curso)', verbose_name='Próximo intento')),
+                ('ultimo_error', models.TextField(blank=True, verbose_name='Último error')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('fecha_envio', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de envío')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='correos_salientes', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Correo Saliente',
+                'verbose_name_plural': 'Correos Salientes',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.AddField(
+            model_name='notificacionmantenimiento',
+            name='correo',
+            field=models.ForeignKey(blank=True, help_text='Email de la bandeja de salida que incluye esta notificación', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notificaciones', to='maintenance.correosaliente', verbose_name='Correo'),
+        ),
+        migrations.AddIndex(
+            model_name='correosaliente',
+            index=models.Index(fields=['estado', 'proximo_intento'], name='correo_saliente_cola_idx'),
+        ),
+    ]
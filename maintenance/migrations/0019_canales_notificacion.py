@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('maintenance', '0018_bandeja_salida'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CanalNotificacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('email', 'Email'), ('webhook', 'Webhook HTTP'), ('archivo', 'Archivo NDJSON')], max_length=20, verbose_name='Tipo')),
+                ('destino', models.CharField(blank=True, help_text='URL del webhook o nombre del fichero; vacío en email (se usa el del usuario)', max_length=500, verbose_name='Destino')),
+                ('activo', models.BooleanField(default=True, verbose_name='Activo')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de creación')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='canales_notificacion', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Canal de Notificación',
+                'verbose_name_plural': 'Canales de Notificación',
+                'ordering': ['usuario', 'tipo'],
+                'unique_together': {('usuario', 'tipo', 'destino')},
+            },
+        ),
+    ]
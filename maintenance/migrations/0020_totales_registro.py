@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:08
+
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def calcular_existentes(apps, schema_editor):
+    """Rellena los totales de los registros existentes (equivale a reconstruir_totales_registros)"""
+    RegistroMantenimiento = apps.get_model('maintenance', 'RegistroMantenimiento')
+    ItemMantenimiento = apps.get_model('maintenance', 'ItemMantenimiento')
+
+    items_por_registro = defaultdict(list)
+    for registro_id, cantidad, costo_unitario, nombre, categoria in ItemMantenimiento.objects.order_by(
+        'tipo_mantenimiento__nombre', 'id'
+    ).values_list('registro_id', 'cantidad', 'costo_unitario', 'tipo_mantenimiento__nombre', 'tipo_mantenimiento__categoria'):
+        items_por_registro[registro_id].append((cantidad * costo_unitario, nombre, categoria))
+
+    registros = list(RegistroMantenimiento.objects.all())
+    for registro in registros:
+        items = items_por_registro[registro.id]
+        nombres = list(dict.fromkeys(nombre for _, nombre, _ in items))
+        categorias = {categoria for _, _, categoria in items}
+        registro.costo_materiales_total = sum((costo for costo, _, _ in items), Decimal('0.00'))
+        registro.costo_subtotal = registro.costo_materiales_total + (registro.costo_mano_obra_total or Decimal('0.00'))
+        registro.costo_iva = Decimal('0.00') if registro.iva_incluido else (registro.costo_subtotal * Decimal('0.21')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        registro.costo_total = registro.costo_subtotal + registro.costo_iva
+        registro.numero_items = len(items)
+        if len(nombres) > 2:
+            registro.resumen_trabajos = f"{nombres[0]}, {nombres[1]} y {len(nombres) - 2} más"[:200]
+        else:
+            registro.resumen_trabajos = ", ".join(nombres)[:200]
+        registro.categoria_trabajos = categorias.pop() if len(categorias) == 1 else ''
+    RegistroMantenimiento.objects.bulk_update(registros, [
+        'costo_materiales_total', 'costo_subtotal', 'costo_iva', 'costo_total',
+        'numero_items', 'resumen_trabajos', 'categoria_trabajos',
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0019_canales_notificacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registromantenimiento',
+            name='categoria_trabajos',
+            field=models.CharField(blank=True, choices=[('motor', 'Motor'), ('transmision', 'Transmisión'), ('frenos', 'Frenos'), ('neumaticos', 'Neumáticos'), ('suspension', 'Suspensión'), ('electrico', 'Sistema Eléctrico'), ('climatizacion', 'Climatización'), ('filtros', 'Filtros'), ('otros', 'Otros')], editable=False, help_text='Vacía si los trabajos son de varias categorías', max_length=20, verbose_name='Categoría de los trabajos'),
+        ),
+        migrations.AddField(
+            model_name='registromantenimiento',
+            name='costo_iva',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10, verbose_name='Importe del IVA'),
+        ),
+        migrations.AddField(
+            model_name='registromantenimiento',
+            name='costo_materiales_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10, verbose_name='Costo total de materiales'),
+        ),
+        migrations.AddField(
+            model_name='registromantenimiento',
+            name='costo_subtotal',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10, verbose_name='Subtotal sin IVA'),
+        ),
+        migrations.AddField(
+            model_name='registromantenimiento',
+            name='costo_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=10, verbose_name='Costo total'),
+        ),
+        migrations.AddField(
+            model_name='registromantenimiento',
+            name='numero_items',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Número de trabajos'),
+        ),
+        migrations.AddField(
+            model_name='registromantenimiento',
+            name='resumen_trabajos',
+            field=models.CharField(blank=True, editable=False, max_length=200, verbose_name='Trabajos realizados'),
+        ),
+        migrations.RunPython(calcular_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+from django.core.management import call_command
+from django.db import migrations
+
+
+def crear_tabla_cache(apps, schema_editor):
+    """
+    La caché por defecto está en la base de datos (DatabaseCache) y la usan
+    el resumen de inicio, el catálogo, el calendario y los gastos; así basta
+    con ``migrate`` para tenerla. No hace nada con otros backends.
+    """
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0020_totales_registro'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_tabla_cache, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:18
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+from django.utils import timezone
+
+
+def quitar_barridos_duplicados(apps, schema_editor):
+    """Deja un solo barrido global activo: el que está en curso ('en_curso' < 'pendiente') o, si no, el más antiguo"""
+    TareaNotificacion = apps.get_model('maintenance', 'TareaNotificacion')
+    activas = list(
+        TareaNotificacion.objects.filter(usuario__isnull=True, estado__in=['pendiente', 'en_curso'])
+        .order_by('estado', 'fecha_creacion', 'id').values_list('id', flat=True)
+    )
+    TareaNotificacion.objects.filter(id__in=activas[1:]).update(
+        estado='error', fecha_fin=timezone.now(), ultimo_error='Barrido global duplicado'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0021_tabla_cache'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='tareanotificacion',
+            name='tarea_notif_activa_unica',
+        ),
+        migrations.AddField(
+            model_name='tareanotificacion',
+            name='fecha_latido',
+            field=models.DateTimeField(blank=True, help_text='Lo renueva el trabajador mientras la tarea sigue en curso', null=True, verbose_name='Último latido'),
+        ),
+        migrations.RunPython(quitar_barridos_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='tareanotificacion',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('usuario', models.Value(0)), condition=models.Q(('estado__in', ['pendiente', 'en_curso'])), name='tarea_notif_activa_unica'),
+        ),
+    ]
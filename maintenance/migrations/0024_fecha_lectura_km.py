@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def fechar_lecturas(apps, schema_editor):
+    """La última edición del vehículo es lo más cercano que hay a la fecha de su lectura"""
+    Vehiculo = apps.get_model('maintenance', 'Vehiculo')
+    Vehiculo.objects.update(fecha_lectura_km=models.F('fecha_actualizacion'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenance', '0023_tarea_global_unica'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehiculo',
+            name='fecha_lectura_km',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text='Cuándo se anotó el kilometraje actual; solo cambia al cambiar el kilometraje', verbose_name='Fecha de la lectura del kilometraje'),
+        ),
+        migrations.RunPython(fechar_lecturas, migrations.RunPython.noop),
+    ]
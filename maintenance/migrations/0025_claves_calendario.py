@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('maintenance', '0024_fecha_lectura_km'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaveCalendario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=64, verbose_name='Clave')),
+                ('fecha_renovacion', models.DateTimeField(auto_now=True, verbose_name='Fecha de renovación')),
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='clave_calendario', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Clave de Calendario',
+                'verbose_name_plural': 'Claves de Calendario',
+                'ordering': ['usuario'],
+            },
+        ),
+    ]
@@ -1,6 +1,10 @@
 from django.db import models
+from django.db.models.functions import Coalesce, Round
 from django.contrib.auth.models import User
-from decimal import Decimal
+from django.utils import timezone
+import secrets
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
 
 
 class Vehiculo(models.Model):
@@ -61,6 +65,26 @@ class Vehiculo(models.Model):
         default=0
     )
     
+    fecha_lectura_km = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name="Fecha de la lectura del kilometraje",
+        help_text="Cuándo se anotó el kilometraje actual; solo cambia al cambiar el kilometraje"
+    )
+    
+    km_diarios_estimados = models.FloatField(
+        verbose_name="Km diarios estimados",
+        help_text="Estimación calculada a partir del historial de mantenimientos",
+        null=True,
+        blank=True
+    )
+    
+    fecha_estimacion_km = models.DateTimeField(
+        verbose_name="Fecha de la estimación de km diarios",
+        null=True,
+        blank=True
+    )
+    
     fecha_creacion = models.DateTimeField(
         auto_now_add=True,
         verbose_name="Fecha de registro"
@@ -79,6 +103,28 @@ class Vehiculo(models.Model):
     def __str__(self):
         return f"{self.marca} {self.modelo}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Kilometraje leído de la base de datos, para saber si ha cambiado al guardar
+        instancia._km_guardado = instancia.__dict__.get('kilometraje_actual')
+        return instancia
+    
+    def save(self, *args, **kwargs):
+        """Fecha una nueva lectura del odómetro solo cuando cambia el kilometraje"""
+        update_fields = kwargs.get('update_fields')
+        km_cambiado = (
+            'kilometraje_actual' not in self.get_deferred_fields() and
+            (update_fields is None or 'kilometraje_actual' in update_fields) and
+            self.kilometraje_actual != getattr(self, '_km_guardado', None)
+        )
+        if km_cambiado and not self._state.adding:
+            self.fecha_lectura_km = timezone.now()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'fecha_lectura_km'}
+        super().save(*args, **kwargs)
+        self._km_guardado = self.kilometraje_actual
+    
     def nombre_completo(self):
         """Devuelve el nombre completo del vehículo"""
         año_str = f" {self.año}" if self.año else ""
@@ -233,6 +279,50 @@ class IntervaloMantenimiento(models.Model):
                 self.intervalo_meses_personalizado > 0)
 
 
+class RegistroMantenimientoQuerySet(models.QuerySet):
+    
+    def with_costs(self):
+        """
+        Anota los costes calculados en la base de datos a partir de los ítems:
+        ``materiales_calculado``, ``mano_obra_calculado``, ``subtotal_calculado``,
+        ``iva_calculado`` (21% si no está incluido), ``total_calculado`` y
+        ``numero_items_calculado``.
+        
+        Los materiales salen de una subconsulta por registro y no de un JOIN,
+        así que se pueden combinar con filtros sobre los ítems y con
+        ``aggregate()`` sin contar dos veces.
+        """
+        dinero = models.DecimalField(max_digits=12, decimal_places=2)
+        cero = models.Value(Decimal('0.00'), output_field=dinero)
+        items = ItemMantenimiento.objects.filter(registro=models.OuterRef('pk')).order_by().values('registro')
+        materiales = items.annotate(
+            total=models.Sum(models.F('cantidad') * models.F('costo_unitario'), output_field=dinero)
+        ).values('total')
+        numero_items = items.annotate(total=models.Count('id')).values('total')
+        
+        return self.annotate(
+            materiales_calculado=Coalesce(models.Subquery(materiales, output_field=dinero), cero),
+            mano_obra_calculado=Coalesce('costo_mano_obra_total', cero, output_field=dinero),
+            numero_items_calculado=Coalesce(models.Subquery(numero_items), 0),
+        ).annotate(
+            subtotal_calculado=models.ExpressionWrapper(
+                models.F('materiales_calculado') + models.F('mano_obra_calculado'), output_field=dinero
+            ),
+        ).annotate(
+            iva_calculado=models.Case(
+                models.When(iva_incluido=True, then=cero),
+                default=Round(models.F('subtotal_calculado') * models.Value(Decimal('0.21')), 2),
+                output_field=dinero,
+            ),
+        ).annotate(
+            # Redondeado para poder compararlo con costo_total también en SQLite,
+            # donde la suma se hace en coma flotante
+            total_calculado=Round(
+                models.F('subtotal_calculado') + models.F('iva_calculado'), 2, output_field=dinero
+            ),
+        )
+
+
 class RegistroMantenimiento(models.Model):
     """Modelo para registrar una sesión de mantenimiento en el taller"""
     
@@ -281,51 +371,145 @@ class RegistroMantenimiento(models.Model):
         help_text="Marcar si los precios ya incluyen IVA. Si no está marcado, se añadirá 21% al total"
     )
     
+    # Totales y resumen de los ítems, desnormalizados para que los listados no
+    # tengan que leer los ítems; los mantiene actualizar_totales
+    costo_materiales_total = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Costo total de materiales"
+    )
+    
+    costo_subtotal = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Subtotal sin IVA"
+    )
+    
+    costo_iva = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Importe del IVA"
+    )
+    
+    costo_total = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name="Costo total"
+    )
+    
+    numero_items = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name="Número de trabajos"
+    )
+    
+    resumen_trabajos = models.CharField(
+        max_length=200,
+        blank=True,
+        editable=False,
+        verbose_name="Trabajos realizados"
+    )
+    
+    categoria_trabajos = models.CharField(
+        max_length=20,
+        choices=TipoMantenimiento.CATEGORIA_CHOICES,
+        blank=True,
+        editable=False,
+        verbose_name="Categoría de los trabajos",
+        help_text="Vacía si los trabajos son de varias categorías"
+    )
+    
     fecha_creacion = models.DateTimeField(
         auto_now_add=True,
         verbose_name="Fecha de registro"
     )
     
+    objects = RegistroMantenimientoQuerySet.as_manager()
+    
+    CAMPOS_TOTALES = [
+        'costo_materiales_total', 'costo_subtotal', 'costo_iva', 'costo_total',
+        'numero_items', 'resumen_trabajos', 'categoria_trabajos',
+    ]
+    
     class Meta:
         verbose_name = "Registro de Mantenimiento"
         verbose_name_plural = "Registros de Mantenimiento"
         ordering = ['-fecha_realizacion']
     
     def __str__(self):
-        items_count = self.items.count()
-        if items_count == 1:
-            return f"{self.vehiculo} - {self.items.first().tipo_mantenimiento.nombre} ({self.fecha_realizacion})"
-        elif items_count > 1:
-            return f"{self.vehiculo} - Mantenimiento múltiple ({items_count} trabajos) ({self.fecha_realizacion})"
+        if self.numero_items == 1:
+            return f"{self.vehiculo} - {self.resumen_trabajos} ({self.fecha_realizacion})"
+        elif self.numero_items > 1:
+            return f"{self.vehiculo} - Mantenimiento múltiple ({self.numero_items} trabajos) ({self.fecha_realizacion})"
         else:
             return f"{self.vehiculo} - Mantenimiento ({self.fecha_realizacion})"
     
-    @property
-    def costo_materiales_total(self):
-        """Calcula el costo total de todos los materiales/piezas"""
-        total = sum(item.costo_total for item in self.items.all())
-        return Decimal(str(total)) if total else Decimal('0.00')
-    
-    @property
-    def costo_subtotal(self):
-        """Calcula el subtotal (materiales + mano de obra) sin IVA"""
-        materiales = self.costo_materiales_total
-        mano_obra = self.costo_mano_obra_total or Decimal('0.00')
-        return materiales + mano_obra
+    def save(self, *args, **kwargs):
+        """La mano de obra y el IVA cambian el subtotal y el total"""
+        self.calcular_costes()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'costo_subtotal', 'costo_iva', 'costo_total'}
+        super().save(*args, **kwargs)
     
-    @property
-    def costo_iva(self):
-        """Calcula el importe del IVA (21%)"""
+    def calcular_costes(self):
+        """Calcula subtotal, IVA (21%) y total a partir de los materiales y la mano de obra"""
+        self.costo_subtotal = self.costo_materiales_total + (self.costo_mano_obra_total or Decimal('0.00'))
         if self.iva_incluido:
-            return Decimal('0.00')
-        return self.costo_subtotal * Decimal('0.21')
+            self.costo_iva = Decimal('0.00')
+        else:
+            self.costo_iva = (self.costo_subtotal * Decimal('0.21')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        self.costo_total = self.costo_subtotal + self.costo_iva
+    
+    @staticmethod
+    def resumir_trabajos(nombres):
+        """Resumen corto de los trabajos: los dos primeros nombres y cuántos más hay"""
+        if len(nombres) > 2:
+            resumen = f"{nombres[0]}, {nombres[1]} y {len(nombres) - 2} más"
+        else:
+            resumen = ", ".join(nombres)
+        return resumen[:200]
     
-    @property
-    def costo_total(self):
-        """Calcula el costo total final (con o sin IVA según corresponda)"""
-        if self.iva_incluido:
-            return self.costo_subtotal
-        return self.costo_subtotal + self.costo_iva
+    @classmethod
+    def actualizar_totales(cls, registro_ids):
+        """
+        Recalcula desde sus ítems los totales y el resumen de los registros
+        indicados, con una lectura de los ítems y un bulk_update. Devuelve el
+        número de registros actualizados.
+        """
+        registros = list(cls.objects.filter(id__in=list(registro_ids)).only(
+            'id', 'costo_mano_obra_total', 'iva_incluido'
+        ))
+        if not registros:
+            return 0
+        
+        items_por_registro = defaultdict(list)
+        for registro_id, cantidad, costo_unitario, nombre, categoria in ItemMantenimiento.objects.filter(
+            registro_id__in=[registro.id for registro in registros]
+        ).order_by('tipo_mantenimiento__nombre', 'id').values_list(
+            'registro_id', 'cantidad', 'costo_unitario',
+            'tipo_mantenimiento__nombre', 'tipo_mantenimiento__categoria'
+        ):
+            items_por_registro[registro_id].append((cantidad * costo_unitario, nombre, categoria))
+        
+        for registro in registros:
+            items = items_por_registro[registro.id]
+            categorias = {categoria for _, _, categoria in items}
+            registro.costo_materiales_total = sum((costo for costo, _, _ in items), Decimal('0.00'))
+            registro.numero_items = len(items)
+            registro.resumen_trabajos = cls.resumir_trabajos(list(dict.fromkeys(nombre for _, nombre, _ in items)))
+            registro.categoria_trabajos = categorias.pop() if len(categorias) == 1 else ''
+            registro.calcular_costes()
+        
+        cls.objects.bulk_update(registros, cls.CAMPOS_TOTALES, batch_size=500)
+        return len(registros)
     
     def get_desglose_costos(self):
         """Retorna un diccionario con el desglose detallado de costos"""
@@ -426,12 +610,126 @@ class ItemMantenimiento(models.Model):
     def __str__(self):
         return f"{self.descripcion} ({self.cantidad}x {self.costo_unitario}€)"
     
+    def save(self, *args, **kwargs):
+        """Guarda el ítem y, en la misma transacción (señal post_save), los totales de su registro"""
+        from django.db import transaction
+        
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
     @property
     def costo_total(self):
         """Calcula el costo total del ítem (cantidad × precio unitario)"""
         return self.cantidad * self.costo_unitario
 
 
+class EstadoMantenimiento(models.Model):
+    """Estado materializado de cada tipo de mantenimiento en un vehículo.
+
+    Se mantiene actualizado desde las señales de ``maintenance.signals`` y se
+    puede reconstruir con ``manage.py reconstruir_estados_mantenimiento``.
+    """
+    
+    vehiculo = models.ForeignKey(
+        Vehiculo,
+        on_delete=models.CASCADE,
+        verbose_name="Vehículo",
+        related_name="estados_mantenimiento"
+    )
+    
+    tipo_mantenimiento = models.ForeignKey(
+        TipoMantenimiento,
+        on_delete=models.CASCADE,
+        verbose_name="Tipo de mantenimiento"
+    )
+    
+    ultimo_registro = models.ForeignKey(
+        RegistroMantenimiento,
+        on_delete=models.CASCADE,
+        verbose_name="Último registro",
+        related_name="+"
+    )
+    
+    fecha_ultimo = models.DateField(
+        verbose_name="Fecha del último mantenimiento"
+    )
+    
+    km_ultimo = models.PositiveIntegerField(
+        verbose_name="Kilometraje del último mantenimiento"
+    )
+    
+    intervalo_km = models.PositiveIntegerField(
+        verbose_name="Intervalo efectivo en kilómetros",
+        default=0
+    )
+    
+    intervalo_meses = models.PositiveIntegerField(
+        verbose_name="Intervalo efectivo en meses",
+        default=0
+    )
+    
+    proximo_km = models.PositiveIntegerField(
+        verbose_name="Próximo mantenimiento (km)",
+        null=True,
+        blank=True
+    )
+    
+    proxima_fecha = models.DateField(
+        verbose_name="Próximo mantenimiento (fecha)",
+        null=True,
+        blank=True
+    )
+    
+    km_restantes = models.IntegerField(
+        verbose_name="Kilómetros restantes",
+        help_text="Negativo si ya se ha superado el kilometraje previsto",
+        null=True,
+        blank=True
+    )
+    
+    fecha_prevista_km = models.DateField(
+        verbose_name="Fecha prevista por kilometraje",
+        help_text="Cuándo se alcanzará el próximo kilometraje según los km diarios estimados",
+        null=True,
+        blank=True
+    )
+    
+    fecha_prevista = models.DateField(
+        verbose_name="Fecha prevista",
+        help_text="Fecha de vencimiento más temprana (por tiempo, por kilometraje previsto o ya superado)",
+        null=True,
+        blank=True
+    )
+    
+    proxima_revision = models.DateField(
+        verbose_name="Próxima revisión",
+        help_text="Primer día en que el paso del tiempo puede cambiar el aviso de este mantenimiento",
+        null=True,
+        blank=True
+    )
+    
+    fecha_actualizacion = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Última actualización"
+    )
+    
+    class Meta:
+        verbose_name = "Estado de Mantenimiento"
+        verbose_name_plural = "Estados de Mantenimiento"
+        unique_together = ['vehiculo', 'tipo_mantenimiento']
+        ordering = ['vehiculo', 'tipo_mantenimiento']
+        indexes = [
+            # Listado de vencimientos de toda la flota: rango sobre fecha_prevista ya ordenado
+            models.Index(fields=['fecha_prevista', 'id'], name='estado_vencimiento_idx'),
+            models.Index(fields=['km_restantes'], name='estado_km_restantes_idx'),
+            # El programador de revisiones solo lee los estados cuya revisión ha llegado
+            models.Index(fields=['proxima_revision'], name='estado_revision_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.vehiculo} - {self.tipo_mantenimiento.nombre}"
+
+
 class UserRegistrationRequest(models.Model):
     """Modelo para almacenar solicitudes de registro de usuarios pendientes de aprobación"""
     
@@ -511,6 +809,7 @@ class UserRegistrationRequest(models.Model):
         """Aprobar la solicitud y crear el usuario"""
         from django.contrib.auth.models import User
         from django.contrib.auth.hashers import make_password
+        from django.db import transaction
         from django.utils import timezone
         
         if self.status != 'pendiente':
@@ -520,27 +819,87 @@ class UserRegistrationRequest(models.Model):
         if User.objects.filter(username=self.username).exists():
             raise ValueError("El nombre de usuario ya existe")
         
-        # Crear el usuario
-        user = User.objects.create(
-            username=self.username,
-            email=self.email,
-            first_name=self.first_name,
-            last_name=self.last_name,
-            password=self.password_hash,  # Ya viene hasheada
-            is_active=True
-        )
+        # El usuario y la solicitud se guardan juntos; el email sale al confirmar
+        with transaction.atomic():
+            # Crear el usuario
+            user = User.objects.create(
+                username=self.username,
+                email=self.email,
+                first_name=self.first_name,
+                last_name=self.last_name,
+                password=self.password_hash,  # Ya viene hasheada
+                is_active=True
+            )
+            
+            # Actualizar la solicitud
+            self.status = 'aprobado'
+            self.fecha_procesado = timezone.now()
+            self.procesado_por = admin_user
+            self.notas = notas
+            self.save()
+            
+            # Enviar email de notificación al usuario aprobado
+            self._enviar_email_aprobacion()
         
-        # Actualizar la solicitud
-        self.status = 'aprobado'
-        self.fecha_procesado = timezone.now()
-        self.procesado_por = admin_user
-        self.notas = notas
-        self.save()
+        return user
+    
+    @classmethod
+    def aprobar_en_bloque(cls, solicitudes, admin_user, notas=""):
+        """
+        Aprueba de una vez varias solicitudes pendientes.
         
-        # Enviar email de notificación al usuario aprobado
-        self._enviar_email_aprobacion()
+        Los conflictos de nombre de usuario se comprueban con una sola
+        consulta, y los usuarios y las solicitudes se guardan en bloque dentro
+        de una transacción. Los emails se encolan juntos al confirmarla.
+        Devuelve (usuarios creados, errores).
+        """
+        from django.db import transaction
+        from .correo import encolar_correos
         
-        return user
+        pendientes = list(solicitudes.filter(status='pendiente'))
+        existentes = set(User.objects.filter(
+            username__in=[solicitud.username for solicitud in pendientes]
+        ).values_list('username', flat=True))
+        
+        aprobadas = []
+        errores = []
+        for solicitud in pendientes:
+            if solicitud.username in existentes:
+                errores.append(f"Error con {solicitud.username}: El nombre de usuario ya existe")
+                continue
+            # Dos solicitudes con el mismo nombre: solo se aprueba la primera
+            existentes.add(solicitud.username)
+            aprobadas.append(solicitud)
+        
+        ahora = timezone.now()
+        with transaction.atomic():
+            usuarios = User.objects.bulk_create([
+                User(
+                    username=solicitud.username,
+                    email=solicitud.email,
+                    first_name=solicitud.first_name,
+                    last_name=solicitud.last_name,
+                    password=solicitud.password_hash,  # Ya viene hasheada
+                    is_active=True
+                )
+                for solicitud in aprobadas
+            ], batch_size=500)
+            for solicitud in aprobadas:
+                solicitud.status = 'aprobado'
+                solicitud.fecha_procesado = ahora
+                solicitud.procesado_por = admin_user
+                solicitud.notas = notas
+            cls.objects.bulk_update(
+                aprobadas, ['status', 'fecha_procesado', 'procesado_por', 'notas'], batch_size=500
+            )
+            
+            login_url = aprobadas[0]._get_login_url() if aprobadas else None
+            encolar_correos([
+                (solicitud.email, *solicitud._email_aprobacion(login_url), '', usuario)
+                for solicitud, usuario in zip(aprobadas, usuarios)
+            ])
+        
+        return usuarios, errores
     
     def rechazar(self, admin_user, notas=""):
         """Rechazar la solicitud"""
@@ -586,16 +945,19 @@ class UserRegistrationRequest(models.Model):
         return f"{protocol}://{domain}{settings.LOGIN_URL}"
 
     def _enviar_email_aprobacion(self):
-        """Enviar email de notificación cuando se aprueba la solicitud"""
-        try:
-            from django.core.mail import send_mail
-            from django.conf import settings
-            
-            # Obtener URL de login con dominio correcto
-            login_url = self._get_login_url()
-            
-            subject = '[Wheeler Keeper] ¡Tu solicitud ha sido aprobada!'
-            message = f"""
+        """Encolar el email de notificación cuando se aprueba la solicitud"""
+        from .correo import encolar_correo
+        
+        # Se entrega en segundo plano para no bloquear la aprobación
+        encolar_correo(self.email, *self._email_aprobacion())
+
+    def _email_aprobacion(self, login_url=None):
+        """Asunto y cuerpo del email de aprobación"""
+        # Obtener URL de login con dominio correcto
+        login_url = login_url or self._get_login_url()
+        
+        subject = '[Wheeler Keeper] ¡Tu solicitud ha sido aprobada!'
+        message = f"""
 Hola {self.first_name},
 
 ¡Excelentes noticias! Tu solicitud de registro en Wheeler Keeper ha sido aprobada.
@@ -611,28 +973,15 @@ Accede al sistema:
 
 Saludos,
 El equipo de Wheeler Keeper
-            """
-            
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[self.email],
-                fail_silently=False,
-            )
-            
-        except Exception as e:
-            # Log del error pero no fallar la aprobación
-            print(f"Error enviando email de aprobación a {self.email}: {str(e)}")
+        """
+        return subject, message
 
     def _enviar_email_rechazo(self, notas=""):
-        """Enviar email de notificación cuando se rechaza la solicitud"""
-        try:
-            from django.core.mail import send_mail
-            from django.conf import settings
-            
-            subject = '[Wheeler Keeper] Solicitud de registro no aprobada'
-            message = f"""
+        """Encolar el email de notificación cuando se rechaza la solicitud"""
+        from .correo import encolar_correo
+        
+        subject = '[Wheeler Keeper] Solicitud de registro no aprobada'
+        message = f"""
 Hola {self.first_name},
 
 Lamentamos informarte que tu solicitud de registro en Wheeler Keeper no ha sido aprobada en este momento.
@@ -648,19 +997,10 @@ Si tienes preguntas sobre esta decisión, puedes contactar con el administrador.
 
 Saludos,
 El equipo de Wheeler Keeper
-            """
-            
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[self.email],
-                fail_silently=False,
-            )
-            
-        except Exception as e:
-            # Log del error pero no fallar el rechazo
-            print(f"Error enviando email de rechazo a {self.email}: {str(e)}")
+        """
+        
+        # Se entrega en segundo plano para no bloquear el rechazo
+        encolar_correo(self.email, subject, message)
 
 
 class NotificacionMantenimiento(models.Model):
@@ -711,10 +1051,30 @@ class NotificacionMantenimiento(models.Model):
         verbose_name="Email enviado"
     )
     
+    correo = models.ForeignKey(
+        'CorreoSaliente',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="Correo",
+        help_text="Email de la bandeja de salida que incluye esta notificación",
+        related_name="notificaciones"
+    )
+    
     class Meta:
         verbose_name = "Notificación de Mantenimiento"
         verbose_name_plural = "Notificaciones de Mantenimiento"
         ordering = ['-fecha_envio']
+        indexes = [
+            # Cubre la comprobación anti-spam (debe_notificar / notificadas_recientes)
+            # sin tener que leer la tabla
+            models.Index(
+                fields=['usuario', 'vehiculo', 'tipo_mantenimiento', 'tipo_alerta', 'fecha_envio'],
+                name='notif_antispam_idx'
+            ),
+            # Listado del admin ordenado por fecha y purga de las antiguas
+            models.Index(fields=['fecha_envio'], name='notif_fecha_envio_idx'),
+        ]
     
     def __str__(self):
         return f"{self.usuario.username} - {self.vehiculo} - {self.tipo_mantenimiento.nombre} ({self.get_tipo_alerta_display()})"
@@ -738,6 +1098,43 @@ class NotificacionMantenimiento(models.Model):
         
         return not existe_reciente
     
+    @classmethod
+    def notificadas_recientes(cls, usuario_ids, horas=24):
+        """
+        Devuelve el conjunto de (usuario_id, vehiculo_id, tipo_mantenimiento_id, tipo_alerta)
+        notificados en las últimas ``horas`` para un lote de usuarios, en una sola consulta.
+        
+        Es la versión en bloque de ``debe_notificar``: un aviso se suprime si su
+        tupla está en el conjunto.
+        """
+        from datetime import timedelta
+        from django.utils import timezone
+        
+        return set(cls.objects.filter(
+            usuario_id__in=usuario_ids,
+            fecha_envio__gte=timezone.now() - timedelta(hours=horas)
+        ).values_list('usuario_id', 'vehiculo_id', 'tipo_mantenimiento_id', 'tipo_alerta'))
+    
+    @classmethod
+    def registrar_en_bloque(cls, notificaciones):
+        """
+        Registra de una vez varias notificaciones, cada una como
+        (usuario, vehiculo, tipo_mantenimiento, tipo_alerta, correo).
+        
+        Se registran como no enviadas; la entrega del correo las marca como enviadas.
+        """
+        return cls.objects.bulk_create([
+            cls(
+                usuario=usuario,
+                vehiculo=vehiculo,
+                tipo_mantenimiento=tipo_mantenimiento,
+                tipo_alerta=tipo_alerta,
+                kilometraje_notificado=vehiculo.kilometraje_actual,
+                correo=correo
+            )
+            for usuario, vehiculo, tipo_mantenimiento, tipo_alerta, correo in notificaciones
+        ], batch_size=500)
+    
     @classmethod
     def registrar_notificacion(cls, usuario, vehiculo, tipo_mantenimiento, tipo_alerta, email_enviado=True):
         """Registra una notificación enviada"""
@@ -749,3 +1146,383 @@ class NotificacionMantenimiento(models.Model):
             kilometraje_notificado=vehiculo.kilometraje_actual,
             email_enviado=email_enviado
         )
+
+
+class TareaNotificacion(models.Model):
+    """Cola en base de datos de verificaciones de notificaciones pendientes de procesar"""
+    
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('en_curso', 'En curso'),
+        ('completada', 'Completada'),
+        ('error', 'Error'),
+    ]
+    
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="Usuario",
+        help_text="Vacío para verificar a todos los usuarios",
+        related_name="tareas_notificacion"
+    )
+    
+    estado = models.CharField(
+        max_length=20,
+        choices=ESTADOS,
+        default='pendiente',
+        verbose_name="Estado"
+    )
+    
+    intentos = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Intentos"
+    )
+    
+    fecha_creacion = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Fecha de creación"
+    )
+    
+    fecha_disponible = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Disponible desde",
+        help_text="La tarea no se procesa antes de esta fecha (reintentos)"
+    )
+    
+    fecha_inicio = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Fecha de inicio"
+    )
+    
+    fecha_fin = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Fecha de finalización"
+    )
+    
+    fecha_latido = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Último latido",
+        help_text="Lo renueva el trabajador mientras la tarea sigue en curso"
+    )
+    
+    trabajador = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name="Trabajador",
+        help_text="Proceso que ha reclamado la tarea"
+    )
+    
+    ultimo_error = models.TextField(
+        blank=True,
+        verbose_name="Último error"
+    )
+    
+    class Meta:
+        verbose_name = "Tarea de Notificación"
+        verbose_name_plural = "Tareas de Notificación"
+        ordering = ['fecha_disponible', 'id']
+        indexes = [
+            models.Index(fields=['estado', 'fecha_disponible'], name='tarea_notif_cola_idx'),
+        ]
+        constraints = [
+            # Como mucho una tarea activa por usuario: encolar dos veces no duplica el trabajo.
+            # Sobre Coalesce(usuario, 0) para que también haya un solo barrido global
+            # activo: con la columna tal cual, los NULL no chocarían entre sí
+            models.UniqueConstraint(
+                Coalesce('usuario', models.Value(0)),
+                condition=models.Q(estado__in=['pendiente', 'en_curso']),
+                name='tarea_notif_activa_unica',
+            ),
+        ]
+    
+    def __str__(self):
+        destino = self.usuario.username if self.usuario_id else 'todos los usuarios'
+        return f"Notificaciones de {destino} ({self.get_estado_display()})"
+    
+    @classmethod
+    def encolar(cls, usuario_id=None):
+        """Encola una verificación si no hay ya una activa para ese usuario; no lanza errores de duplicado"""
+        from django.db import IntegrityError, transaction
+        
+        if cls.objects.filter(usuario_id=usuario_id, estado__in=['pendiente', 'en_curso']).exists():
+            return None
+        try:
+            with transaction.atomic():
+                return cls.objects.create(usuario_id=usuario_id)
+        except IntegrityError:
+            # Otra petición la ha encolado a la vez
+            return None
+
+
+class Concesion(models.Model):
+    """Concesión (lease) con caducidad para que una tarea la ejecute un solo proceso de todo el despliegue"""
+    
+    nombre = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name="Nombre"
+    )
+    
+    titular = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name="Titular",
+        help_text="Proceso que tiene la concesión"
+    )
+    
+    expira = models.DateTimeField(
+        verbose_name="Expira"
+    )
+    
+    fecha_adquisicion = models.DateTimeField(
+        verbose_name="Fecha de adquisición"
+    )
+    
+    class Meta:
+        verbose_name = "Concesión"
+        verbose_name_plural = "Concesiones"
+        ordering = ['nombre']
+    
+    def __str__(self):
+        return f"{self.nombre} ({self.titular} hasta {self.expira:%d/%m/%Y %H:%M})"
+    
+    @classmethod
+    def adquirir(cls, nombre, duracion, titular=''):
+        """
+        Intenta quedarse con la concesión ``nombre`` durante ``duracion`` (timedelta).
+        
+        Devuelve (adquirida, expira). La actualización condicional es atómica en
+        la base de datos, así que solo un proceso puede adquirirla mientras no
+        haya expirado.
+        """
+        from django.db import IntegrityError, transaction
+        
+        ahora = timezone.now()
+        expira = ahora + duracion
+        adquirida = cls.objects.filter(nombre=nombre, expira__lte=ahora).update(
+            titular=titular, expira=expira, fecha_adquisicion=ahora
+        )
+        if adquirida:
+            return True, expira
+        
+        # Si existe y sigue vigente, la tiene otro proceso
+        vigente = cls.objects.filter(nombre=nombre).values_list('expira', flat=True).first()
+        if vigente is not None:
+            return False, vigente
+        
+        try:
+            with transaction.atomic():
+                cls.objects.create(nombre=nombre, titular=titular, expira=expira, fecha_adquisicion=ahora)
+            return True, expira
+        except IntegrityError:
+            # Otro proceso la ha creado a la vez
+            return False, expira
+
+
+class CorreoSaliente(models.Model):
+    """Bandeja de salida: emails ya renderizados pendientes de entregar o reintentar"""
+    
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('enviado', 'Enviado'),
+        ('error', 'Error'),
+    ]
+    
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="Usuario",
+        related_name="correos_salientes"
+    )
+    
+    destinatario = models.EmailField(
+        verbose_name="Destinatario"
+    )
+    
+    asunto = models.CharField(
+        max_length=255,
+        verbose_name="Asunto"
+    )
+    
+    cuerpo_texto = models.TextField(
+        verbose_name="Cuerpo (texto plano)"
+    )
+    
+    cuerpo_html = models.TextField(
+        blank=True,
+        verbose_name="Cuerpo (HTML)"
+    )
+    
+    estado = models.CharField(
+        max_length=20,
+        choices=ESTADOS,
+        default='pendiente',
+        verbose_name="Estado"
+    )
+    
+    intentos = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name="Intentos"
+    )
+    
+    proximo_intento = models.DateTimeField(
+        default=timezone.now,
+        verbose_name="Próximo intento",
+        help_text="El email no se envía antes de esta fecha (reintentos y envíos en curso)"
+    )
+    
+    ultimo_error = models.TextField(
+        blank=True,
+        verbose_name="Último error"
+    )
+    
+    fecha_creacion = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Fecha de creación"
+    )
+    
+    fecha_envio = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Fecha de envío"
+    )
+    
+    class Meta:
+        verbose_name = "Correo Saliente"
+        verbose_name_plural = "Correos Salientes"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='correo_saliente_cola_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.destinatario} - {self.asunto} ({self.get_estado_display()})"
+
+
+class CanalNotificacion(models.Model):
+    """Canal por el que un usuario recibe los avisos de mantenimiento (sin ninguno, por email)"""
+    
+    TIPOS = [
+        ('email', 'Email'),
+        ('webhook', 'Webhook HTTP'),
+        ('archivo', 'Archivo NDJSON'),
+    ]
+    
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Usuario",
+        related_name="canales_notificacion"
+    )
+    
+    tipo = models.CharField(
+        max_length=20,
+        choices=TIPOS,
+        verbose_name="Tipo"
+    )
+    
+    destino = models.CharField(
+        max_length=500,
+        blank=True,
+        verbose_name="Destino",
+        help_text="URL del webhook o nombre del fichero; vacío en email (se usa el del usuario)"
+    )
+    
+    activo = models.BooleanField(
+        default=True,
+        verbose_name="Activo"
+    )
+    
+    fecha_creacion = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name="Fecha de creación"
+    )
+    
+    class Meta:
+        verbose_name = "Canal de Notificación"
+        verbose_name_plural = "Canales de Notificación"
+        ordering = ['usuario', 'tipo']
+        unique_together = ['usuario', 'tipo', 'destino']
+    
+    def __str__(self):
+        return f"{self.usuario.username} - {self.get_tipo_display()}{f' ({self.destino})' if self.destino else ''}"
+    
+    def clean(self):
+        """El webhook necesita una URL http(s) y el archivo un nombre de fichero"""
+        from django.core.exceptions import ValidationError
+        from django.core.validators import URLValidator
+        
+        if self.tipo == 'webhook':
+            try:
+                URLValidator(schemes=['http', 'https'])(self.destino)
+            except ValidationError:
+                raise ValidationError({'destino': 'Indica una URL http(s) válida para el webhook'})
+        elif self.tipo == 'archivo' and not self.destino:
+            raise ValidationError({'destino': 'Indica el nombre del fichero'})
+    
+    @classmethod
+    def por_usuario(cls, usuario_ids):
+        """Devuelve {usuario_id: [(tipo, destino), ...]} de los canales activos, en una consulta"""
+        canales = defaultdict(list)
+        for usuario_id, tipo, destino in cls.objects.filter(
+            usuario_id__in=usuario_ids, activo=True
+        ).values_list('usuario_id', 'tipo', 'destino'):
+            canales[usuario_id].append((tipo, destino))
+        return canales
+
+
+class ClaveCalendario(models.Model):
+    """Clave secreta de cada usuario que validan los enlaces de su calendario; renovarla los revoca todos"""
+    
+    usuario = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name="Usuario",
+        related_name="clave_calendario"
+    )
+    
+    clave = models.CharField(
+        max_length=64,
+        verbose_name="Clave"
+    )
+    
+    fecha_renovacion = models.DateTimeField(
+        auto_now=True,
+        verbose_name="Fecha de renovación"
+    )
+    
+    class Meta:
+        verbose_name = "Clave de Calendario"
+        verbose_name_plural = "Claves de Calendario"
+        ordering = ['usuario']
+    
+    def __str__(self):
+        return f"{self.usuario.username} ({self.fecha_renovacion:%d/%m/%Y %H:%M})"
+    
+    @staticmethod
+    def nueva_clave():
+        return secrets.token_urlsafe(24)
+    
+    @classmethod
+    def de_usuario(cls, usuario_id):
+        """Devuelve la clave vigente del usuario, creándola la primera vez"""
+        clave, _ = cls.objects.get_or_create(usuario_id=usuario_id, defaults={'clave': cls.nueva_clave()})
+        return clave.clave
+    
+    @classmethod
+    def renovar(cls, usuario_id):
+        """Sustituye la clave del usuario; los enlaces firmados con la anterior dejan de funcionar"""
+        clave = cls.nueva_clave()
+        cls.objects.update_or_create(usuario_id=usuario_id, defaults={'clave': clave})
+        return clave
+    
+    @classmethod
+    def es_vigente(cls, usuario_id, clave):
+        return cls.objects.filter(usuario_id=usuario_id, clave=clave).exists()
@@ -0,0 +1,182 @@
+"""
+Plan de mantenimiento plurianual y previsión de costes por vehículo.
+
+A partir de los estados materializados (último servicio, intervalos efectivos
+y ritmo de km diarios) se proyectan todas las repeticiones futuras de cada
+tipo de mantenimiento dentro del horizonte pedido. Tras cada servicio los dos
+contadores vuelven a cero, así que la separación entre repeticiones es la del
+intervalo que vence antes: el de meses o el de km al ritmo estimado.
+
+Todas las repeticiones de todos los pares (vehículo, tipo) se calculan en una
+única pasada con NumPy, y cada repetición lleva el coste medio que ese tipo
+ha tenido en el historial del usuario.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from django.db.models import Count, DecimalField, F, Sum
+from django.utils import timezone
+
+from .barrido import EPOCA, sumar_meses
+from .cache import obtener_cacheado
+from .catalogo import obtener_catalogo
+from .models import EstadoMantenimiento, ItemMantenimiento
+
+
+AÑOS_POR_DEFECTO = 3
+AÑOS_MAXIMOS = 10
+
+
+def costes_esperados(usuario_id):
+    """
+    Devuelve {tipo_id: coste medio por servicio} según el historial del usuario.
+
+    El coste de cada ítem son sus materiales más la parte proporcional de la
+    mano de obra del registro al que pertenece. Las sumas se agrupan en SQL por
+    tipo y por ``numero_items`` del registro, de modo que el reparto de la mano
+    de obra se hace con Decimal sobre unas pocas filas (en SQLite una división
+    de importes redondos sería entera). La media se redondea al céntimo con
+    ROUND_HALF_UP, como los costes de los registros.
+    """
+    dinero = DecimalField(max_digits=12, decimal_places=2)
+    filas = (
+        ItemMantenimiento.objects.filter(registro__vehiculo__propietario_id=usuario_id)
+        .values('tipo_mantenimiento_id', 'registro__numero_items')
+        .annotate(
+            materiales=Sum(F('cantidad') * F('costo_unitario'), output_field=dinero),
+            mano_obra=Sum('registro__costo_mano_obra_total'),
+            servicios=Count('id'),
+        )
+        .order_by()
+    )
+
+    sumas = defaultdict(Decimal)
+    servicios = defaultdict(int)
+    for fila in filas:
+        tipo_id = fila['tipo_mantenimiento_id']
+        sumas[tipo_id] += fila['materiales'] + (fila['mano_obra'] or Decimal('0')) / max(fila['registro__numero_items'], 1)
+        servicios[tipo_id] += fila['servicios']
+
+    return {
+        tipo_id: (suma / servicios[tipo_id]).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        for tipo_id, suma in sumas.items()
+    }
+
+
+def generar_planes(vehiculo_ids, años=AÑOS_POR_DEFECTO, hoy=None):
+    """
+    Devuelve {vehiculo_id: [repetición, ...]} ordenadas por fecha.
+
+    Cada repetición es un diccionario con fecha, tipo de mantenimiento,
+    motivo ('km' o 'tiempo'), km estimados en esa fecha y coste esperado.
+    Un mantenimiento ya vencido aparece hoy y marcado como vencido.
+    """
+    hoy = hoy or date.today()
+    horizonte = (hoy + relativedelta(years=años) - EPOCA).days
+    hoy_dias = (hoy - EPOCA).days
+
+    estados = list(EstadoMantenimiento.objects.filter(
+        vehiculo_id__in=vehiculo_ids, fecha_prevista__isnull=False
+    ).values_list(
+        'vehiculo_id', 'tipo_mantenimiento_id', 'intervalo_km', 'intervalo_meses',
+        'fecha_prevista', 'proxima_fecha', 'proximo_km',
+        'vehiculo__propietario_id', 'vehiculo__kilometraje_actual',
+        'vehiculo__km_diarios_estimados', 'vehiculo__fecha_lectura_km',
+    ))
+    if not estados:
+        return {}
+
+    intervalo_km = np.array([estado[2] for estado in estados], dtype=np.int64)
+    intervalo_meses = np.array([estado[3] for estado in estados], dtype=np.int64)
+    prevista = np.array([estado[4] for estado in estados], dtype='datetime64[D]').astype(np.int64)
+    por_tiempo = np.array([estado[4] == estado[5] for estado in estados])
+    km_actual = np.array([estado[8] for estado in estados], dtype=np.float64)
+    ritmo = np.array([estado[9] or 0 for estado in estados], dtype=np.float64)
+    lectura = np.array(
+        [timezone.localdate(estado[10]) for estado in estados], dtype='datetime64[D]'
+    ).astype(np.int64)
+
+    # La primera repetición es la fecha prevista (o hoy, si ya está vencida)
+    vencido = prevista < hoy_dias
+    inicio = np.maximum(prevista, hoy_dias)
+
+    # Separación entre repeticiones: el intervalo de km al ritmo estimado o el de meses
+    con_ritmo = (intervalo_km > 0) & (ritmo > 0)
+    paso_km = np.where(
+        con_ritmo, np.ceil(np.divide(intervalo_km, ritmo, out=np.ones(len(estados)), where=con_ritmo)), 0
+    ).astype(np.int64)
+    con_meses = intervalo_meses > 0
+    paso_meses = np.where(
+        con_meses, sumar_meses(inicio.astype('datetime64[D]'), intervalo_meses).astype(np.int64) - inicio, 0
+    )
+    usa_meses = con_meses & (~con_ritmo | (paso_meses <= paso_km))
+    paso = np.where(usa_meses, paso_meses, paso_km)
+
+    # Número de repeticiones de cada par dentro del horizonte (la separación mínima
+    # de un intervalo por meses es de 28 días)
+    repetible = paso > 0
+    paso_minimo = np.where(usa_meses, 28 * intervalo_meses, paso)
+    repeticiones = np.where(
+        inicio > horizonte, 0,
+        1 + np.where(repetible, (horizonte - inicio) // np.maximum(paso_minimo, 1), 0)
+    )
+
+    # Una fila por repetición: índice del par y ordinal k dentro de él
+    fila = np.repeat(np.arange(len(estados)), repeticiones)
+    k = np.arange(len(fila)) - np.repeat(np.cumsum(repeticiones) - repeticiones, repeticiones)
+
+    fechas = np.where(
+        usa_meses[fila],
+        sumar_meses(inicio[fila].astype('datetime64[D]'), k * intervalo_meses[fila]).astype(np.int64),
+        inicio[fila] + k * paso[fila],
+    )
+    dentro = fechas <= horizonte
+    fila, k, fechas = fila[dentro], k[dentro], fechas[dentro]
+
+    km_estimados = np.where(
+        ritmo[fila] > 0, km_actual[fila] + ritmo[fila] * (fechas - lectura[fila]), np.nan
+    )
+
+    catalogo = obtener_catalogo()
+    costes = {
+        propietario_id: costes_esperados(propietario_id)
+        for propietario_id in {estado[7] for estado in estados}
+    }
+
+    planes = defaultdict(list)
+    for i, ordinal, dias, km in zip(fila.tolist(), k.tolist(), fechas.tolist(), km_estimados.tolist()):
+        vehiculo_id, tipo_id = estados[i][0], estados[i][1]
+        tipo = catalogo.get(tipo_id)
+        if ordinal == 0:
+            motivo = 'tiempo' if por_tiempo[i] else 'km'
+            km_previstos = estados[i][6] if motivo == 'km' and estados[i][6] is not None else km
+        else:
+            motivo = 'tiempo' if usa_meses[i] else 'km'
+            km_previstos = km
+        planes[vehiculo_id].append({
+            'fecha': EPOCA + timedelta(days=dias),
+            'tipo_mantenimiento': tipo.nombre if tipo else '',
+            'categoria': tipo.get_categoria_display() if tipo else '',
+            'motivo': motivo,
+            'km_estimado': None if km_previstos is None or np.isnan(km_previstos) else int(round(km_previstos)),
+            'coste': costes[estados[i][7]].get(tipo_id),
+            'vencido': bool(ordinal == 0 and vencido[i]),
+        })
+
+    for repeticiones_vehiculo in planes.values():
+        repeticiones_vehiculo.sort(key=lambda r: (r['fecha'], r['tipo_mantenimiento']))
+    return dict(planes)
+
+
+def plan_vehiculo(vehiculo, años=AÑOS_POR_DEFECTO, hoy=None):
+    """Plan del vehículo, cacheado con la versión de datos de su propietario"""
+    hoy = hoy or date.today()
+    return obtener_cacheado(
+        vehiculo.propietario_id,
+        f'plan_mantenimiento:{vehiculo.id}:{años}:{hoy.isoformat()}',
+        lambda: generar_planes([vehiculo.id], años, hoy).get(vehiculo.id, []),
+        timeout=86400,
+    )
@@ -0,0 +1,108 @@
+"""
+Proyección del kilometraje diario de cada vehículo.
+
+Ajusta por mínimos cuadrados una recta km = a + b·día con los puntos
+(fecha_realizacion, kilometraje_realizacion) de su historial más la lectura
+actual del vehículo (fecha_lectura_km, kilometraje_actual). Los puntos con 0 km
+son el valor por defecto de un kilometraje sin anotar y no se usan. La pendiente b es la estimación de km diarios, que se
+guarda en Vehiculo para convertir los intervalos por kilometraje en fechas
+previstas sin volver a ajustar en cada petición.
+"""
+import math
+from datetime import timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from .models import Vehiculo, RegistroMantenimiento
+
+
+# Días mínimos que debe abarcar el historial para que la estimación sea fiable
+DIAS_MINIMOS_AJUSTE = 30
+
+
+def _dias(fechas):
+    """Convierte una secuencia de fechas en días desde la época (float64)"""
+    return np.array(fechas, dtype='datetime64[D]').astype(np.int64).astype(np.float64)
+
+
+def estimar_km_diarios(vehiculo_ids=None):
+    """
+    Estima y guarda los km diarios de los vehículos indicados (o de toda la flota).
+
+    El ajuste es un único cálculo vectorizado: los sumatorios de cada vehículo
+    se agregan con ``np.bincount`` sobre todos los puntos a la vez. Devuelve
+    {vehiculo_id: km_diarios} con los vehículos actualizados.
+    """
+    vehiculos = Vehiculo.objects.all()
+    registros = RegistroMantenimiento.objects.all()
+    if vehiculo_ids is not None:
+        vehiculos = vehiculos.filter(id__in=vehiculo_ids)
+        registros = registros.filter(vehiculo_id__in=vehiculo_ids)
+
+    lecturas = list(vehiculos.filter(kilometraje_actual__gt=0).values_list(
+        'id', 'fecha_lectura_km', 'kilometraje_actual'
+    ))
+    historial = list(registros.filter(kilometraje_realizacion__gt=0).order_by().values_list(
+        'vehiculo_id', 'fecha_realizacion', 'kilometraje_realizacion'
+    ))
+    if not lecturas and not historial:
+        return {}
+
+    ids = np.concatenate([
+        np.array([lectura[0] for lectura in lecturas], dtype=np.int64),
+        np.array([punto[0] for punto in historial], dtype=np.int64),
+    ])
+    x = np.concatenate([
+        _dias([timezone.localdate(lectura[1]) for lectura in lecturas]),
+        _dias([punto[1] for punto in historial]),
+    ])
+    y = np.array(
+        [lectura[2] for lectura in lecturas] + [punto[2] for punto in historial],
+        dtype=np.float64
+    )
+
+    # Centrar x mejora la estabilidad numérica de los sumatorios
+    x -= x.min()
+
+    grupos, indice = np.unique(ids, return_inverse=True)
+    n = np.bincount(indice).astype(np.float64)
+    sx = np.bincount(indice, weights=x)
+    sy = np.bincount(indice, weights=y)
+    sxx = np.bincount(indice, weights=x * x)
+    sxy = np.bincount(indice, weights=x * y)
+
+    x_min = np.full(len(grupos), np.inf)
+    x_max = np.full(len(grupos), -np.inf)
+    np.minimum.at(x_min, indice, x)
+    np.maximum.at(x_max, indice, x)
+
+    denominador = n * sxx - sx * sx
+    validos = (n >= 2) & (denominador > 0) & (x_max - x_min >= DIAS_MINIMOS_AJUSTE)
+    pendiente = np.zeros(len(grupos))
+    pendiente[validos] = (n[validos] * sxy[validos] - sx[validos] * sy[validos]) / denominador[validos]
+    # Una pendiente no positiva (odómetro corregido, datos erróneos) no permite predecir
+    validos &= pendiente > 0
+
+    estimaciones = {
+        int(vehiculo_id): (round(float(km), 2) if valido else None)
+        for vehiculo_id, km, valido in zip(grupos, pendiente, validos)
+    }
+
+    ahora = timezone.now()
+    actualizados = []
+    for vehiculo in vehiculos.only('id', 'km_diarios_estimados'):
+        vehiculo.km_diarios_estimados = estimaciones.get(vehiculo.id)
+        vehiculo.fecha_estimacion_km = ahora
+        actualizados.append(vehiculo)
+    # bulk_update no dispara señales ni toca fecha_actualizacion
+    Vehiculo.objects.bulk_update(actualizados, ['km_diarios_estimados', 'fecha_estimacion_km'], batch_size=500)
+
+    return {vehiculo_id: km for vehiculo_id, km in estimaciones.items() if km is not None}
+
+
+def fecha_prevista_km(km_restantes, km_diarios, fecha_lectura):
+    """Fecha en que se alcanzarán los km restantes al ritmo estimado, o None si no se puede prever"""
+    if km_restantes is None or not km_diarios:
+        return None
+    return fecha_lectura + timedelta(days=math.ceil(km_restantes / km_diarios))
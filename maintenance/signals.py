@@ -0,0 +1,172 @@
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import (
+    Vehiculo, TipoMantenimiento, IntervaloMantenimiento,
+    RegistroMantenimiento, ItemMantenimiento, EstadoMantenimiento,
+    TareaNotificacion
+)
+from .cache import invalidar_usuario
+from .catalogo import invalidar_catalogo
+from .proyeccion import estimar_km_diarios
+from .vencimientos import obtener_vencimientos, recalcular_estados
+
+
+# Pares (vehículo, tipo) modificados en la transacción en curso de cada hilo
+_pendientes = threading.local()
+
+
+def _recalcular_al_confirmar(vehiculo_ids, tipo_ids=None, reestimar_km=False):
+    """
+    Marca como pendientes de recálculo los pares (vehículo, tipo) afectados
+    y programa su recálculo para cuando se confirme la transacción.
+
+    Sin ``tipo_ids`` se marcan todos los tipos del vehículo. Diferirlo evita
+    recalcular a mitad de un borrado en cascada (cuando el vehículo está a
+    punto de desaparecer) y ver datos sin confirmar; además, todos los
+    cambios de una misma transacción se recalculan juntos una sola vez. Con
+    ``reestimar_km`` se vuelve a ajustar antes el ritmo de km diarios, ya que
+    han cambiado sus datos de entrada.
+    """
+    vehiculo_ids = {vehiculo_id for vehiculo_id in vehiculo_ids if vehiculo_id}
+    if not vehiculo_ids:
+        return
+
+    if not hasattr(_pendientes, 'pares'):
+        _pendientes.pares = {}
+        _pendientes.reestimar = set()
+    for vehiculo_id in vehiculo_ids:
+        if tipo_ids is None:
+            _pendientes.pares[vehiculo_id] = None
+        elif _pendientes.pares.get(vehiculo_id, set()) is not None:
+            _pendientes.pares.setdefault(vehiculo_id, set()).update(tipo_ids)
+    if reestimar_km:
+        _pendientes.reestimar.update(vehiculo_ids)
+
+    # El primer callback que se ejecute tras el commit procesa todo lo acumulado
+    # y los demás lo encuentran vacío; si la transacción se revierte, los pares
+    # se recalculan en el siguiente commit, lo que es inocuo
+    transaction.on_commit(_procesar_pendientes)
+
+
+def _procesar_pendientes():
+    """Recalcula los pares pendientes del hilo y encola avisos de los umbrales cruzados"""
+    pares = getattr(_pendientes, 'pares', None)
+    if not pares:
+        return
+    reestimar = _pendientes.reestimar
+    _pendientes.pares, _pendientes.reestimar = {}, set()
+
+    # Encolar el aviso de un usuario en cuanto uno de sus mantenimientos cruza un umbral
+    avisos_inmediatos = getattr(settings, 'WHEELER_AVISOS_INMEDIATOS', True)
+    antes = _alertas(pares) if avisos_inmediatos else {}
+
+    if reestimar:
+        estimar_km_diarios(reestimar)
+    completos = [vehiculo_id for vehiculo_id, tipos in pares.items() if tipos is None]
+    if completos:
+        recalcular_estados(completos)
+    parciales = {vehiculo_id: tipos for vehiculo_id, tipos in pares.items() if tipos is not None}
+    if parciales:
+        recalcular_estados(list(parciales), set().union(*parciales.values()))
+
+    if avisos_inmediatos:
+        despues = _alertas(pares)
+        usuarios = {
+            propietario_id
+            for par, (propietario_id, alerta) in despues.items()
+            if antes.get(par, (None, None))[1] != alerta
+        }
+        for usuario_id in usuarios:
+            TareaNotificacion.encolar(usuario_id)
+
+
+def _alertas(pares):
+    """Devuelve {(vehiculo_id, tipo_id): (propietario_id, tipo_alerta)} de los pares pendientes ya en aviso"""
+    return {
+        (vencimiento.vehiculo.id, vencimiento.tipo_mantenimiento.id): (
+            vencimiento.vehiculo.propietario_id, vencimiento.tipo_alerta
+        )
+        for vencimiento in obtener_vencimientos(Vehiculo.objects.filter(id__in=list(pares)))
+        if pares[vencimiento.vehiculo.id] is None or vencimiento.tipo_mantenimiento.id in pares[vencimiento.vehiculo.id]
+    }
+
+
+@receiver(post_save, sender=Vehiculo)
+def vehiculo_guardado(sender, instance, created, **kwargs):
+    """El kilometraje o el tipo de vehículo afectan a los km restantes y a la aplicabilidad"""
+    if created:
+        transaction.on_commit(lambda: invalidar_usuario(instance.propietario_id))
+    else:
+        _recalcular_al_confirmar([instance.id], reestimar_km=True)
+
+
+@receiver(post_delete, sender=Vehiculo)
+def vehiculo_eliminado(sender, instance, **kwargs):
+    """Sus estados desaparecen en cascada; basta con invalidar los datos cacheados del usuario"""
+    transaction.on_commit(lambda: invalidar_usuario(instance.propietario_id))
+
+
+@receiver(post_save, sender=RegistroMantenimiento)
+@receiver(post_delete, sender=RegistroMantenimiento)
+def registro_modificado(sender, instance, **kwargs):
+    """Recalcula el vehículo del registro y, si ha cambiado de vehículo, también el anterior"""
+    vehiculo_ids = {instance.vehiculo_id}
+    if not kwargs.get('created', False):
+        vehiculo_ids.update(
+            EstadoMantenimiento.objects.filter(ultimo_registro_id=instance.id).values_list('vehiculo_id', flat=True)
+        )
+    _recalcular_al_confirmar(vehiculo_ids, reestimar_km=True)
+
+
+@receiver(post_save, sender=ItemMantenimiento)
+@receiver(post_delete, sender=ItemMantenimiento)
+def item_modificado(sender, instance, **kwargs):
+    """Un ítem añadido o borrado cambia el último servicio de su par (vehículo, tipo)"""
+    vehiculo_ids = RegistroMantenimiento.objects.filter(
+        id=instance.registro_id
+    ).values_list('vehiculo_id', flat=True)
+    # Al editarlo puede haber cambiado de tipo, así que se recalcula el vehículo entero
+    tipo_ids = None if kwargs.get('created') is False else [instance.tipo_mantenimiento_id]
+    _recalcular_al_confirmar(vehiculo_ids, tipo_ids)
+
+
+@receiver(post_save, sender=ItemMantenimiento)
+@receiver(post_delete, sender=ItemMantenimiento)
+def item_totales(sender, instance, origin=None, **kwargs):
+    """Actualiza los totales del registro del ítem en la misma transacción que el ítem"""
+    # Al borrar el registro (o su vehículo o usuario) los ítems caen en cascada con él
+    if getattr(origin, 'model', type(origin)) in (RegistroMantenimiento, Vehiculo, User):
+        return
+    RegistroMantenimiento.actualizar_totales([instance.registro_id])
+
+
+@receiver(post_save, sender=IntervaloMantenimiento)
+@receiver(post_delete, sender=IntervaloMantenimiento)
+def intervalo_modificado(sender, instance, **kwargs):
+    """Un intervalo personalizado sólo afecta a su par (vehículo, tipo)"""
+    _recalcular_al_confirmar([instance.vehiculo_id], [instance.tipo_mantenimiento_id])
+
+
+@receiver(post_save, sender=TipoMantenimiento)
+def tipo_mantenimiento_guardado(sender, instance, created, **kwargs):
+    """Los intervalos por defecto, la aplicabilidad o el estado activo afectan a todos sus vehículos"""
+    # Se registra antes que el recálculo para que éste ya vea el catálogo nuevo
+    transaction.on_commit(invalidar_catalogo)
+    if created:
+        return
+    vehiculo_ids = ItemMantenimiento.objects.filter(
+        tipo_mantenimiento=instance
+    ).values_list('registro__vehiculo_id', flat=True).distinct()
+    _recalcular_al_confirmar(list(vehiculo_ids), [instance.id])
+
+
+@receiver(post_delete, sender=TipoMantenimiento)
+def tipo_mantenimiento_eliminado(sender, instance, **kwargs):
+    """Sus ítems y estados desaparecen en cascada; basta con publicar un catálogo nuevo"""
+    transaction.on_commit(invalidar_catalogo)
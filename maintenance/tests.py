@@ -1,3 +1,1036 @@
-from django.test import TestCase
+import json
+import socketserver
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from urllib.error import HTTPError
 
-# Create your tests here.
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache as cache_usuario
+from .barrido import barrer_flota, sumar_meses
+from .calendario import token_calendario
+from .canales import CanalArchivo, CanalWebhook
+from .correo import enviar_correos
+from .gastos import calcular_gastos
+from .plan import costes_esperados
+from .proyeccion import estimar_km_diarios
+from .management.commands.enviar_notificaciones_mantenimiento import Command as EnviarNotificaciones, _dividir_rango
+from .management.commands.particionar_notificaciones import Command as ParticionarNotificaciones
+from .management.commands.procesar_cola_notificaciones import Command as TrabajadorCola
+from .models import (
+    ClaveCalendario, Concesion, CorreoSaliente, EstadoMantenimiento, IntervaloMantenimiento, ItemMantenimiento,
+    RegistroMantenimiento, TareaNotificacion, TipoMantenimiento, UserRegistrationRequest, Vehiculo,
+)
+from .vencimientos import obtener_vencimientos, recalcular_estados
+
+
+class ManejadorSMTP(socketserver.StreamRequestHandler):
+    """
+    Servidor SMTP mínimo para pruebas. Rechaza los destinatarios que contienen
+    "rechazo" y corta la conexión con los que contienen "corte".
+    """
+
+    def handle(self):
+        servidor = self.server
+        with servidor.lock:
+            servidor.activas += 1
+            servidor.max_activas = max(servidor.max_activas, servidor.activas)
+        try:
+            self.conversar()
+        finally:
+            with servidor.lock:
+                servidor.activas -= 1
+
+    def responder(self, linea):
+        self.wfile.write(f'{linea}\r\n'.encode())
+
+    def conversar(self):
+        self.responder('220 prueba')
+        destinatario = None
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            orden = linea.decode().strip()
+            verbo = orden.upper()
+            if verbo.startswith('RCPT'):
+                destinatario = orden.split(':', 1)[1].strip(' <>')
+                if 'corte' in destinatario:
+                    return
+                if 'rechazo' in destinatario:
+                    self.responder('550 buzón inexistente')
+                else:
+                    self.responder('250 ok')
+            elif verbo.startswith('DATA'):
+                self.responder('354 adelante')
+                while self.rfile.readline().rstrip(b'\r\n') != b'.':
+                    pass
+                # Latencia del servidor para que las sesiones se solapen
+                time.sleep(0.05)
+                with self.server.lock:
+                    self.server.recibidos.append(destinatario)
+                self.responder('250 en cola')
+            elif verbo.startswith('QUIT'):
+                self.responder('221 adiós')
+                return
+            else:
+                self.responder('250 ok')
+
+
+class ServidorSMTP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ManejadorSMTP)
+        self.lock = threading.Lock()
+        self.activas = 0
+        self.max_activas = 0
+        self.recibidos = []
+
+
+class EnviarCorreosConcurrenteTests(TestCase):
+    def setUp(self):
+        self.servidor = ServidorSMTP()
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.hilo.start()
+        ajustes = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=self.servidor.server_address[1],
+            EMAIL_USE_TLS=False,
+            EMAIL_USE_SSL=False,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_TIMEOUT=5,
+        )
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+    def tearDown(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        self.hilo.join()
+
+    def crear_correos(self, destinatarios):
+        CorreoSaliente.objects.bulk_create([
+            CorreoSaliente(destinatario=destinatario, asunto='Prueba', cuerpo_texto='Hola')
+            for destinatario in destinatarios
+        ])
+        return list(CorreoSaliente.objects.order_by('id'))
+
+    def test_sesiones_simultaneas_entregan_todo(self):
+        correos = self.crear_correos([f'usuario{i}@example.com' for i in range(12)])
+
+        fallidos = enviar_correos(correos, sesiones=4)
+
+        self.assertEqual(fallidos, [])
+        self.assertGreater(self.servidor.max_activas, 1)
+        self.assertEqual(
+            sorted(self.servidor.recibidos),
+            sorted(correo.destinatario for correo in correos),
+        )
+        self.assertEqual(
+            CorreoSaliente.objects.filter(estado='enviado', intentos=1).count(), len(correos)
+        )
+
+    def test_fallo_en_una_sesion_no_afecta_a_las_demas(self):
+        destinatarios = [f'usuario{i}@example.com' for i in range(10)]
+        destinatarios[2] = 'rechazo@example.com'
+        destinatarios[5] = 'corte@example.com'
+        correos = self.crear_correos(destinatarios)
+        antes = timezone.now()
+
+        fallidos = enviar_correos(correos, sesiones=4)
+
+        self.assertEqual(
+            sorted(correo.destinatario for correo, _ in fallidos),
+            ['corte@example.com', 'rechazo@example.com'],
+        )
+        for correo in CorreoSaliente.objects.filter(destinatario__in=['rechazo@example.com', 'corte@example.com']):
+            self.assertEqual(correo.estado, 'pendiente')
+            self.assertEqual(correo.intentos, 1)
+            self.assertNotEqual(correo.ultimo_error, '')
+            self.assertGreater(correo.proximo_intento, antes)
+            self.assertIsNone(correo.fecha_envio)
+
+        enviados = CorreoSaliente.objects.exclude(
+            destinatario__in=['rechazo@example.com', 'corte@example.com']
+        )
+        self.assertEqual(enviados.filter(estado='enviado', intentos=1, ultimo_error='').count(), 8)
+        self.assertEqual(
+            sorted(self.servidor.recibidos),
+            sorted(enviados.values_list('destinatario', flat=True)),
+        )
+
+
+class ReconstruirTotalesTests(TestCase):
+    def setUp(self):
+        usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        vehiculo = Vehiculo.objects.create(propietario=usuario, tipo='coche', marca='Seat', modelo='Ibiza')
+        # 12.50 sin IVA deja un IVA de medio céntimo: 2.625
+        self.registro = RegistroMantenimiento.objects.create(
+            vehiculo=vehiculo,
+            fecha_realizacion=date(2024, 5, 1),
+            kilometraje_realizacion=50000,
+            costo_mano_obra_total=Decimal('12.50'),
+            iva_incluido=False,
+        )
+
+    def reconstruir_desfasados(self):
+        salida = StringIO()
+        call_command('reconstruir_totales_registros', solo_desfasados=True, stdout=salida)
+        return salida.getvalue()
+
+    def test_iva_de_medio_centimo_coincide_con_sql(self):
+        registro = RegistroMantenimiento.objects.with_costs().get(pk=self.registro.pk)
+        self.assertEqual(registro.costo_iva, Decimal('2.63'))
+        self.assertEqual(registro.costo_total, Decimal('15.13'))
+        self.assertEqual(registro.costo_iva, registro.iva_calculado)
+        self.assertEqual(registro.costo_total, registro.total_calculado)
+
+    def test_solo_desfasados_converge(self):
+        # Totales guardados con el redondeo anterior (mitad al par)
+        RegistroMantenimiento.objects.filter(pk=self.registro.pk).update(
+            costo_iva=Decimal('2.62'), costo_total=Decimal('15.12'),
+        )
+
+        self.assertIn('reconstruidos para 1 registros', self.reconstruir_desfasados())
+        self.assertIn('reconstruidos para 0 registros', self.reconstruir_desfasados())
+
+        self.registro.refresh_from_db()
+        self.assertEqual(self.registro.costo_total, Decimal('15.13'))
+
+
+class GastosPorCategoriaTests(TestCase):
+    def test_registro_con_varias_categorias_se_reparte(self):
+        usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        vehiculo = Vehiculo.objects.create(propietario=usuario, tipo='coche', marca='Seat', modelo='Ibiza')
+        registro = RegistroMantenimiento.objects.create(
+            vehiculo=vehiculo,
+            fecha_realizacion=date(2024, 5, 1),
+            kilometraje_realizacion=50000,
+            costo_mano_obra_total=Decimal('50.00'),
+            iva_incluido=False,
+        )
+        # Clave, nombre cargado por load_maintenance_types y una categoría desconocida
+        for nombre, categoria, cantidad, costo in [
+            ('Cambio de aceite', 'motor', 1, '40.00'),
+            ('Filtro de aceite', 'Filtros', 2, '10.00'),
+            ('Correa de distribución', 'Motor', 1, '60.00'),
+            ('Escobillas', 'Lunas', 1, '15.00'),
+        ]:
+            tipo = TipoMantenimiento.objects.create(nombre=nombre, categoria=categoria)
+            ItemMantenimiento.objects.create(
+                registro=registro, tipo_mantenimiento=tipo, cantidad=cantidad, costo_unitario=Decimal(costo),
+            )
+
+        gastos = calcular_gastos(usuario.id)
+
+        totales = {fila['nombre']: fila['total'] for fila in gastos['por_categoria']}
+        self.assertEqual(totales, {
+            'Motor': Decimal('100.00'),
+            'Filtros': Decimal('20.00'),
+            'Lunas (categoría no reconocida)': Decimal('15.00'),
+            'Mano de obra': Decimal('50.00'),
+            'IVA añadido': Decimal('38.85'),
+        })
+        self.assertEqual(sum(totales.values()), gastos['resumen']['total'])
+
+
+class ManejadorWebhook(BaseHTTPRequestHandler):
+    """
+    Receptor HTTP de webhooks para pruebas. Responde 500 en las rutas que
+    empiezan por /error y tarda más que el timeout en las que empiezan por /lento.
+    """
+
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if self.path.startswith('/lento'):
+            time.sleep(1)
+        with self.server.lock:
+            self.server.recibidos.append((self.path, cuerpo['avisos']))
+        self.send_response(500 if self.path.startswith('/error') else 204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorWebhook(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), ManejadorWebhook)
+        self.lock = threading.Lock()
+        self.recibidos = []
+
+    def url(self, ruta):
+        return f'http://127.0.0.1:{self.server_address[1]}{ruta}'
+
+
+class CanalWebhookTests(SimpleTestCase):
+    def setUp(self):
+        self.servidor = ServidorWebhook()
+        self.hilo = threading.Thread(target=self.servidor.serve_forever, daemon=True)
+        self.hilo.start()
+
+    def tearDown(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
+        self.hilo.join()
+
+    def test_agrupa_los_avisos_de_cada_url_en_lotes(self):
+        canal = CanalWebhook(paralelismo=4, timeout=5, tamano_lote=2)
+        for usuario_id in range(1, 6):
+            canal.añadir(SimpleNamespace(id=usuario_id), self.servidor.url('/a'), {'usuario': usuario_id})
+        canal.añadir(SimpleNamespace(id=6), self.servidor.url('/b'), {'usuario': 6})
+
+        entregados, errores = canal.entregar()
+
+        self.assertEqual(errores, [])
+        self.assertEqual(entregados, {1, 2, 3, 4, 5, 6})
+        lotes = sorted((ruta, [aviso['usuario'] for aviso in avisos]) for ruta, avisos in self.servidor.recibidos)
+        self.assertEqual(lotes, [('/a', [1, 2]), ('/a', [3, 4]), ('/a', [5]), ('/b', [6])])
+        # Lo pendiente se vacía al entregar
+        self.assertEqual(canal.entregar(), (set(), []))
+
+    def test_errores_http_y_timeouts_no_cuentan_como_entregados(self):
+        canal = CanalWebhook(paralelismo=3, timeout=0.2, tamano_lote=10)
+        canal.añadir(SimpleNamespace(id=1), self.servidor.url('/ok'), {'usuario': 1})
+        canal.añadir(SimpleNamespace(id=2), self.servidor.url('/error'), {'usuario': 2})
+        canal.añadir(SimpleNamespace(id=3), self.servidor.url('/lento'), {'usuario': 3})
+
+        entregados, errores = canal.entregar()
+
+        self.assertEqual(entregados, {1})
+        errores = dict(errores)
+        self.assertEqual(set(errores), {self.servidor.url('/error'), self.servidor.url('/lento')})
+        self.assertIsInstance(errores[self.servidor.url('/error')], HTTPError)
+        self.assertIsInstance(errores[self.servidor.url('/lento')], TimeoutError)
+
+
+class CanalArchivoTests(SimpleTestCase):
+    def setUp(self):
+        temporal = tempfile.TemporaryDirectory()
+        self.addCleanup(temporal.cleanup)
+        self.directorio = Path(temporal.name) / 'avisos'
+
+    def test_escribe_una_linea_json_por_aviso(self):
+        canal = CanalArchivo(self.directorio)
+        canal.añadir(SimpleNamespace(id=1), 'flota/avisos.ndjson', {'usuario': 1, 'nombre': 'Peña'})
+        canal.añadir(SimpleNamespace(id=2), 'flota/avisos.ndjson', {'usuario': 2})
+
+        self.assertEqual(canal.entregar(), ({1, 2}, []))
+
+        lineas = (self.directorio / 'flota' / 'avisos.ndjson').read_text(encoding='utf-8').splitlines()
+        self.assertEqual([json.loads(linea) for linea in lineas], [{'usuario': 1, 'nombre': 'Peña'}, {'usuario': 2}])
+
+    def test_rechaza_rutas_fuera_del_directorio(self):
+        canal = CanalArchivo(self.directorio)
+        for destino in ['../fuera.ndjson', 'flota/../../fuera.ndjson', '/tmp/fuera.ndjson', '.']:
+            with self.subTest(destino=destino), self.assertRaises(ValueError):
+                canal.ruta(destino)
+
+        canal.añadir(SimpleNamespace(id=1), '../fuera.ndjson', {'usuario': 1})
+        canal.añadir(SimpleNamespace(id=2), 'bien.ndjson', {'usuario': 2})
+        entregados, errores = canal.entregar()
+
+        self.assertEqual(entregados, {2})
+        self.assertEqual([destino for destino, _ in errores], ['../fuera.ndjson'])
+        self.assertFalse((self.directorio.parent / 'fuera.ndjson').exists())
+
+
+class EstadosMaterializadosTests(TestCase):
+    """Los estados que mantienen las señales coinciden con reconstruirlos desde cero"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.aceite = TipoMantenimiento.objects.create(nombre='Aceite', intervalo_km=10000, intervalo_meses=12)
+            self.frenos = TipoMantenimiento.objects.create(nombre='Frenos', intervalo_km=30000)
+            self.itv = TipoMantenimiento.objects.create(nombre='ITV', intervalo_meses=24)
+            self.vehiculo = Vehiculo.objects.create(
+                propietario=self.usuario, tipo='coche', marca='Seat', modelo='Ibiza', kilometraje_actual=25000,
+            )
+            self.registro = self.crear_registro(date(2024, 1, 15), 20000, [self.aceite, self.itv])
+
+    def crear_registro(self, fecha, km, tipos):
+        registro = RegistroMantenimiento.objects.create(
+            vehiculo=self.vehiculo, fecha_realizacion=fecha, kilometraje_realizacion=km,
+        )
+        for tipo in tipos:
+            ItemMantenimiento.objects.create(registro=registro, tipo_mantenimiento=tipo, costo_unitario=Decimal('10.00'))
+        return registro
+
+    def vencimientos(self):
+        return sorted(
+            (
+                v.vehiculo.id, v.tipo_mantenimiento.id, v.ultimo_registro.id, v.intervalo_km, v.intervalo_meses,
+                v.proximo_km, v.proxima_fecha, v.km_restantes, v.fecha_prevista_km, v.fecha_prevista,
+            )
+            for v in obtener_vencimientos(Vehiculo.objects.all(), solo_proximos=False)
+        )
+
+    def assertEstadosAlDia(self):
+        """Compara los estados actuales con los que salen de reconstruirlos desde cero"""
+        mantenidos = self.vencimientos()
+        EstadoMantenimiento.objects.all().delete()
+        recalcular_estados(list(Vehiculo.objects.values_list('id', flat=True)))
+        self.assertEqual(mantenidos, self.vencimientos())
+        return mantenidos
+
+    def tipos_con_estado(self):
+        return set(EstadoMantenimiento.objects.values_list('tipo_mantenimiento_id', flat=True))
+
+    def test_alta_de_items(self):
+        self.assertEqual(self.tipos_con_estado(), {self.aceite.id, self.itv.id})
+        self.assertEstadosAlDia()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            posterior = self.crear_registro(date(2024, 6, 1), 24000, [self.aceite, self.frenos])
+
+        self.assertEqual(self.tipos_con_estado(), {self.aceite.id, self.itv.id, self.frenos.id})
+        self.assertEqual(
+            EstadoMantenimiento.objects.get(tipo_mantenimiento=self.aceite).ultimo_registro_id, posterior.id
+        )
+        self.assertEstadosAlDia()
+
+    def test_cambio_de_tipo_de_un_item(self):
+        item = self.registro.items.get(tipo_mantenimiento=self.itv)
+        with self.captureOnCommitCallbacks(execute=True):
+            item.tipo_mantenimiento = self.frenos
+            item.save()
+
+        self.assertEqual(self.tipos_con_estado(), {self.aceite.id, self.frenos.id})
+        self.assertEstadosAlDia()
+
+    def test_borrado_de_un_item(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.registro.items.get(tipo_mantenimiento=self.aceite).delete()
+
+        self.assertEqual(self.tipos_con_estado(), {self.itv.id})
+        self.assertEstadosAlDia()
+
+    def test_cambio_de_kilometraje_del_vehiculo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehiculo.kilometraje_actual = 31000
+            self.vehiculo.save()
+
+        self.assertEqual(EstadoMantenimiento.objects.get(tipo_mantenimiento=self.aceite).km_restantes, -1000)
+        self.assertEstadosAlDia()
+
+    def test_intervalo_personalizado(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            intervalo = IntervaloMantenimiento.objects.create(
+                vehiculo=self.vehiculo, tipo_mantenimiento=self.aceite, intervalo_km_personalizado=5000,
+            )
+        self.assertEqual(EstadoMantenimiento.objects.get(tipo_mantenimiento=self.aceite).proximo_km, 25000)
+        self.assertEstadosAlDia()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            intervalo.intervalo_meses_personalizado = 6
+            intervalo.save()
+        self.assertEqual(
+            EstadoMantenimiento.objects.get(tipo_mantenimiento=self.aceite).proxima_fecha, date(2024, 7, 15)
+        )
+        self.assertEstadosAlDia()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            intervalo.delete()
+        self.assertEqual(EstadoMantenimiento.objects.get(tipo_mantenimiento=self.aceite).proximo_km, 30000)
+        self.assertEstadosAlDia()
+
+    def test_borrados_en_cascada(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            anterior = self.crear_registro(date(2023, 1, 10), 10000, [self.aceite, self.frenos])
+        self.assertEstadosAlDia()
+
+        # Al borrar el registro más reciente vuelve a mandar el anterior
+        with self.captureOnCommitCallbacks(execute=True):
+            self.registro.delete()
+        self.assertEqual(self.tipos_con_estado(), {self.aceite.id, self.frenos.id})
+        self.assertEqual(
+            EstadoMantenimiento.objects.get(tipo_mantenimiento=self.aceite).ultimo_registro_id, anterior.id
+        )
+        self.assertEstadosAlDia()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.frenos.delete()
+        self.assertEqual(self.tipos_con_estado(), {self.aceite.id})
+        self.assertEstadosAlDia()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehiculo.delete()
+        self.assertFalse(EstadoMantenimiento.objects.exists())
+        self.assertEqual(self.assertEstadosAlDia(), [])
+
+
+class BarridoVectorizadoTests(TestCase):
+    """barrer_flota da lo mismo que los estados recalculados con relativedelta"""
+
+    def setUp(self):
+        usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        with self.captureOnCommitCallbacks(execute=True):
+            mensual = TipoMantenimiento.objects.create(nombre='Mensual', intervalo_meses=1)
+            anual = TipoMantenimiento.objects.create(nombre='Anual', intervalo_meses=12)
+            solo_km = TipoMantenimiento.objects.create(nombre='Solo km', intervalo_km=5000)
+            mixto = TipoMantenimiento.objects.create(nombre='Mixto', intervalo_km=10000, intervalo_meses=24)
+            de_moto = TipoMantenimiento.objects.create(nombre='Moto', intervalo_meses=6, vehiculos_aplicables='moto')
+
+        # Sin ejecutar las señales: los estados se recalculan abajo con los ritmos fijados a mano
+        con_ritmo = Vehiculo.objects.create(
+            propietario=usuario, tipo='coche', marca='Seat', modelo='Ibiza', kilometraje_actual=30000,
+        )
+        sin_ritmo = Vehiculo.objects.create(
+            propietario=usuario, tipo='coche', marca='Renault', modelo='Clio', kilometraje_actual=5000,
+        )
+        moto = Vehiculo.objects.create(
+            propietario=usuario, tipo='moto', marca='Honda', modelo='CB500', kilometraje_actual=17000,
+        )
+        Vehiculo.objects.filter(pk=con_ritmo.pk).update(km_diarios_estimados=40.0)
+
+        for vehiculo, fecha, km, tipos in [
+            (con_ritmo, date(2024, 1, 31), 25000, [mensual, solo_km, mixto, de_moto]),
+            (con_ritmo, date(2023, 3, 31), 15000, [anual]),
+            (sin_ritmo, date(2024, 2, 29), 3000, [anual, solo_km, mensual, mixto]),
+            (moto, date(2023, 8, 31), 11500, [mensual, de_moto, solo_km]),
+        ]:
+            registro = RegistroMantenimiento.objects.create(
+                vehiculo=vehiculo, fecha_realizacion=fecha, kilometraje_realizacion=km,
+            )
+            for tipo in tipos:
+                ItemMantenimiento.objects.create(registro=registro, tipo_mantenimiento=tipo, costo_unitario=Decimal('1.00'))
+        IntervaloMantenimiento.objects.create(
+            vehiculo=con_ritmo, tipo_mantenimiento=mensual, intervalo_meses_personalizado=13,
+        )
+        IntervaloMantenimiento.objects.create(
+            vehiculo=sin_ritmo, tipo_mantenimiento=mixto, intervalo_km_personalizado=4000,
+        )
+        recalcular_estados(list(Vehiculo.objects.values_list('id', flat=True)))
+
+        self.tipos = {tipo.nombre: tipo.id for tipo in [mensual, anual, solo_km, mixto, de_moto]}
+        self.vehiculos = {'con_ritmo': con_ritmo.id, 'sin_ritmo': sin_ritmo.id, 'moto': moto.id}
+
+    @staticmethod
+    def filas(vencimientos):
+        return sorted(
+            (
+                v.vehiculo.id, v.tipo_mantenimiento.id, v.ultimo_registro.id, v.intervalo_km, v.intervalo_meses,
+                v.proximo_km, v.proxima_fecha, v.km_restantes, v.dias_restantes,
+                v.fecha_prevista_km, v.fecha_prevista, v.dias_previstos_km,
+            )
+            for v in vencimientos
+        )
+
+    def test_coincide_con_los_estados(self):
+        for hoy in [date(2024, 3, 1), date(2025, 2, 1), date(2100, 1, 1)]:
+            with self.subTest(hoy=hoy):
+                self.assertEqual(
+                    self.filas(barrer_flota(hoy=hoy)),
+                    self.filas(obtener_vencimientos(Vehiculo.objects.all(), hoy=hoy)),
+                )
+
+    def test_fin_de_mes_y_filas_sin_fecha(self):
+        vencimientos = {
+            (v.vehiculo.id, v.tipo_mantenimiento.id): v for v in barrer_flota(hoy=date(2100, 1, 1))
+        }
+
+        def proxima_fecha(vehiculo, tipo):
+            return vencimientos[self.vehiculos[vehiculo], self.tipos[tipo]].proxima_fecha
+
+        # 31 de enero + 13 meses (intervalo personalizado) y 29 de febrero + 12 meses
+        self.assertEqual(proxima_fecha('con_ritmo', 'Mensual'), date(2025, 2, 28))
+        self.assertEqual(proxima_fecha('sin_ritmo', 'Anual'), date(2025, 2, 28))
+        self.assertEqual(proxima_fecha('sin_ritmo', 'Mensual'), date(2024, 3, 29))
+        self.assertEqual(proxima_fecha('moto', 'Mensual'), date(2023, 9, 30))
+
+        # Solo km, sin ritmo y sin superar: no tiene fecha y queda fuera de cualquier ventana
+        self.assertNotIn((self.vehiculos['sin_ritmo'], self.tipos['Solo km']), vencimientos)
+        # Solo km ya superado sin ritmo: vence en la fecha de la lectura
+        superado = vencimientos[self.vehiculos['moto'], self.tipos['Solo km']]
+        self.assertIsNone(superado.proxima_fecha)
+        self.assertIsNone(superado.fecha_prevista_km)
+        self.assertEqual(superado.km_restantes, -500)
+        self.assertIsNotNone(superado.fecha_prevista)
+        # Tipo solo de motos en un coche
+        self.assertNotIn((self.vehiculos['con_ritmo'], self.tipos['Moto']), vencimientos)
+
+    def test_sumar_meses_como_relativedelta(self):
+        fechas = [date(2023, 1, 1) + timedelta(days=dias) for dias in range(3 * 366)]
+        for meses in range(1, 26):
+            with self.subTest(meses=meses):
+                calculadas = sumar_meses(
+                    np.array(fechas, dtype='datetime64[D]'), np.full(len(fechas), meses, dtype=np.int64)
+                )
+                self.assertEqual(
+                    calculadas.tolist(), [fecha + relativedelta(months=meses) for fecha in fechas]
+                )
+
+
+class LecturaKilometrajeTests(TestCase):
+    def setUp(self):
+        usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        self.vehiculo = Vehiculo.objects.create(propietario=usuario, tipo='coche', marca='Seat', modelo='Ibiza')
+        for fecha, km in [(date(2024, 1, 1), 10000), (date(2024, 7, 19), 20000)]:
+            RegistroMantenimiento.objects.create(
+                vehiculo=self.vehiculo, fecha_realizacion=fecha, kilometraje_realizacion=km,
+            )
+
+    def test_la_fecha_de_lectura_solo_cambia_con_el_kilometraje(self):
+        hace_un_mes = timezone.now() - timedelta(days=30)
+        Vehiculo.objects.filter(pk=self.vehiculo.pk).update(fecha_lectura_km=hace_un_mes)
+
+        vehiculo = Vehiculo.objects.get(pk=self.vehiculo.pk)
+        vehiculo.modelo = 'León'
+        vehiculo.save()
+        vehiculo.refresh_from_db()
+        self.assertEqual(vehiculo.fecha_lectura_km, hace_un_mes)
+
+        vehiculo.kilometraje_actual = 21000
+        vehiculo.save(update_fields=['kilometraje_actual'])
+        vehiculo.refresh_from_db()
+        self.assertGreater(vehiculo.fecha_lectura_km, hace_un_mes)
+
+    def test_sin_kilometraje_anotado_solo_cuenta_el_historial(self):
+        # 10000 km en 200 días; la lectura por defecto de 0 km no entra en el ajuste
+        self.assertEqual(estimar_km_diarios([self.vehiculo.id]), {self.vehiculo.id: 50.0})
+
+    def test_editar_el_vehiculo_no_mueve_la_lectura(self):
+        Vehiculo.objects.filter(pk=self.vehiculo.pk).update(
+            kilometraje_actual=30000,
+            fecha_lectura_km=timezone.make_aware(datetime(2025, 2, 4, 12)),
+        )
+        estimacion = estimar_km_diarios([self.vehiculo.id])
+        self.assertEqual(estimacion, {self.vehiculo.id: 50.0})
+
+        vehiculo = Vehiculo.objects.get(pk=self.vehiculo.pk)
+        vehiculo.matricula = '1234ABC'
+        vehiculo.save()
+        self.assertEqual(estimar_km_diarios([self.vehiculo.id]), estimacion)
+
+
+class CacheUsuarioTests(TestCase):
+    def setUp(self):
+        cache_usuario.lru.clear()
+        cache_usuario.versiones.clear()
+        self.calculos = 0
+
+    def calcular(self):
+        self.calculos += 1
+        return self.calculos
+
+    def test_acierto_en_memoria_no_consulta_la_cache_compartida(self):
+        self.assertEqual(cache_usuario.obtener_cacheado(7, 'dato', self.calcular), 1)
+
+        # La caché por defecto es DatabaseCache: cualquier viaje a ella sería una consulta
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(cache_usuario.obtener_cacheado(7, 'dato', self.calcular), 1)
+        self.assertEqual(len(consultas), 0)
+        self.assertEqual(self.calculos, 1)
+
+    def test_invalidar_en_el_mismo_proceso_se_ve_al_momento(self):
+        cache_usuario.obtener_cacheado(7, 'dato', self.calcular)
+        cache_usuario.invalidar_usuario(7)
+        self.assertEqual(cache_usuario.obtener_cacheado(7, 'dato', self.calcular), 2)
+
+    def test_cambios_de_otro_proceso_se_ven_tras_la_comprobacion(self):
+        cache_usuario.obtener_cacheado(7, 'dato', self.calcular)
+        # Otro proceso renueva la versión directamente en la caché compartida
+        cache.set(cache_usuario._clave_version(7), cache_usuario._nueva_version(), None)
+
+        self.assertEqual(cache_usuario.obtener_cacheado(7, 'dato', self.calcular), 1)
+        with override_settings(WHEELER_CACHE_COMPROBACION_VERSION=0):
+            self.assertEqual(cache_usuario.obtener_cacheado(7, 'dato', self.calcular), 2)
+
+
+class ConcesionTests(TestCase):
+    def test_solo_un_titular_hasta_que_expira(self):
+        adquirida, expira = Concesion.adquirir('barrido', timedelta(minutes=5), 'a')
+        self.assertTrue(adquirida)
+
+        self.assertEqual(Concesion.adquirir('barrido', timedelta(minutes=5), 'b'), (False, expira))
+        self.assertEqual(Concesion.objects.get(nombre='barrido').titular, 'a')
+
+        Concesion.objects.filter(nombre='barrido').update(expira=timezone.now() - timedelta(seconds=1))
+        adquirida, _ = Concesion.adquirir('barrido', timedelta(minutes=5), 'b')
+        self.assertTrue(adquirida)
+        self.assertEqual(Concesion.objects.get(nombre='barrido').titular, 'b')
+
+
+class ColaNotificacionesTests(TransactionTestCase):
+    """El trabajador corre en su propio hilo de conexión, así que se prueba fuera de una transacción"""
+
+    def setUp(self):
+        self.usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+
+    def trabajador(self, nombre):
+        trabajador = TrabajadorCola(stdout=StringIO(), stderr=StringIO())
+        trabajador.trabajador = nombre
+        trabajador.max_intentos = 3
+        trabajador.intervalo_latido = 60
+        return trabajador
+
+    def test_reencola_solo_las_tareas_sin_latido(self):
+        hace_una_hora = timezone.now() - timedelta(hours=1)
+        viva = TareaNotificacion.objects.create(
+            usuario=self.usuario, estado='en_curso', fecha_inicio=hace_una_hora, fecha_latido=timezone.now(),
+        )
+        muerta = TareaNotificacion.objects.create(
+            estado='en_curso', fecha_inicio=hace_una_hora, fecha_latido=hace_una_hora,
+        )
+        otro = User.objects.create_user('luis', 'luis@example.com', 'clave')
+        sin_latido = TareaNotificacion.objects.create(usuario=otro, estado='en_curso', fecha_inicio=hace_una_hora)
+
+        self.trabajador('w1').reencolar_abandonadas(900)
+
+        estados = dict(TareaNotificacion.objects.values_list('id', 'estado'))
+        self.assertEqual(estados, {viva.id: 'en_curso', muerta.id: 'pendiente', sin_latido.id: 'pendiente'})
+
+    def test_resultado_se_guarda_si_la_tarea_sigue_siendo_suya(self):
+        TareaNotificacion.encolar(self.usuario.id)
+        trabajador = self.trabajador('w1')
+        [tarea] = trabajador.reclamar(1)
+
+        with mock.patch(f'{TrabajadorCola.__module__}.call_command'):
+            trabajador.procesar(tarea)
+
+        tarea.refresh_from_db()
+        self.assertEqual(tarea.estado, 'completada')
+        self.assertIsNotNone(tarea.fecha_fin)
+
+    def test_resultado_no_pisa_una_tarea_reencolada(self):
+        TareaNotificacion.encolar()
+        trabajador = self.trabajador('w1')
+        [tarea] = trabajador.reclamar(1)
+
+        def latido_perdido(*args, **kwargs):
+            TareaNotificacion.objects.filter(id=tarea.id).update(fecha_latido=timezone.now() - timedelta(hours=1))
+            self.trabajador('w2').reencolar_abandonadas(900)
+
+        with mock.patch(f'{TrabajadorCola.__module__}.call_command', side_effect=latido_perdido):
+            trabajador.procesar(tarea)
+
+        tarea.refresh_from_db()
+        self.assertEqual(tarea.estado, 'pendiente')
+        self.assertIsNone(tarea.fecha_fin)
+        self.assertIn('reencolada', trabajador.stderr._out.getvalue())
+
+    def test_resultado_no_pisa_una_tarea_reclamada_por_otro(self):
+        TareaNotificacion.encolar(self.usuario.id)
+        trabajador = self.trabajador('w1')
+        [tarea] = trabajador.reclamar(1)
+
+        def reclamada_por_otro(*args, **kwargs):
+            otro = self.trabajador('w2')
+            TareaNotificacion.objects.filter(id=tarea.id).update(fecha_latido=timezone.now() - timedelta(hours=1))
+            otro.reencolar_abandonadas(900)
+            otro.reclamar(1)
+            raise RuntimeError('SMTP caído')
+
+        with mock.patch(f'{TrabajadorCola.__module__}.call_command', side_effect=reclamada_por_otro):
+            trabajador.procesar(tarea)
+
+        tarea.refresh_from_db()
+        self.assertEqual((tarea.estado, tarea.trabajador, tarea.intentos), ('en_curso', 'w2', 2))
+        self.assertEqual(tarea.ultimo_error, 'Tarea abandonada por su trabajador')
+
+
+class CalendarioTests(TestCase):
+    def setUp(self):
+        cache_usuario.lru.clear()
+        cache_usuario.versiones.clear()
+        self.usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        self.url = reverse('maintenance:calendario_ics', args=[token_calendario(self.usuario.id)])
+
+    def test_feed_sin_cambios_responde_304(self):
+        respuesta = self.client.get(self.url)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta['Content-Type'], 'text/calendar; charset=utf-8')
+
+        respuesta_etag = self.client.get(self.url, HTTP_IF_NONE_MATCH=respuesta['ETag'])
+        self.assertEqual(respuesta_etag.status_code, 304)
+        respuesta_fecha = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=respuesta['Last-Modified'])
+        self.assertEqual(respuesta_fecha.status_code, 304)
+
+        # Un cambio en los datos del usuario renueva la versión y con ella el ETag
+        with self.captureOnCommitCallbacks(execute=True):
+            Vehiculo.objects.create(propietario=self.usuario, tipo='coche', marca='Seat', modelo='Ibiza')
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=respuesta['ETag']).status_code, 200)
+
+    def test_token_invalido_responde_404(self):
+        token = token_calendario(self.usuario.id)
+        for malo in ('basura', token[:-1] + ('A' if token[-1] != 'A' else 'B')):
+            url = reverse('maintenance:calendario_ics', args=[malo])
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_renovar_la_clave_revoca_los_enlaces(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        self.client.force_login(self.usuario)
+        self.client.post(reverse('maintenance:renovar_calendario'))
+
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        url_nueva = reverse('maintenance:calendario_ics', args=[token_calendario(self.usuario.id)])
+        self.assertEqual(self.client.get(url_nueva).status_code, 200)
+        self.assertEqual(ClaveCalendario.objects.filter(usuario=self.usuario).count(), 1)
+
+
+class RepartoNotificacionesTests(TestCase):
+    """--shard y --chunk-size reparten los usuarios sin perder ni repetir ninguno"""
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tipo = TipoMantenimiento.objects.create(nombre='Aceite', intervalo_meses=1)
+            usuarios = [User.objects.create_user(f'u{i}', f'u{i}@example.com', 'clave') for i in range(8)]
+            for usuario in usuarios:
+                vehiculo = Vehiculo.objects.create(
+                    propietario=usuario, tipo='coche', marca='Seat', modelo='Ibiza', kilometraje_actual=10000,
+                )
+                registro = RegistroMantenimiento.objects.create(
+                    vehiculo=vehiculo, fecha_realizacion=date.today() - timedelta(days=90), kilometraje_realizacion=5000,
+                )
+                ItemMantenimiento.objects.create(registro=registro, tipo_mantenimiento=tipo, costo_unitario=Decimal('1.00'))
+            # Un hueco en los ids, como en cualquier base de datos con bajas
+            usuarios.pop(3).delete()
+        self.emails = sorted(usuario.email for usuario in usuarios)
+
+    def avisados(self, *argumentos):
+        salida = StringIO()
+        call_command('enviar_notificaciones_mantenimiento', '--test-mode', *argumentos, stdout=salida)
+        prefijo = '📧 [MODO PRUEBA] Se enviaría aviso a '
+        return [linea[len(prefijo):-1] for linea in salida.getvalue().splitlines() if linea.startswith(prefijo)]
+
+    def test_dividir_rango_cubre_cada_id_una_vez(self):
+        for desde, hasta, partes in [(1, 2, 1), (1, 2, 4), (1, 101, 3), (7, 30, 7), (5, 1005, 16)]:
+            rangos = _dividir_rango(desde, hasta, partes)
+            self.assertLessEqual(len(rangos), partes)
+            ids = [id_ for inicio, fin in rangos for id_ in range(inicio, fin)]
+            self.assertEqual(ids, list(range(desde, hasta)))
+
+    def test_shards_avisan_a_cada_usuario_una_vez(self):
+        for motor in ('estados', 'vectorized'):
+            for total in (1, 3, 20):
+                with self.subTest(motor=motor, shards=total):
+                    avisados = []
+                    for indice in range(total):
+                        avisados += self.avisados(
+                            '--engine', motor, '--shard', f'{indice}/{total}', '--chunk-size', '2',
+                        )
+                    self.assertEqual(sorted(avisados), self.emails)
+
+    def test_motor_vectorizado_calcula_por_bloques(self):
+        with mock.patch(f'{EnviarNotificaciones.__module__}.barrer_flota', wraps=barrer_flota) as barrido:
+            avisados = self.avisados('--engine', 'vectorized', '--chunk-size', '3')
+
+        self.assertEqual(sorted(avisados), self.emails)
+        bloques = [sorted(llamada.args[0].values_list('email', flat=True)) for llamada in barrido.call_args_list]
+        self.assertEqual([len(bloque) for bloque in bloques], [3, 3, 1])
+        self.assertEqual(sorted(email for bloque in bloques for email in bloque), self.emails)
+
+
+class CostesEsperadosTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        self.vehiculo = Vehiculo.objects.create(propietario=self.usuario, tipo='coche', marca='Seat', modelo='Ibiza')
+        self.tipos = {
+            nombre: TipoMantenimiento.objects.create(nombre=nombre)
+            for nombre in ['Aceite', 'Filtro', 'Frenos', 'Escobillas']
+        }
+
+    def registrar(self, mano_obra, items):
+        with self.captureOnCommitCallbacks(execute=True):
+            registro = RegistroMantenimiento.objects.create(
+                vehiculo=self.vehiculo, fecha_realizacion=date(2024, 1, 1), kilometraje_realizacion=1000,
+                costo_mano_obra_total=mano_obra,
+            )
+            for nombre, cantidad, costo in items:
+                ItemMantenimiento.objects.create(
+                    registro=registro, tipo_mantenimiento=self.tipos[nombre], cantidad=cantidad, costo_unitario=costo,
+                )
+
+    def test_media_por_tipo_con_mano_obra_repartida(self):
+        # 50 € de mano de obra entre tres ítems: 16,666… € cada uno
+        self.registrar(Decimal('50.00'), [('Aceite', 1, Decimal('10.00')), ('Filtro', 1, Decimal('10.00')),
+                                          ('Frenos', 3, Decimal('20.00'))])
+        self.registrar(Decimal('0.01'), [('Aceite', 2, Decimal('1.25'))])
+        # Media exactamente en medio céntimo: 1,005 € se redondea hacia arriba
+        self.registrar(None, [('Escobillas', 1, Decimal('1.00'))])
+        self.registrar(None, [('Escobillas', 1, Decimal('1.01'))])
+        otro = User.objects.create_user('luis', 'luis@example.com', 'clave')
+        with self.captureOnCommitCallbacks(execute=True):
+            ajeno = RegistroMantenimiento.objects.create(
+                vehiculo=Vehiculo.objects.create(propietario=otro, tipo='coche', marca='Kia', modelo='Rio'),
+                fecha_realizacion=date(2024, 1, 1), kilometraje_realizacion=1000,
+            )
+            ItemMantenimiento.objects.create(registro=ajeno, tipo_mantenimiento=self.tipos['Aceite'],
+                                             costo_unitario=Decimal('999.00'))
+
+        with CaptureQueriesContext(connection) as consultas:
+            costes = costes_esperados(self.usuario.id)
+        self.assertEqual(len(consultas), 1)
+        self.assertEqual(costes, {
+            self.tipos['Aceite'].id: Decimal('14.59'),
+            self.tipos['Filtro'].id: Decimal('26.67'),
+            self.tipos['Frenos'].id: Decimal('76.67'),
+            self.tipos['Escobillas'].id: Decimal('1.01'),
+        })
+
+
+class AvisosInmediatosTests(TestCase):
+    def setUp(self):
+        self.usuario = User.objects.create_user('ana', 'ana@example.com', 'clave')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.aceite = TipoMantenimiento.objects.create(nombre='Aceite', intervalo_km=10000)
+            self.frenos = TipoMantenimiento.objects.create(nombre='Frenos', intervalo_km=30000)
+            vehiculo = Vehiculo.objects.create(
+                propietario=self.usuario, tipo='coche', marca='Seat', modelo='Ibiza', kilometraje_actual=10000,
+            )
+            self.registro = RegistroMantenimiento.objects.create(
+                vehiculo=vehiculo, fecha_realizacion=date.today(), kilometraje_realizacion=500,
+            )
+            self.item = ItemMantenimiento.objects.create(
+                registro=self.registro, tipo_mantenimiento=self.frenos, costo_unitario=Decimal('1.00'),
+            )
+
+    def cambiar_tipo(self, tipo):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.tipo_mantenimiento = tipo
+            self.item.save()
+
+    def test_encola_una_tarea_solo_al_aparecer_un_aviso(self):
+        # Los frenos quedan a 20.500 km: sin aviso
+        self.assertFalse(TareaNotificacion.objects.exists())
+
+        # El aceite queda a 500 km: aparece un aviso
+        self.cambiar_tipo(self.aceite)
+        self.assertEqual(TareaNotificacion.objects.filter(usuario=self.usuario).count(), 1)
+
+        # Guardar otra vez sin cambiar el aviso no encola nada más
+        TareaNotificacion.objects.update(estado='completada')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        self.assertEqual(TareaNotificacion.objects.count(), 1)
+
+    def test_ajuste_leido_al_confirmar(self):
+        with override_settings(WHEELER_AVISOS_INMEDIATOS=False):
+            self.cambiar_tipo(self.aceite)
+        self.assertFalse(TareaNotificacion.objects.exists())
+
+
+class SolicitudesRegistroTests(TestCase):
+    """Los emails de registro solo llegan a la bandeja de salida si la transacción se confirma"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user('sa', 'admin@example.com', 'clave', is_staff=True)
+
+    def solicitud(self, username, email=None):
+        return UserRegistrationRequest.objects.create(
+            username=username, email=email or f'{username}@example.com',
+            first_name=username.title(), last_name='Pérez', password_hash='!',
+        )
+
+    def test_aprobar_encola_el_email_al_confirmar(self):
+        solicitud = self.solicitud('ana')
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario = solicitud.aprobar(self.admin)
+
+        self.assertEqual(usuario.username, 'ana')
+        self.assertEqual(list(CorreoSaliente.objects.values_list('destinatario', flat=True)), ['ana@example.com'])
+
+    def test_aprobacion_revertida_no_encola_nada(self):
+        solicitud = self.solicitud('ana')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    solicitud.aprobar(self.admin)
+                    raise RuntimeError('fallo posterior en la misma transacción')
+
+        self.assertEqual(callbacks, [])
+        self.assertFalse(CorreoSaliente.objects.exists())
+        self.assertFalse(User.objects.filter(username='ana').exists())
+        solicitud.refresh_from_db()
+        self.assertEqual(solicitud.status, 'pendiente')
+
+    def test_aprobar_en_bloque_encola_un_email_por_solicitud(self):
+        for username in ['ana', 'luis', 'marta']:
+            self.solicitud(username)
+        self.solicitud('ana', 'otra-ana@example.com')
+        User.objects.create_user('pablo', 'pablo@example.com', 'clave')
+        self.solicitud('pablo', 'pablo2@example.com')
+        self.solicitud('rosa').aprobar(self.admin)
+        CorreoSaliente.objects.all().delete()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            usuarios, errores = UserRegistrationRequest.aprobar_en_bloque(
+                UserRegistrationRequest.objects.order_by('id'), self.admin,
+            )
+
+        self.assertEqual(len(errores), 2)
+        self.assertEqual(
+            sorted(CorreoSaliente.objects.values_list('destinatario', 'usuario__username')),
+            [('ana@example.com', 'ana'), ('luis@example.com', 'luis'), ('marta@example.com', 'marta')],
+        )
+        self.assertEqual(sorted(usuario.username for usuario in usuarios), ['ana', 'luis', 'marta'])
+
+    def test_registro_encola_el_aviso_al_administrador(self):
+        datos = {
+            'username': 'ana', 'email': 'ana@example.com', 'first_name': 'Ana', 'last_name': 'Pérez',
+            'password1': 'clave-segura', 'password2': 'clave-segura',
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(reverse('maintenance:registro_usuario'), datos)
+
+        self.assertRedirects(respuesta, reverse('maintenance:registro_exitoso'))
+        self.assertTrue(UserRegistrationRequest.objects.filter(username='ana', status='pendiente').exists())
+        [correo] = CorreoSaliente.objects.all()
+        self.assertEqual(correo.destinatario, 'admin@example.com')
+        self.assertIn('ana', correo.asunto)
+
+        # Una solicitud repetida no pasa la validación y no avisa a nadie
+        with self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(reverse('maintenance:registro_usuario'), datos)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(CorreoSaliente.objects.count(), 1)
+
+
+class DefinicionIndiceTests(SimpleTestCase):
+    """La conversión a tabla particionada recrea los índices con nombres provisionales"""
+
+    def test_reescribe_nombre_y_tabla(self):
+        comando = ParticionarNotificaciones()
+        self.assertEqual(
+            comando.definicion_indice(
+                'CREATE INDEX notif_fecha_envio_idx ON public.maintenance_notificacionmantenimiento '
+                'USING btree (fecha_envio)',
+                'nueva_idx0', '"nueva"',
+            ),
+            'CREATE INDEX "nueva_idx0" ON "nueva" USING btree (fecha_envio)',
+        )
+        self.assertEqual(
+            comando.definicion_indice(
+                'CREATE UNIQUE INDEX u ON ONLY public.t USING btree (id, fecha_envio) WHERE (email_enviado)',
+                'nueva_idx1', '"nueva"',
+            ),
+            'CREATE UNIQUE INDEX "nueva_idx1" ON "nueva" USING btree (id, fecha_envio) WHERE (email_enviado)',
+        )
+        with self.assertRaises(CommandError):
+            comando.definicion_indice('CREATE TABLE t (id int)', 'x', '"nueva"')
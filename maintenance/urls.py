@@ -13,6 +13,7 @@ urlpatterns = [
     path('vehiculos/<int:vehiculo_id>/', views.detalle_vehiculo, name='detalle_vehiculo'),
     path('vehiculos/<int:vehiculo_id>/editar/', views.editar_vehiculo, name='editar_vehiculo'),
     path('vehiculos/<int:vehiculo_id>/eliminar/', views.eliminar_vehiculo, name='eliminar_vehiculo'),
+    path('vehiculos/<int:vehiculo_id>/plan/', views.plan_mantenimiento, name='plan_mantenimiento'),
     
     # Gestión de mantenimientos
     path('mantenimientos/', views.lista_mantenimientos, name='lista_mantenimientos'),
@@ -21,10 +22,18 @@ urlpatterns = [
     path('mantenimientos/<int:mantenimiento_id>/editar/', views.editar_mantenimiento, name='editar_mantenimiento'),
     path('mantenimientos/<int:mantenimiento_id>/eliminar/', views.eliminar_mantenimiento, name='eliminar_mantenimiento'),
     path('mantenimientos/proximos/', views.proximos_mantenimientos, name='proximos_mantenimientos'),
+    path('mantenimientos/gastos/', views.analitica_gastos, name='analitica_gastos'),
+    
+    # Operaciones (solo staff)
+    path('operaciones/vencimientos/', views.operaciones_vencimientos, name='operaciones_vencimientos'),
     
     # API endpoints
     path('api/tipos-mantenimiento/', views.get_tipos_mantenimiento_json, name='api_tipos_mantenimiento'),
     
+    # Calendario (acceso por token firmado, sin sesión)
+    path('calendario/<str:token>.ics', views.calendario_ics, name='calendario_ics'),
+    path('calendario/renovar/', views.renovar_calendario, name='renovar_calendario'),
+    
     # Registro de usuarios
     path('registro/', views.registro_usuario, name='registro_usuario'),
     path('registro/exitoso/', views.registro_exitoso, name='registro_exitoso'),
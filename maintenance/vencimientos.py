@@ -0,0 +1,404 @@
+"""
+Motor de cálculo de vencimientos de mantenimiento.
+
+Resuelve en bloque, para un conjunto de vehículos, el último servicio de cada
+tipo de mantenimiento y los intervalos efectivos, de modo que el coste en
+consultas no dependa del número de pares (vehículo, tipo). El resultado se
+materializa en EstadoMantenimiento, que es lo que leen las vistas y el
+comando de notificaciones.
+"""
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Optional
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .cache import invalidar_usuario, obtener_cacheado
+from .catalogo import obtener_catalogo
+from .proyeccion import fecha_prevista_km
+from .models import (
+    Vehiculo, TipoMantenimiento, IntervaloMantenimiento,
+    RegistroMantenimiento, ItemMantenimiento, EstadoMantenimiento
+)
+
+
+# Umbrales a partir de los cuales un mantenimiento se considera próximo
+UMBRAL_KM = 1000
+UMBRAL_DIAS = 30
+
+# Campos de EstadoMantenimiento que se recalculan al actualizar un estado
+CAMPOS_ESTADO = [
+    'ultimo_registro', 'fecha_ultimo', 'km_ultimo', 'intervalo_km', 'intervalo_meses',
+    'proximo_km', 'proxima_fecha', 'km_restantes', 'fecha_prevista_km', 'fecha_prevista',
+    'proxima_revision', 'fecha_actualizacion',
+]
+
+
+@dataclass
+class Vencimiento:
+    """Estado de vencimiento de un tipo de mantenimiento en un vehículo"""
+
+    vehiculo: Vehiculo
+    tipo_mantenimiento: TipoMantenimiento
+    ultimo_registro: RegistroMantenimiento
+    intervalo_km: int
+    intervalo_meses: int
+    proximo_km: Optional[int]
+    proxima_fecha: Optional[date]
+    km_restantes: Optional[int]
+    dias_restantes: Optional[int]
+    fecha_prevista_km: Optional[date] = None
+    fecha_prevista: Optional[date] = None
+    dias_previstos_km: Optional[int] = None
+
+    @property
+    def proximo_por_km(self):
+        return self.km_restantes is not None and self.km_restantes <= UMBRAL_KM
+
+    @property
+    def proximo_por_tiempo(self):
+        return self.dias_restantes is not None and self.dias_restantes <= UMBRAL_DIAS
+
+    @property
+    def proximo_por_prevision(self):
+        """El ritmo de uso estimado alcanzará el kilometraje dentro del umbral de días"""
+        return self.dias_previstos_km is not None and self.dias_previstos_km <= UMBRAL_DIAS
+
+    @property
+    def vencido_km(self):
+        return self.km_restantes is not None and self.km_restantes <= 0
+
+    @property
+    def vencido_tiempo(self):
+        return self.dias_restantes is not None and self.dias_restantes <= 0
+
+    @property
+    def es_proximo(self):
+        return self.proximo_por_km or self.proximo_por_tiempo or self.proximo_por_prevision
+
+    @property
+    def urgencia(self):
+        """0 = no urgente, 1 = próximo, 2 = vencido"""
+        if self.vencido_km or self.vencido_tiempo:
+            return 2
+        if self.es_proximo:
+            return 1
+        return 0
+
+    @property
+    def tipo_alerta(self):
+        """Tipo de alerta según NotificacionMantenimiento.tipo_alerta"""
+        if self.vencido_km:
+            return 'vencido_km'
+        if self.vencido_tiempo:
+            return 'vencido_tiempo'
+        if self.proximo_por_tiempo:
+            return 'proximo_tiempo'
+        return 'proximo_km'
+
+
+def intervalos_efectivos(tipo_mantenimiento, intervalo_personalizado=None):
+    """Devuelve (intervalo_km, intervalo_meses) aplicando la personalización si existe"""
+    intervalo_km = tipo_mantenimiento.intervalo_km or 0
+    intervalo_meses = tipo_mantenimiento.intervalo_meses or 0
+    if intervalo_personalizado:
+        intervalo_km = intervalo_personalizado.intervalo_km_personalizado or intervalo_km
+        intervalo_meses = intervalo_personalizado.intervalo_meses_personalizado or intervalo_meses
+    return intervalo_km, intervalo_meses
+
+
+def en_aviso(proxima_fecha, fecha_prevista_km, km_restantes, hoy):
+    """Lo mismo que Vencimiento.es_proximo a partir de los campos de un estado"""
+    umbral = timedelta(days=UMBRAL_DIAS)
+    return (
+        (km_restantes is not None and km_restantes <= UMBRAL_KM) or
+        (proxima_fecha is not None and proxima_fecha - umbral <= hoy) or
+        (fecha_prevista_km is not None and fecha_prevista_km - umbral <= hoy)
+    )
+
+
+def proxima_revision(proxima_fecha, fecha_prevista_km, km_restantes, hoy=None):
+    """
+    Primer día posterior a ``hoy`` en que el aviso de un estado puede cambiar
+    sin que cambien sus datos: cuando entra en el umbral de días por tiempo o
+    por kilometraje previsto.
+
+    Mientras está en aviso se revisa cada día, que es la frecuencia con la
+    que se repiten los recordatorios. Sin fechas por delante devuelve None:
+    solo un cambio en los datos (que ya recalcula el estado) puede avisarlo.
+    """
+    hoy = hoy or date.today()
+    if en_aviso(proxima_fecha, fecha_prevista_km, km_restantes, hoy):
+        return hoy + timedelta(days=1)
+
+    umbral = timedelta(days=UMBRAL_DIAS)
+    # Fuera de aviso, ambas fechas de entrada en el umbral son posteriores a hoy
+    cambios = [fecha - umbral for fecha in (proxima_fecha, fecha_prevista_km) if fecha is not None]
+    return min(cambios) if cambios else None
+
+
+def tipos_con_intervalo():
+    """Tipos de mantenimiento activos que tienen algún intervalo definido"""
+    return obtener_catalogo().con_intervalo
+
+
+def ultimos_items(vehiculo_ids, tipo_ids=None):
+    """
+    Ítems del servicio más reciente de cada (vehículo, tipo de mantenimiento),
+    seleccionados con una única consulta de ventana.
+
+    ``vehiculo_ids`` puede ser una lista o una subconsulta.
+    """
+    items = ItemMantenimiento.objects.filter(registro__vehiculo_id__in=vehiculo_ids)
+    if tipo_ids is not None:
+        items = items.filter(tipo_mantenimiento_id__in=tipo_ids)
+
+    return items.annotate(
+        orden=Window(
+            expression=RowNumber(),
+            partition_by=[F('registro__vehiculo_id'), F('tipo_mantenimiento_id')],
+            order_by=[
+                F('registro__fecha_realizacion').desc(),
+                F('registro__kilometraje_realizacion').desc(),
+                F('registro_id').desc(),
+            ],
+        )
+    ).filter(orden=1).order_by()
+
+
+def ultimos_servicios(vehiculo_ids, tipo_ids=None):
+    """Devuelve {(vehiculo_id, tipo_id): registro_id} con el registro más reciente de cada tipo"""
+    items = ultimos_items(vehiculo_ids, tipo_ids).values_list(
+        'registro__vehiculo_id', 'tipo_mantenimiento_id', 'registro_id'
+    )
+    return {(vehiculo_id, tipo_id): registro_id for vehiculo_id, tipo_id, registro_id in items}
+
+
+def intervalos_personalizados(vehiculo_ids):
+    """Devuelve {(vehiculo_id, tipo_id): IntervaloMantenimiento} en una sola consulta"""
+    return {
+        (intervalo.vehiculo_id, intervalo.tipo_mantenimiento_id): intervalo
+        for intervalo in IntervaloMantenimiento.objects.filter(vehiculo_id__in=vehiculo_ids)
+    }
+
+
+def recalcular_estados(vehiculo_ids, tipo_ids=None):
+    """
+    Recalcula y persiste los EstadoMantenimiento de los vehículos indicados.
+
+    Con ``tipo_ids`` sólo se recalculan esos tipos de mantenimiento. Los
+    vehículos que ya no existen se ignoran, por lo que es seguro llamarlo
+    tras un borrado en cascada.
+    """
+    vehiculos = list(Vehiculo.objects.filter(id__in=vehiculo_ids).only(
+        'id', 'tipo', 'kilometraje_actual', 'propietario', 'km_diarios_estimados', 'fecha_lectura_km'
+    ))
+    vehiculo_ids = [vehiculo.id for vehiculo in vehiculos]
+    if not vehiculo_ids:
+        return 0
+
+    tipos = {tipo.id: tipo for tipo in tipos_con_intervalo()}
+    if tipo_ids is not None:
+        tipo_ids = set(tipo_ids)
+        tipos = {tipo_id: tipo for tipo_id, tipo in tipos.items() if tipo_id in tipo_ids}
+
+    ultimos = ultimos_servicios(vehiculo_ids, tipo_ids=list(tipos))
+    registros = RegistroMantenimiento.objects.only(
+        'id', 'fecha_realizacion', 'kilometraje_realizacion'
+    ).in_bulk(set(ultimos.values()))
+    personalizados = intervalos_personalizados(vehiculo_ids)
+    hoy = date.today()
+
+    estados = []
+    for vehiculo in vehiculos:
+        for tipo in tipos.values():
+            registro_id = ultimos.get((vehiculo.id, tipo.id))
+            if registro_id is None or not tipo.es_aplicable_a_vehiculo(vehiculo):
+                continue
+            registro = registros[registro_id]
+
+            intervalo_km, intervalo_meses = intervalos_efectivos(
+                tipo, personalizados.get((vehiculo.id, tipo.id))
+            )
+
+            proximo_km = km_restantes = None
+            if intervalo_km > 0:
+                proximo_km = registro.kilometraje_realizacion + intervalo_km
+                km_restantes = proximo_km - vehiculo.kilometraje_actual
+
+            proxima_fecha = None
+            if intervalo_meses > 0:
+                proxima_fecha = registro.fecha_realizacion + relativedelta(months=intervalo_meses)
+
+            prevista_km = fecha_prevista_km(
+                km_restantes, vehiculo.km_diarios_estimados, timezone.localdate(vehiculo.fecha_lectura_km)
+            )
+            fechas = [fecha for fecha in (proxima_fecha, prevista_km) if fecha is not None]
+            if km_restantes is not None and km_restantes <= 0 and prevista_km is None:
+                # Sin ritmo estimado, un kilometraje ya superado vence en la fecha de la lectura
+                fechas.append(timezone.localdate(vehiculo.fecha_lectura_km))
+
+            estados.append(EstadoMantenimiento(
+                vehiculo_id=vehiculo.id,
+                tipo_mantenimiento_id=tipo.id,
+                ultimo_registro_id=registro.id,
+                fecha_ultimo=registro.fecha_realizacion,
+                km_ultimo=registro.kilometraje_realizacion,
+                intervalo_km=intervalo_km,
+                intervalo_meses=intervalo_meses,
+                proximo_km=proximo_km,
+                proxima_fecha=proxima_fecha,
+                km_restantes=km_restantes,
+                fecha_prevista_km=prevista_km,
+                fecha_prevista=min(fechas) if fechas else None,
+                proxima_revision=proxima_revision(proxima_fecha, prevista_km, km_restantes, hoy),
+            ))
+
+    vigentes = {(estado.vehiculo_id, estado.tipo_mantenimiento_id) for estado in estados}
+    existentes = EstadoMantenimiento.objects.filter(vehiculo_id__in=vehiculo_ids)
+    if tipo_ids is not None:
+        existentes = existentes.filter(tipo_mantenimiento_id__in=tipo_ids)
+    # Estados que ya no corresponden (tipos sin historial, inactivos o no aplicables)
+    obsoletos = [
+        estado_id
+        for estado_id, vehiculo_id, tipo_id in existentes.values_list('id', 'vehiculo_id', 'tipo_mantenimiento_id')
+        if (vehiculo_id, tipo_id) not in vigentes
+    ]
+
+    with transaction.atomic():
+        if obsoletos:
+            EstadoMantenimiento.objects.filter(id__in=obsoletos).delete()
+        EstadoMantenimiento.objects.bulk_create(
+            estados,
+            update_conflicts=True,
+            unique_fields=['vehiculo', 'tipo_mantenimiento'],
+            update_fields=CAMPOS_ESTADO,
+        )
+
+    for propietario_id in {vehiculo.propietario_id for vehiculo in vehiculos}:
+        invalidar_usuario(propietario_id)
+
+    return len(estados)
+
+
+def obtener_vencimientos(vehiculos, hoy=None, solo_proximos=True):
+    """
+    Devuelve los vencimientos de los vehículos indicados leyendo los estados
+    materializados.
+
+    Con ``solo_proximos`` se devuelven únicamente los que están dentro de los
+    umbrales de aviso (UMBRAL_KM / UMBRAL_DIAS) o ya vencidos.
+    """
+    hoy = hoy or date.today()
+    estados = EstadoMantenimiento.objects.filter(vehiculo__in=vehiculos)
+    if solo_proximos:
+        estados = estados.filter(
+            Q(km_restantes__lte=UMBRAL_KM) |
+            Q(fecha_prevista__lte=hoy + timedelta(days=UMBRAL_DIAS))
+        )
+    # Los tipos salen del catálogo en memoria en lugar de un JOIN por fila
+    estados = estados.select_related('vehiculo', 'ultimo_registro')
+    catalogo = obtener_catalogo()
+
+    return [
+        Vencimiento(
+            vehiculo=estado.vehiculo,
+            tipo_mantenimiento=catalogo.get(estado.tipo_mantenimiento_id) or estado.tipo_mantenimiento,
+            ultimo_registro=estado.ultimo_registro,
+            intervalo_km=estado.intervalo_km,
+            intervalo_meses=estado.intervalo_meses,
+            proximo_km=estado.proximo_km,
+            proxima_fecha=estado.proxima_fecha,
+            km_restantes=estado.km_restantes,
+            dias_restantes=(estado.proxima_fecha - hoy).days if estado.proxima_fecha else None,
+            fecha_prevista_km=estado.fecha_prevista_km,
+            fecha_prevista=estado.fecha_prevista,
+            dias_previstos_km=(estado.fecha_prevista_km - hoy).days if estado.fecha_prevista_km else None,
+        )
+        for estado in estados
+    ]
+
+
+def ordenar_por_prioridad(vencimientos):
+    """Ordena los vencimientos dejando primero los vencidos y después por fecha prevista"""
+    return sorted(vencimientos, key=lambda v: (
+        -v.urgencia,
+        v.fecha_prevista or date.max,
+        v.km_restantes if v.km_restantes is not None else 999999
+    ))
+
+
+def vencimientos_flota(dias, km=None, hoy=None):
+    """
+    Estados de toda la flota vencidos o que vencen en los próximos ``dias``.
+
+    La ventana de fechas es un único rango sobre el índice de fecha_prevista,
+    que ya devuelve las filas en orden. Con ``km`` se incluyen también los que
+    tengan ``km`` o menos kilómetros restantes.
+    """
+    hoy = hoy or date.today()
+    ventana = Q(fecha_prevista__lte=hoy + timedelta(days=dias))
+    if km is not None:
+        ventana |= Q(km_restantes__lte=km)
+    return EstadoMantenimiento.objects.filter(ventana).select_related(
+        'vehiculo__propietario', 'tipo_mantenimiento'
+    ).order_by(F('fecha_prevista').asc(nulls_last=True), 'id')
+
+
+def describir_vencimiento(vencimiento):
+    """Texto de aviso de un vencimiento para las vistas web"""
+    mensaje = ""
+    if vencimiento.proximo_por_km or vencimiento.proximo_por_prevision:
+        km_restantes = vencimiento.km_restantes
+        if km_restantes <= 0:
+            mensaje = f"¡Ya es hora del mantenimiento! (Pasado por {abs(km_restantes):.0f} km)"
+        else:
+            mensaje = f"Próximo mantenimiento en {km_restantes:.0f} km"
+            if vencimiento.fecha_prevista_km:
+                mensaje += f" (previsto hacia el {vencimiento.fecha_prevista_km:%d/%m/%Y})"
+    
+    if vencimiento.proximo_por_tiempo:
+        dias_restantes = vencimiento.dias_restantes
+        if dias_restantes <= 0:
+            mensaje += f" ¡Ya es hora del mantenimiento! (Pasado por {abs(dias_restantes)} días)"
+        elif mensaje:
+            mensaje += f" o en {dias_restantes} días"
+        else:
+            mensaje = f"Próximo mantenimiento en {dias_restantes} días"
+    
+    return mensaje.strip()
+
+
+def resumen_vencimientos_usuario(usuario_id, limite=10):
+    """
+    Resumen de los vencimientos más urgentes de un usuario para el panel de inicio.
+
+    Se guarda en la caché de dos niveles por versión de datos del usuario y por
+    día, ya que los días restantes cambian con la fecha. Contiene solo valores
+    simples para que sea barato de serializar.
+    """
+    hoy = date.today()
+
+    def calcular():
+        vehiculos = Vehiculo.objects.filter(propietario_id=usuario_id)
+        vencimientos = ordenar_por_prioridad(obtener_vencimientos(vehiculos, hoy=hoy))
+        return [
+            {
+                'tipo_mantenimiento': vencimiento.tipo_mantenimiento.nombre,
+                'vehiculo': str(vencimiento.vehiculo),
+                'vehiculo_id': vencimiento.vehiculo.id,
+                'mensaje': describir_vencimiento(vencimiento),
+                'urgencia': vencimiento.urgencia,
+                'km_restantes': vencimiento.km_restantes,
+                'dias_restantes': vencimiento.dias_restantes,
+            }
+            for vencimiento in vencimientos[:limite]
+        ]
+
+    return obtener_cacheado(
+        usuario_id, f'resumen_vencimientos:{hoy.isoformat()}:{limite}', calcular, timeout=86400
+    )
@@ -1,12 +1,24 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import Paginator
 from django.contrib import messages
-from django.http import JsonResponse
-from django.db import models
-from django.db.models import Q, Max
-from django.utils import timezone
-from datetime import timedelta
-from .models import Vehiculo, TipoMantenimiento, IntervaloMantenimiento, RegistroMantenimiento, ItemMantenimiento
+from django.http import Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.urls import reverse
+from django.db.models import Min
+from datetime import date
+from .models import Vehiculo, TipoMantenimiento, IntervaloMantenimiento, RegistroMantenimiento, ItemMantenimiento, EstadoMantenimiento, ClaveCalendario
+from .calendario import token_calendario, leer_token, ultima_modificacion, ics_cacheado
+from .cache import version_usuario
+from .catalogo import obtener_catalogo
+from .correo import encolar_correo
+from .gastos import gastos_usuario, PERIODOS, PERIODO_POR_DEFECTO
+from .plan import plan_vehiculo, AÑOS_POR_DEFECTO, AÑOS_MAXIMOS
+from .vencimientos import (
+    obtener_vencimientos, ordenar_por_prioridad, describir_vencimiento,
+    resumen_vencimientos_usuario, vencimientos_flota
+)
 from .forms import VehiculoForm, RegistroMantenimientoForm, ItemMantenimientoFormSet, FiltroMantenimientoForm, UserRegistrationForm
 
 
@@ -15,13 +27,13 @@ def inicio(request):
     """Página principal mostrando los vehículos del usuario y alertas de mantenimiento"""
     vehiculos = Vehiculo.objects.filter(propietario=request.user)
     
-    # TODO: Implementar lógica de mantenimientos próximos con nuevo modelo
-    mantenimientos_proximos = []
+    # Alertas de mantenimiento desde el resumen cacheado del usuario
+    mantenimientos_proximos = resumen_vencimientos_usuario(request.user.id, limite=10)
     
     # Obtener últimos mantenimientos
     ultimos_mantenimientos = RegistroMantenimiento.objects.filter(
         vehiculo__propietario=request.user
-    ).prefetch_related('items__tipo_mantenimiento')[:5]
+    ).select_related('vehiculo')[:5]
     
     context = {
         'vehiculos': vehiculos,
@@ -76,10 +88,15 @@ def detalle_vehiculo(request, vehiculo_id):
     # Obtener últimos mantenimientos
     ultimos_mantenimientos = vehiculo.mantenimientos.all()[:5]
     
+    url_calendario = request.build_absolute_uri(reverse(
+        'maintenance:calendario_ics', args=[token_calendario(request.user.id, vehiculo.id)]
+    ))
+    
     return render(request, 'maintenance/vehiculos/detalle.html', {
         'vehiculo': vehiculo,
         'intervalos_personalizados': intervalos_personalizados,
-        'ultimos_mantenimientos': ultimos_mantenimientos
+        'ultimos_mantenimientos': ultimos_mantenimientos,
+        'url_calendario': url_calendario,
     })
 
 
@@ -121,6 +138,38 @@ def eliminar_vehiculo(request, vehiculo_id):
     })
 
 
+@login_required
+def plan_mantenimiento(request, vehiculo_id):
+    """Vista con el plan de mantenimiento plurianual y la previsión de costes de un vehículo"""
+    vehiculo = get_object_or_404(Vehiculo, id=vehiculo_id, propietario=request.user)
+    
+    try:
+        años = int(request.GET.get('años', AÑOS_POR_DEFECTO))
+    except ValueError:
+        años = AÑOS_POR_DEFECTO
+    años = min(max(años, 1), AÑOS_MAXIMOS)
+    
+    repeticiones = plan_vehiculo(vehiculo, años)
+    
+    # Totales por año natural
+    costes_por_año = {}
+    for repeticion in repeticiones:
+        costes_por_año.setdefault(repeticion['fecha'].year, []).append(repeticion['coste'] or 0)
+    resumen_anual = [
+        {'año': año, 'servicios': len(costes), 'coste': sum(costes)}
+        for año, costes in sorted(costes_por_año.items())
+    ]
+    
+    return render(request, 'maintenance/vehiculos/plan.html', {
+        'vehiculo': vehiculo,
+        'años': años,
+        'opciones_años': range(1, AÑOS_MAXIMOS + 1),
+        'repeticiones': repeticiones,
+        'resumen_anual': resumen_anual,
+        'coste_total': sum(fila['coste'] for fila in resumen_anual),
+    })
+
+
 # ========== VISTAS DE MANTENIMIENTO ==========
 
 @login_required
@@ -131,7 +180,7 @@ def lista_mantenimientos(request):
     
     mantenimientos = RegistroMantenimiento.objects.filter(
         vehiculo__propietario=request.user
-    ).select_related('vehiculo').prefetch_related('items__tipo_mantenimiento')
+    ).select_related('vehiculo')
     
     if filtro_form.is_valid():
         vehiculo = filtro_form.cleaned_data.get('vehiculo')
@@ -227,43 +276,15 @@ def detalle_mantenimiento(request, mantenimiento_id):
     # Obtener ítems del mantenimiento
     items = mantenimiento.items.all().select_related('tipo_mantenimiento')
     
-    # Calcular próximos mantenimientos para cada tipo
-    proximo_km = None
-    proxima_fecha = None
-    tipos_realizados = []
+    tipos_realizados = [item.tipo_mantenimiento for item in items]
     
-    for item in items:
-        tipo_mant = item.tipo_mantenimiento
-        tipos_realizados.append(tipo_mant)
-        
-        # Buscar intervalo personalizado del usuario para este vehículo y tipo
-        from .models import IntervaloMantenimiento
-        intervalo_personalizado = IntervaloMantenimiento.objects.filter(
-            vehiculo=mantenimiento.vehiculo,
-            tipo_mantenimiento=tipo_mant
-        ).first()
-        
-        # Usar intervalo personalizado o el por defecto del tipo
-        if intervalo_personalizado:
-            # Si hay personalización y el valor es > 0, usarlo; sino usar el por defecto
-            intervalo_km = intervalo_personalizado.intervalo_km_personalizado if intervalo_personalizado.intervalo_km_personalizado > 0 else (tipo_mant.intervalo_km or 0)
-            intervalo_meses = intervalo_personalizado.intervalo_meses_personalizado if intervalo_personalizado.intervalo_meses_personalizado > 0 else (tipo_mant.intervalo_meses or 0)
-        else:
-            intervalo_km = tipo_mant.intervalo_km or 0
-            intervalo_meses = tipo_mant.intervalo_meses or 0
-        
-        # Calcular próximo mantenimiento por kilometraje
-        if intervalo_km > 0:
-            proximo_km_tipo = mantenimiento.kilometraje_realizacion + intervalo_km
-            if proximo_km is None or proximo_km_tipo < proximo_km:
-                proximo_km = proximo_km_tipo
-        
-        # Calcular próximo mantenimiento por fecha
-        if intervalo_meses > 0:
-            from dateutil.relativedelta import relativedelta
-            proxima_fecha_tipo = mantenimiento.fecha_realizacion + relativedelta(months=intervalo_meses)
-            if proxima_fecha is None or proxima_fecha_tipo < proxima_fecha:
-                proxima_fecha = proxima_fecha_tipo
+    # Próximos vencimientos del vehículo para los tipos realizados (estado materializado)
+    proximos = EstadoMantenimiento.objects.filter(
+        vehiculo=mantenimiento.vehiculo,
+        tipo_mantenimiento__in=tipos_realizados
+    ).aggregate(proximo_km=Min('proximo_km'), proxima_fecha=Min('proxima_fecha'))
+    proximo_km = proximos['proximo_km']
+    proxima_fecha = proximos['proxima_fecha']
     
     # Calcular kilómetros restantes
     km_restantes = None
@@ -321,11 +342,10 @@ def eliminar_mantenimiento(request, mantenimiento_id):
     )
     
     if request.method == 'POST':
-        items_count = mantenimiento.items.count()
-        if items_count == 1:
-            nombre_mantenimiento = f"{mantenimiento.items.first().tipo_mantenimiento.nombre} - {mantenimiento.vehiculo}"
+        if mantenimiento.numero_items == 1:
+            nombre_mantenimiento = f"{mantenimiento.resumen_trabajos} - {mantenimiento.vehiculo}"
         else:
-            nombre_mantenimiento = f"Mantenimiento múltiple ({items_count} trabajos) - {mantenimiento.vehiculo}"
+            nombre_mantenimiento = f"Mantenimiento múltiple ({mantenimiento.numero_items} trabajos) - {mantenimiento.vehiculo}"
         mantenimiento.delete()
         messages.success(request, f'Registro de mantenimiento "{nombre_mantenimiento}" eliminado correctamente.')
         return redirect('maintenance:lista_mantenimientos')
@@ -335,101 +355,124 @@ def eliminar_mantenimiento(request, mantenimiento_id):
     })
 
 
+@login_required
+def analitica_gastos(request):
+    """Vista con el gasto en mantenimiento por mes, categoría y vehículo"""
+    vehiculos = Vehiculo.objects.filter(propietario=request.user)
+    
+    try:
+        meses = int(request.GET.get('meses', PERIODO_POR_DEFECTO))
+    except ValueError:
+        meses = PERIODO_POR_DEFECTO
+    if meses not in PERIODOS:
+        meses = PERIODO_POR_DEFECTO
+    
+    vehiculo = None
+    if request.GET.get('vehiculo', '').isdigit():
+        vehiculo = get_object_or_404(vehiculos, id=request.GET['vehiculo'])
+    
+    return render(request, 'maintenance/mantenimientos/gastos.html', {
+        'vehiculos': vehiculos,
+        'vehiculo': vehiculo,
+        'meses': meses,
+        'opciones_meses': PERIODOS,
+        'gastos': gastos_usuario(request.user.id, vehiculo.id if vehiculo else None, meses),
+    })
+
+
 @login_required
 def proximos_mantenimientos(request):
     """Vista para mostrar mantenimientos próximos a vencer"""
-    from .models import IntervaloMantenimiento, TipoMantenimiento
-    from dateutil.relativedelta import relativedelta
-    from datetime import date
-    
     vehiculos = Vehiculo.objects.filter(propietario=request.user)
     mantenimientos_proximos = []
     
-    for vehiculo in vehiculos:
-        # Obtener todos los tipos de mantenimiento aplicables a este vehículo
-        tipos_aplicables = TipoMantenimiento.objects.filter(
-            models.Q(vehiculos_aplicables='todos') | models.Q(vehiculos_aplicables=vehiculo.tipo),
-            activo=True
-        ).filter(
-            models.Q(intervalo_km__gt=0) | models.Q(intervalo_meses__gt=0)
-        )
-        
-        for tipo_mant in tipos_aplicables:
-            # Buscar el último mantenimiento de este tipo
-            ultimo_registro = RegistroMantenimiento.objects.filter(
-                vehiculo=vehiculo,
-                items__tipo_mantenimiento=tipo_mant
-            ).order_by('-fecha_realizacion').first()
-            
-            if ultimo_registro:
-                # Buscar intervalo personalizado
-                intervalo_personalizado = IntervaloMantenimiento.objects.filter(
-                    vehiculo=vehiculo,
-                    tipo_mantenimiento=tipo_mant
-                ).first()
-                
-                # Determinar intervalos a usar
-                if intervalo_personalizado:
-                    intervalo_km = intervalo_personalizado.intervalo_km_personalizado if intervalo_personalizado.intervalo_km_personalizado > 0 else tipo_mant.intervalo_km
-                    intervalo_meses = intervalo_personalizado.intervalo_meses_personalizado if intervalo_personalizado.intervalo_meses_personalizado > 0 else tipo_mant.intervalo_meses
-                else:
-                    intervalo_km = tipo_mant.intervalo_km or 0
-                    intervalo_meses = tipo_mant.intervalo_meses or 0
-                
-                # Calcular próximos vencimientos
-                proximo_km = None
-                proxima_fecha = None
-                es_proximo = False
-                mensaje = ""
-                
-                if intervalo_km > 0:
-                    proximo_km = ultimo_registro.kilometraje_realizacion + intervalo_km
-                    km_restantes = proximo_km - vehiculo.kilometraje_actual
-                    
-                    if km_restantes <= 1000:  # Próximo si faltan 1000 km o menos
-                        es_proximo = True
-                        if km_restantes <= 0:
-                            mensaje = f"¡Ya es hora del mantenimiento! (Pasado por {abs(km_restantes):.0f} km)"
-                        else:
-                            mensaje = f"Próximo mantenimiento en {km_restantes:.0f} km"
-                
-                if intervalo_meses > 0:
-                    proxima_fecha = ultimo_registro.fecha_realizacion + relativedelta(months=intervalo_meses)
-                    dias_restantes = (proxima_fecha - date.today()).days
-                    
-                    if dias_restantes <= 30:  # Próximo si faltan 30 días o menos
-                        es_proximo = True
-                        if dias_restantes <= 0:
-                            mensaje += f" ¡Ya es hora del mantenimiento! (Pasado por {abs(dias_restantes)} días)"
-                        else:
-                            if mensaje:
-                                mensaje += f" o en {dias_restantes} días"
-                            else:
-                                mensaje = f"Próximo mantenimiento en {dias_restantes} días"
-                
-                if es_proximo:
-                    mantenimientos_proximos.append({
-                        'tipo_mantenimiento': tipo_mant,
-                        'ultimo_registro': ultimo_registro,
-                        'vehiculo': vehiculo,
-                        'proximo_km': proximo_km,
-                        'proxima_fecha': proxima_fecha,
-                        'mensaje': mensaje,
-                        'km_restantes': proximo_km - vehiculo.kilometraje_actual if proximo_km else None,
-                        'dias_restantes': (proxima_fecha - date.today()).days if proxima_fecha else None,
-                    })
-    
-    # Ordenar por prioridad (primero los más urgentes)
-    mantenimientos_proximos.sort(key=lambda x: (
-        x['km_restantes'] if x['km_restantes'] is not None else 999999,
-        x['dias_restantes'] if x['dias_restantes'] is not None else 999999
-    ))
+    for vencimiento in ordenar_por_prioridad(obtener_vencimientos(vehiculos)):
+        mantenimientos_proximos.append({
+            'tipo_mantenimiento': vencimiento.tipo_mantenimiento,
+            'ultimo_registro': vencimiento.ultimo_registro,
+            'vehiculo': vencimiento.vehiculo,
+            'proximo_km': vencimiento.proximo_km,
+            'proxima_fecha': vencimiento.proxima_fecha,
+            'fecha_prevista_km': vencimiento.fecha_prevista_km,
+            'mensaje': describir_vencimiento(vencimiento),
+            'km_restantes': vencimiento.km_restantes,
+            'dias_restantes': vencimiento.dias_restantes,
+        })
     
     return render(request, 'maintenance/mantenimientos/proximos.html', {
         'mantenimientos_proximos': mantenimientos_proximos
     })
 
 
+@staff_member_required
+def operaciones_vencimientos(request):
+    """Vista de operaciones: vencimientos de todos los vehículos de todas las cuentas"""
+    try:
+        dias = max(int(request.GET.get('dias', 30)), 0)
+    except ValueError:
+        dias = 30
+    try:
+        km = int(request.GET['km']) if request.GET.get('km') else None
+    except ValueError:
+        km = None
+    
+    paginator = Paginator(vencimientos_flota(dias, km=km), 50)
+    pagina = paginator.get_page(request.GET.get('page'))
+    
+    return render(request, 'maintenance/operaciones/vencimientos.html', {
+        'pagina': pagina,
+        'dias': dias,
+        'km': km,
+        'hoy': date.today(),
+    })
+
+
+def _datos_calendario(request, token):
+    """(usuario_id, vehiculo_id, versión) del token, resueltos una sola vez por petición"""
+    if not hasattr(request, '_datos_calendario'):
+        datos = leer_token(token)
+        if datos is not None:
+            datos = (*datos, version_usuario(datos[0]))
+        request._datos_calendario = datos
+    return request._datos_calendario
+
+
+def _etag_calendario(request, token):
+    datos = _datos_calendario(request, token)
+    return f'{datos[2]}-{datos[1] or 0}' if datos else None
+
+
+def _ultima_modificacion_calendario(request, token):
+    datos = _datos_calendario(request, token)
+    return ultima_modificacion(datos[2]) if datos else None
+
+
+@require_GET
+@condition(etag_func=_etag_calendario, last_modified_func=_ultima_modificacion_calendario)
+def calendario_ics(request, token):
+    """Feed iCalendar de próximos mantenimientos; el token firmado sustituye al inicio de sesión"""
+    datos = _datos_calendario(request, token)
+    if datos is None:
+        raise Http404('Calendario no encontrado')
+    usuario_id, vehiculo_id, _ = datos
+    
+    response = HttpResponse(ics_cacheado(usuario_id, vehiculo_id), content_type='text/calendar; charset=utf-8')
+    response['Content-Disposition'] = 'inline; filename="mantenimientos.ics"'
+    return response
+
+
+@login_required
+@require_POST
+def renovar_calendario(request):
+    """Renueva la clave de los enlaces de calendario del usuario, revocando los anteriores"""
+    ClaveCalendario.renovar(request.user.id)
+    messages.success(request, 'Enlaces de calendario renovados. Los enlaces anteriores ya no funcionan.')
+    vehiculo = Vehiculo.objects.filter(id=request.POST.get('vehiculo_id') or None, propietario=request.user).first()
+    if vehiculo:
+        return redirect('maintenance:detalle_vehiculo', vehiculo_id=vehiculo.id)
+    return redirect('maintenance:inicio')
+
+
 @login_required
 def get_tipos_mantenimiento_json(request):
     """API para obtener tipos de mantenimiento según el vehículo"""
@@ -439,10 +482,7 @@ def get_tipos_mantenimiento_json(request):
     
     try:
         vehiculo = Vehiculo.objects.get(id=vehiculo_id, propietario=request.user)
-        tipos = TipoMantenimiento.objects.filter(
-            Q(vehiculos_aplicables='todos') | Q(vehiculos_aplicables=vehiculo.tipo),
-            activo=True
-        ).order_by('categoria', 'nombre')
+        tipos = obtener_catalogo().aplicables(vehiculo)
         
         # Agrupar por categorías
         tipos_agrupados = {}
@@ -477,25 +517,19 @@ def registro_usuario(request):
             # Guardar la solicitud de registro
             solicitud = form.save()
             
-            # Enviar email de notificación al administrador
-            try:
-                from django.core.mail import send_mail
-                from django.conf import settings
-                from django.contrib.auth.models import User
-                
-                # Obtener email del usuario sa (administrador)
-                try:
-                    admin_user = User.objects.get(username='sa')
-                    admin_email = admin_user.email
-                    # Si el usuario sa no tiene email configurado, usar el de configuración
-                    if not admin_email:
-                        admin_email = settings.ADMIN_EMAIL
-                except User.DoesNotExist:
-                    # Si no existe usuario sa, usar email de configuración
-                    admin_email = settings.ADMIN_EMAIL
-                
-                subject = f'[Wheeler Keeper] Nueva solicitud de registro - {solicitud.username}'
-                message = f"""
+            # Encolar el email de notificación al administrador: la respuesta
+            # no espera al servidor SMTP
+            from django.conf import settings
+            from django.contrib.auth.models import User
+            
+            # Obtener email del usuario sa (administrador)
+            admin_email = User.objects.filter(username='sa').values_list('email', flat=True).first()
+            # Si no existe el usuario sa o no tiene email configurado, usar el de configuración
+            if not admin_email:
+                admin_email = settings.ADMIN_EMAIL
+            
+            subject = f'[Wheeler Keeper] Nueva solicitud de registro - {solicitud.username}'
+            message = f"""
 Hola Administrador,
 
 Se ha recibido una nueva solicitud de registro en Wheeler Keeper.
@@ -511,19 +545,9 @@ Para revisar y aprobar/rechazar esta solicitud, accede al panel de administraci
 
 ¡Saludos!
 Wheeler Keeper
-                """
-                
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[admin_email],
-                    fail_silently=False,
-                )
-                
-            except Exception as e:
-                # Si falla el envío del email, log del error pero continúa
-                print(f"Error enviando email de notificación: {e}")
+            """
+            
+            encolar_correo(admin_email, subject, message)
             
             messages.success(
                 request, 
@@ -561,7 +585,8 @@ def gestionar_intervalos(request, vehiculo_id):
     vehiculo = get_object_or_404(Vehiculo, id=vehiculo_id, propietario=request.user)
     
     # Obtener todos los tipos de mantenimiento
-    tipos_mantenimiento = TipoMantenimiento.objects.all().order_by('categoria', 'nombre')
+    catalogo = obtener_catalogo()
+    tipos_mantenimiento = catalogo.todos
     
     # Obtener intervalos personalizados existentes
     intervalos_existentes = IntervaloMantenimiento.objects.filter(vehiculo=vehiculo)
@@ -598,7 +623,9 @@ def gestionar_intervalos(request, vehiculo_id):
                     intervalos_dict[tipo_id].delete()
             else:
                 # Crear o actualizar el intervalo personalizado
-                tipo_mantenimiento = get_object_or_404(TipoMantenimiento, id=tipo_id)
+                tipo_mantenimiento = catalogo.get(tipo_id)
+                if tipo_mantenimiento is None:
+                    raise Http404('Tipo de mantenimiento no encontrado')
                 intervalo, created = IntervaloMantenimiento.objects.update_or_create(
                     vehiculo=vehiculo,
                     tipo_mantenimiento=tipo_mantenimiento,
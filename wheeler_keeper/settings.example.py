@@ -105,6 +105,34 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Debe ser compartida entre procesos: guarda la versión de datos de cada usuario
+# con la que se invalidan los resúmenes cacheados (por defecto, en la propia BD;
+# la tabla la crea `migrate` y también `python manage.py createcachetable`).
+# LocMemCache sólo sirve con un único proceso.
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': config('CACHE_LOCATION', default='wheeler_keeper_cache'),
+    }
+}
+
+# Número máximo de entradas de la caché LRU en memoria de cada proceso
+WHEELER_CACHE_LRU_ENTRADAS = config('WHEELER_CACHE_LRU_ENTRADAS', default=1024, cast=int)
+
+# Segundos durante los que cada proceso reutiliza la versión de datos de un usuario
+# sin consultar la caché compartida (0 = comprobarla en cada lectura)
+WHEELER_CACHE_COMPROBACION_VERSION = config('WHEELER_CACHE_COMPROBACION_VERSION', default=2, cast=int)
+
+# Segundos entre comprobaciones de la versión del catálogo de tipos de mantenimiento
+WHEELER_CATALOGO_COMPROBACION = config('WHEELER_CATALOGO_COMPROBACION', default=10, cast=int)
+
+# Encolar el aviso de un usuario en cuanto un cambio hace que un mantenimiento cruce un umbral
+WHEELER_AVISOS_INMEDIATOS = config('WHEELER_AVISOS_INMEDIATOS', default=True, cast=bool)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -164,5 +192,14 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='Wheeler Keeper <noreply@wheelerkeepr.com>')
 
+# Conexiones SMTP simultáneas al enviar cada lote de emails (1 = en serie)
+WHEELER_EMAIL_SESIONES_SMTP = config('WHEELER_EMAIL_SESIONES_SMTP', default=1, cast=int)
+
+# Canales de aviso distintos del email: peticiones de webhook simultáneas, timeout
+# por petición y directorio donde se escriben los ficheros NDJSON
+WHEELER_WEBHOOK_PARALELISMO = config('WHEELER_WEBHOOK_PARALELISMO', default=8, cast=int)
+WHEELER_WEBHOOK_TIMEOUT = config('WHEELER_WEBHOOK_TIMEOUT', default=10, cast=float)
+WHEELER_CANALES_DIRECTORIO = config('WHEELER_CANALES_DIRECTORIO', default=str(BASE_DIR / 'avisos'))
+
 # Admin Email (para notificaciones) - Se configura desde variables de entorno
 ADMIN_EMAIL = config('ADMIN_EMAIL', default='admin@example.com')
\ No newline at end of file